@@ -0,0 +1,124 @@
+from servicetime import ServiceTime
+import heapq
+import logging
+
+
+class TripRecord(object):
+    """"Last accepted update of an active trip. day is the day of year of the trip's service day, segment and
+        distance are its last match on the shape, lat and lon the last reported position."""
+    __slots__ = ('trip_id', 'progress', 'timestamp', 'day', 'segment', 'distance', 'lat', 'lon')
+
+    def __init__(self, trip_id, progress, timestamp, day, segment=None, distance=None, lat=None, lon=None):
+        self.trip_id = trip_id
+        self.progress = progress
+        self.timestamp = timestamp
+        self.day = day
+        self.segment = segment
+        self.distance = distance
+        self.lat = lat
+        self.lon = lon
+
+
+class ActiveTrips:
+    """"Trips seen in the last INACTIVE_AFTER seconds of feed time, keyed by trip_id. A heap of (timestamp, trip_id)
+        orders the trips by their last update, so clean_inactive_trips touches only the expired ones. An update
+        pushes a new heap entry and leaves the old one behind, stale entries are skipped when they reach the top and
+        the heap is rebuilt once they outnumber the trips."""
+    INACTIVE_AFTER = 7200
+    MIN_COMPACT_SIZE = 1024
+
+    def __init__(self, time_zone=None):
+        """"time_zone of the agency for the service day of new trips, local time by default."""
+        self.time_zone = time_zone
+        self.service_time = ServiceTime(time_zone)
+        self.trips = {}
+        self._expiry = []
+
+    def __len__(self):
+        return len(self.trips)
+
+    def __contains__(self, trip_id):
+        return trip_id in self.trips
+
+    def get(self, trip_id):
+        """"TripRecord of an active trip or None."""
+        return self.trips.get(trip_id)
+
+    def is_trip_active(self, trip_id):
+        return trip_id in self.trips
+
+    def get_trip_progress(self, trip_id):
+        record = self.trips.get(trip_id)
+        return record.progress if record is not None else None
+
+    def get_day_for_trip(self, trip_id):
+        record = self.trips.get(trip_id)
+        return record.day if record is not None else None
+
+    def get_timestamp_for_trip(self, trip_id):
+        record = self.trips.get(trip_id)
+        return record.timestamp if record is not None else None
+
+    def get_last_segment(self, trip_id):
+        """"Shape segment the trip was matched to in its last update."""
+        record = self.trips.get(trip_id)
+        return record.segment if record is not None else None
+
+    def get_last_distance(self, trip_id):
+        record = self.trips.get(trip_id)
+        return record.distance if record is not None else None
+
+    def get_last_position(self, trip_id):
+        """"(lat, lon) of the last update or None."""
+        record = self.trips.get(trip_id)
+        return (record.lat, record.lon) if record is not None and record.lat is not None else None
+
+    def add_update_trip(self, trip_id, timestamp, progress, segment=None, distance=None, lat=None, lon=None,
+                        day=None):
+        """"Returns the TripRecord of the trip. A new trip gets day, by default the day of year of the service day
+            the timestamp falls into."""
+        record = self.trips.get(trip_id)
+        if record is None:
+            if day is None:
+                day = int(self.service_time.get_day_of_year(self.service_time.get_seconds([timestamp])[1])[0])
+            record = self.trips[trip_id] = TripRecord(trip_id, progress, timestamp, day)
+            moved = True
+        else:
+            moved = record.timestamp != timestamp
+        record.progress = progress
+        record.timestamp = timestamp
+        record.segment = segment
+        record.distance = distance
+        record.lat = lat
+        record.lon = lon
+        if moved:
+            heapq.heappush(self._expiry, (timestamp, trip_id))
+            if len(self._expiry) > max(2 * len(self.trips), self.MIN_COMPACT_SIZE):
+                self._compact()
+        return record
+
+    def add_record(self, record):
+        """"Puts back a TripRecord saved earlier, e.g. by a checkpoint."""
+        self.trips[record.trip_id] = record
+        heapq.heappush(self._expiry, (record.timestamp, record.trip_id))
+
+    def clear(self):
+        self.trips.clear()
+        self._expiry = []
+
+    def clean_inactive_trips(self, timestamp):
+        """"Non-active trips are removed after 2 hours. Returns the number of removed trips."""
+        cnt = 0
+        expiry = self._expiry
+        while expiry and timestamp - expiry[0][0] > self.INACTIVE_AFTER:
+            last_update, trip_id = heapq.heappop(expiry)
+            record = self.trips.get(trip_id)
+            if record is not None and record.timestamp == last_update:
+                del self.trips[trip_id]
+                cnt += 1
+        logging.info("{} trips are no longer active".format(cnt))
+        return cnt
+
+    def _compact(self):
+        self._expiry = [(record.timestamp, trip_id) for trip_id, record in self.trips.items()]
+        heapq.heapify(self._expiry)
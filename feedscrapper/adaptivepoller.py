@@ -0,0 +1,70 @@
+from collections import deque
+import numpy as np
+
+MIN_INTERVAL = 1
+BACKOFF_LIMIT = 4
+
+
+class AdaptivePoller:
+    """"Learns when a feed is regenerated and times the fetches just after it. The regeneration period is the
+        median difference of consecutive header.timestamps, the phase comes from the last header.timestamp and the
+        lag between it and the fetch that returned it, which covers the publishing delay and the clock skew.
+        Every lag is an upper bound of the publishing delay, a fetch made late only adds its lateness, so the
+        smallest recent one is used. The first fetch of a period is made MARGIN seconds before the feed is expected,
+        when it is too early the feed is unchanged and the retry after RETRY_DELAY seconds brings the lag down, so
+        the lateness of the fetches doesn't feed back into the estimate. Until MIN_SAMPLES periods are seen the fixed
+        interval is used. RETRY_DELAY doubles with every unchanged fetch. Delays stay within min_interval and
+        max_interval, BACKOFF_LIMIT times the interval by default."""
+    WINDOW = 20
+    MIN_SAMPLES = 3
+    MARGIN = 1.0
+    RETRY_DELAY = 1.0
+
+    def __init__(self, interval, min_interval=None, max_interval=None):
+        self.interval = interval
+        self.min_interval = min_interval or MIN_INTERVAL
+        self.max_interval = max_interval or interval * BACKOFF_LIMIT
+        self.last_timestamp = None
+        self.unchanged = 0
+        self._periods = deque(maxlen=self.WINDOW)
+        self._lags = deque(maxlen=self.WINDOW)
+
+        self.polls = 0
+        self.unchanged_polls = 0
+
+    def observe(self, fetch_time, feed_timestamp):
+        """"feed_timestamp is the header.timestamp of a new feed, None when the feed hasn't changed."""
+        self.polls += 1
+        if not feed_timestamp:
+            self.unchanged += 1
+            self.unchanged_polls += 1
+            return
+        self.unchanged = 0
+        if self.last_timestamp is not None and feed_timestamp > self.last_timestamp:
+            self._periods.append(feed_timestamp - self.last_timestamp)
+        self._lags.append(max(fetch_time - feed_timestamp, 0))
+        self.last_timestamp = feed_timestamp
+
+    def get_period(self):
+        """"Learned regeneration period or None."""
+        if len(self._periods) < self.MIN_SAMPLES:
+            return None
+        return float(np.median(self._periods))
+
+    def get_lag(self):
+        return float(min(self._lags)) if self._lags else 0.0
+
+    def get_delay(self, now):
+        """"Seconds to wait before the next fetch."""
+        period = self.get_period()
+        if period is None:
+            delay = self.interval
+        elif self.unchanged:
+            delay = self.RETRY_DELAY * 2 ** (self.unchanged - 1)
+        else:
+            delay = self.last_timestamp + period + self.get_lag() - self.MARGIN - now
+        return min(max(delay, self.min_interval), self.max_interval)
+
+    def get_stats(self):
+        return {'period': self.get_period(), 'lag': self.get_lag(), 'polls': self.polls,
+                'unchanged_polls': self.unchanged_polls}
@@ -0,0 +1,191 @@
+import argparse
+import logging
+import os
+import sqlite3
+import numpy as np
+from partitioneddb import PartitionedDbManager, PERIODS
+
+ARCHIVE_EXT = '.npz'
+FORMAT_VERSION = 1
+ROW_GROUP_SIZE = 100000
+COLUMNS = ('route_id', 'trip_id', 'time', 'day', 'stop_seq', 'stop_progress', 'delay_sec', 'progress')
+DICTIONARY_COLUMNS = ('route_id', 'trip_id')
+# stored dtypes, progress values are kept with float32 precision
+DTYPES = {'day': np.int16, 'stop_seq': np.int16, 'stop_progress': np.float32, 'delay_sec': np.int32,
+          'progress': np.float32}
+
+
+def export_log(db_file, archive_path, row_group_size=ROW_GROUP_SIZE):
+    """"Writes vehicle_log of a closed db file to a compressed columnar archive ordered by time. Rows are read and
+        encoded in groups of row_group_size: route_id and trip_id are stored as codes to a dictionary shared by all
+        groups, time as the first value of the group followed by deltas. Returns the number of rows."""
+    conn = sqlite3.connect(db_file)
+    try:
+        cursor = conn.execute("SELECT {} FROM vehicle_log ORDER BY time".format(', '.join(COLUMNS)))
+        dictionaries = dict((name, {}) for name in DICTIONARY_COLUMNS)
+        arrays = {}
+        num_groups = 0
+        num_rows = 0
+        while True:
+            rows = cursor.fetchmany(row_group_size)
+            if not rows:
+                break
+            columns = zip(*rows)
+            prefix = _group_prefix(num_groups)
+            for name, values in zip(COLUMNS, columns):
+                if name in DICTIONARY_COLUMNS:
+                    arrays[prefix + name] = _encode_dictionary(values, dictionaries[name])
+                elif name == 'time':
+                    times = np.array(values, dtype=np.int64)
+                    arrays[prefix + 'time_base'] = times[:1]
+                    arrays[prefix + 'time_delta'] = np.diff(times).astype(np.int32)
+                else:
+                    arrays[prefix + name] = np.array(values, dtype=DTYPES[name])
+            num_groups += 1
+            num_rows += len(rows)
+    finally:
+        conn.close()
+
+    for name in DICTIONARY_COLUMNS:
+        values = sorted(dictionaries[name], key=dictionaries[name].get)
+        arrays['dict_' + name] = np.array([value.encode('utf-8') for value in values], dtype=np.string_)
+    arrays['header'] = np.array([FORMAT_VERSION, num_groups, num_rows], dtype=np.int64)
+    tmp_path = archive_path + '.tmp' + ARCHIVE_EXT
+    np.savez_compressed(tmp_path, **arrays)
+    os.rename(tmp_path, archive_path)
+    return num_rows
+
+
+def export_partitions(db_file, archive_dir, time_zone=None, period=PERIODS[0], overwrite=False):
+    """"Archives the closed partitions of a partitioned log. The live partition and the previous one, which is kept
+        open for late rows, aren't indexed yet and are skipped. Late rows can still be written to a closed partition,
+        so an archive is written again when the number of its rows differs from the partition's, otherwise
+        partitions already in archive_dir are skipped unless overwrite is set. Returns paths of the written
+        archives."""
+    db_manager = PartitionedDbManager(db_file, time_zone, period)
+    if not os.path.isdir(archive_dir):
+        os.makedirs(archive_dir)
+    written = []
+    for key in db_manager.list_partitions():
+        if not db_manager.is_closed(key):
+            continue
+        db_path = db_manager.get_partition_path(key)
+        archive_path = os.path.join(archive_dir, os.path.basename(db_manager.base) + '.' + key + ARCHIVE_EXT)
+        if os.path.isfile(archive_path) and not overwrite and _get_archived_rows(archive_path) == _count_rows(db_path):
+            continue
+        num_rows = export_log(db_path, archive_path)
+        logging.info("Archived {} rows of partition {} to {}".format(num_rows, key, archive_path))
+        written.append(archive_path)
+    return written
+
+
+class ArchiveReader:
+    """"Reads an archive written by export_log one row group at a time. Columns come back as numpy arrays, route_id and
+        trip_id as int32 codes to the route_ids and trip_ids dictionaries unless decoded."""
+
+    def __init__(self, archive_path):
+        self.archive = np.load(archive_path)
+        format_version, self.num_groups, self.num_rows = self.archive['header'].tolist()
+        if format_version != FORMAT_VERSION:
+            raise ValueError("Unsupported archive version {}".format(format_version))
+        self.dictionaries = dict((name, self.archive['dict_' + name]) for name in DICTIONARY_COLUMNS)
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def route_ids(self):
+        return self.dictionaries['route_id']
+
+    @property
+    def trip_ids(self):
+        return self.dictionaries['trip_id']
+
+    def iter_row_groups(self, columns=COLUMNS, decode=False):
+        """"Yields a dict of column arrays for every row group."""
+        for group in range(self.num_groups):
+            yield self.read_row_group(group, columns, decode)
+
+    def read_row_group(self, group, columns=COLUMNS, decode=False):
+        prefix = _group_prefix(group)
+        result = {}
+        for name in columns:
+            if name == 'time':
+                base = self.archive[prefix + 'time_base']
+                deltas = self.archive[prefix + 'time_delta']
+                result[name] = np.concatenate((base, base[0] + np.cumsum(deltas, dtype=np.int64)))
+            elif name in DICTIONARY_COLUMNS and decode:
+                result[name] = self.dictionaries[name][self.archive[prefix + name]]
+            else:
+                result[name] = self.archive[prefix + name]
+        return result
+
+    def read(self, columns=COLUMNS, decode=False):
+        """"All row groups concatenated."""
+        groups = list(self.iter_row_groups(columns, decode))
+        if not groups:
+            return dict((name, np.zeros(0)) for name in columns)
+        return dict((name, np.concatenate([group[name] for group in groups])) for name in columns)
+
+    def close(self):
+        self.archive.close()
+
+
+def read_archives(archive_paths, columns=COLUMNS):
+    """"Concatenates several archives, route_id and trip_id are decoded to strings because dictionaries differ
+        between archives."""
+    parts = []
+    for archive_path in archive_paths:
+        reader = ArchiveReader(archive_path)
+        try:
+            parts.append(reader.read(columns, decode=True))
+        finally:
+            reader.close()
+    if not parts:
+        return dict((name, np.zeros(0)) for name in columns)
+    return dict((name, np.concatenate([part[name] for part in parts])) for name in columns)
+
+
+def _count_rows(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM vehicle_log").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _get_archived_rows(archive_path):
+    reader = ArchiveReader(archive_path)
+    try:
+        return reader.num_rows
+    finally:
+        reader.close()
+
+
+def _group_prefix(group):
+    return "g{:05d}_".format(group)
+
+
+def _encode_dictionary(values, dictionary):
+    """"Returns int32 codes of the values, new values are added to the dictionary mapping a value to its code."""
+    uniques, inverse = np.unique(np.array(values, dtype=object), return_inverse=True)
+    codes = np.array([dictionary.setdefault(value, len(dictionary)) for value in uniques], dtype=np.int32)
+    return codes[inverse]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Exports vehicle_log to compressed columnar archives.')
+    parser.add_argument('--sqliteDb', help='Database file, with --partition the base name of its partitions',
+                        required=True)
+    parser.add_argument('--archiveDir', help='Output directory', required=True)
+    parser.add_argument('--partition', help='Period of the partitions', choices=PERIODS, required=False)
+    parser.add_argument('--overwrite', help='Export again already archived partitions', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.partition is not None:
+        export_partitions(args.sqliteDb, args.archiveDir, period=args.partition, overwrite=args.overwrite)
+    else:
+        if not os.path.isdir(args.archiveDir):
+            os.makedirs(args.archiveDir)
+        name = os.path.splitext(os.path.basename(args.sqliteDb))[0] + ARCHIVE_EXT
+        print export_log(args.sqliteDb, os.path.join(args.archiveDir, name))
@@ -0,0 +1,72 @@
+"""Compares the full protobuf parse followed by get_vehicle_records with the fast wire format decoder.
+
+Run from the feedscrapper directory: python -m benchmark.decodebench"""
+from google.protobuf.internal import api_implementation
+from google.transit import gtfs_realtime_pb2
+from tripbatch import get_vehicle_records
+from wiredecoder import decode_feed
+import argparse
+import random
+import time
+
+STOPS_PER_TRIP_UPDATE = 20
+
+
+def build_feed(num_vehicles, num_trip_updates, seed=0):
+    rnd = random.Random(seed)
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '2.0'
+    feed.header.timestamp = 1517000000
+    for i in range(num_vehicles):
+        entity = feed.entity.add()
+        entity.id = 'v{}'.format(i)
+        vehicle = entity.vehicle
+        vehicle.trip.trip_id = 'trip{}'.format(i)
+        vehicle.trip.route_id = 'route{}'.format(i % 100)
+        vehicle.vehicle.id = 'vehicle{}'.format(i)
+        vehicle.stop_id = 'stop{}'.format(rnd.randrange(5000))
+        vehicle.position.latitude = 42 + rnd.random()
+        vehicle.position.longitude = 24 + rnd.random()
+        vehicle.position.bearing = rnd.uniform(0, 360)
+        vehicle.timestamp = 1517000000 - rnd.randrange(60)
+    for i in range(num_trip_updates):
+        entity = feed.entity.add()
+        entity.id = 't{}'.format(i)
+        entity.trip_update.trip.trip_id = 'trip{}'.format(i)
+        for seq in range(STOPS_PER_TRIP_UPDATE):
+            stop_time_update = entity.trip_update.stop_time_update.add()
+            stop_time_update.stop_sequence = seq
+            stop_time_update.stop_id = 'stop{}'.format(seq)
+            stop_time_update.arrival.delay = rnd.randrange(-60, 300)
+    return feed.SerializeToString()
+
+
+def full_parse(data):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(data)
+    return get_vehicle_records(feed)
+
+
+def time_decoder(func, data, repeat):
+    before = time.time()
+    for i in range(repeat):
+        func(data)
+    return (time.time() - before) / repeat * 1000
+
+
+def run(num_vehicles, num_trip_updates, repeat):
+    data = build_feed(num_vehicles, num_trip_updates)
+    print "protobuf implementation {}, feed {} bytes".format(api_implementation.Type(), len(data))
+    full = time_decoder(full_parse, data, repeat)
+    fast = time_decoder(lambda content: decode_feed(content).records, data, repeat)
+    print "{:>12} {:>12} {:>8}".format("full ms", "fast ms", "speedup")
+    print "{:>12.1f} {:>12.1f} {:>8.2f}".format(full, fast, full / fast)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Feed decoder benchmark.')
+    parser.add_argument('--vehicles', help='Number of vehicle entities', type=int, default=10000)
+    parser.add_argument('--tripUpdates', help='Number of trip update entities', type=int, default=10000)
+    parser.add_argument('--repeat', help='Number of decoded feeds', type=int, default=5)
+    args = parser.parse_args()
+    run(args.vehicles, args.tripUpdates, args.repeat)
@@ -0,0 +1,69 @@
+"""Compares vehicle projection with and without the shape segment index for growing shape lengths.
+
+Run from the feedscrapper directory: python -m benchmark.indexbench"""
+from geometrycache import ShapeGeometry
+from transitfeed import Point
+from utils import TripState, project_on_shape, project_on_shape_vectorized
+import argparse
+import math
+import random
+import time
+
+SHAPE_LENGTHS = (100, 500, 1000, 2500, 5000)
+STEP_METERS = 30
+
+
+def build_shape(num_points, seed=0):
+    """"Random walk starting in Plovdiv with STEP_METERS long steps and a slowly changing heading."""
+    rnd = random.Random(seed)
+    lat, lng, heading = 42.14, 24.79, 0
+    points = []
+    for i in range(num_points):
+        points.append((lat, lng))
+        heading += rnd.uniform(-0.3, 0.3)
+        lat += math.degrees(STEP_METERS * math.cos(heading) / 6371010.0)
+        lng += math.degrees(STEP_METERS * math.sin(heading) / 6371010.0 / math.cos(math.radians(lat)))
+    return points
+
+
+def build_vehicles(points, count, seed=1):
+    rnd = random.Random(seed)
+    vehicles = []
+    for i in range(count):
+        lat, lng = points[rnd.randrange(len(points))]
+        vehicles.append(Point.FromLatLng(lat + rnd.uniform(-3e-4, 3e-4), lng + rnd.uniform(-3e-4, 3e-4)))
+    return vehicles
+
+
+def time_queries(func, vehicles):
+    before = time.time()
+    for vehicle in vehicles:
+        func(vehicle)
+    return (time.time() - before) / len(vehicles) * 1e6
+
+
+def run(num_vehicles):
+    print "{:>8} {:>14} {:>14} {:>8} {:>14} {:>14} {:>8}".format(
+        "points", "python us", "indexed us", "speedup", "numpy us", "indexed us", "speedup")
+    error = TripState.VEHICLE_ERROR
+    for num_points in SHAPE_LENGTHS:
+        geometry = ShapeGeometry('bench', build_shape(num_points))
+        geometry.get_index()
+        geometry.get_arrays()
+        vehicles = build_vehicles(build_shape(num_points), num_vehicles)
+        full = time_queries(lambda pt: project_on_shape(geometry, pt, error, -0.1, float("inf")), vehicles)
+        indexed = time_queries(lambda pt: project_on_shape(geometry, pt, error, -0.1, float("inf"), 0,
+                                                           geometry.get_index().query(pt, error)), vehicles)
+        vect = time_queries(lambda pt: project_on_shape_vectorized(geometry, pt, error, -0.1, float("inf")), vehicles)
+        vect_indexed = time_queries(lambda pt: project_on_shape_vectorized(geometry, pt, error, -0.1, float("inf"), 0,
+                                                                           geometry.get_index().query(pt, error)),
+                                    vehicles)
+        print "{:>8} {:>14.1f} {:>14.1f} {:>8.1f} {:>14.1f} {:>14.1f} {:>8.1f}".format(
+            num_points, full, indexed, full / indexed, vect, vect_indexed, vect / vect_indexed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Segment index benchmark.')
+    parser.add_argument('--vehicles', help='Number of projected vehicles per shape', type=int, default=200)
+    args = parser.parse_args()
+    run(args.vehicles)
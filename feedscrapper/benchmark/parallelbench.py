@@ -0,0 +1,59 @@
+"""Compares vehicle projection in the main process with ProjectionPool for a growing number of workers.
+
+Run from the feedscrapper directory: python -m benchmark.parallelbench --gtfsZipOrDir feed_path"""
+from compiledschedule import load_schedule
+from parallel import ProjectionPool
+from tripbatch import TripStateBatch, VehicleRecord
+from utils import ENGINES, ENGINE_NUMPY
+import argparse
+import multiprocessing
+import random
+import time
+
+
+def build_records(schedule, count, seed=0):
+    """"Vehicles near random points of the shapes of random trips."""
+    rnd = random.Random(seed)
+    trips = [trip for trip in schedule.GetTripList() if trip.shape_id]
+    records = []
+    for i in range(count):
+        trip = rnd.choice(trips)
+        lat, lng = rnd.choice(schedule.GetShape(trip.shape_id).points)[:2]
+        records.append(VehicleRecord(trip.trip_id, trip.route_id, '', lat + rnd.uniform(-1e-4, 1e-4),
+                                     lng + rnd.uniform(-1e-4, 1e-4), 1517000000))
+    return records
+
+
+def time_cycles(func, records, cycles):
+    func(records)  # warm up geometry caches
+    before = time.time()
+    for i in range(cycles):
+        func(records)
+    return len(records) * cycles / (time.time() - before)
+
+
+def run(gtfs_zip_or_dir, num_vehicles, max_workers, cycles, engine, compiled_dir):
+    schedule = load_schedule(gtfs_zip_or_dir, compiled_dir)
+    records = build_records(schedule, num_vehicles)
+    print "{:>8} {:>16} {:>8}".format("workers", "vehicles/s", "speedup")
+    single = time_cycles(lambda recs: TripStateBatch(schedule, recs, engine), records, cycles)
+    print "{:>8} {:>16.0f} {:>8.2f}".format(0, single, 1)
+    for workers in range(1, max_workers + 1):
+        pool = ProjectionPool(gtfs_zip_or_dir, workers, compiled_dir, engine)
+        try:
+            rate = time_cycles(pool.project, records, cycles)
+        finally:
+            pool.close()
+        print "{:>8} {:>16.0f} {:>8.2f}".format(workers, rate, rate / single)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Projection worker pool benchmark.')
+    parser.add_argument('--gtfsZipOrDir', help='Gtfs zip file or directory', required=True)
+    parser.add_argument('--compiledDir', help='A directory for compiled schedules', required=False)
+    parser.add_argument('--vehicles', help='Number of vehicles in a feed', type=int, default=2000)
+    parser.add_argument('--workers', help='Max number of workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--cycles', help='Number of projected feeds', type=int, default=5)
+    parser.add_argument('--engine', help='Vehicle projection engine', choices=ENGINES, default=ENGINE_NUMPY)
+    args = parser.parse_args()
+    run(args.gtfsZipOrDir, args.vehicles, args.workers, args.cycles, args.engine, args.compiledDir)
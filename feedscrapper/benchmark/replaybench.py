@@ -0,0 +1,127 @@
+"""Replays a feed recording through the scraper pipeline and reports entities/s, per stage latency and peak memory.
+
+Run from the feedscrapper directory: python -m benchmark.replaybench
+Without --recording a recording of vehicles moving along the trips of --gtfsZipOrDir (test/sample-feed by default) is
+generated, record a live feed with recorder.py for realistic numbers."""
+from google.transit import gtfs_realtime_pb2
+from compiledschedule import load_schedule
+from dbmanager import DbManager
+from feedscrapper import ActiveTrips, get_time_zone, process_feed
+from geometrycache import GeometryCache
+from recorder import RecordingWriter, ReplayServer, read_recording
+from snapshotdiff import SnapshotDiff
+from utils import TripState, ENGINES, ENGINE_NUMPY
+from wiredecoder import DECODERS, DECODER_FAST, parse_feed
+import argparse
+import os
+import requests
+import resource
+import shutil
+import tempfile
+import time
+
+STAGES = ('fetch', 'parse', 'project', 'filter', 'write')
+SNAPSHOT_INTERVAL = 30
+
+
+def build_recording(schedule, path, snapshots, start_time=1517000000):
+    """"Vehicles of all trips with shapes moving from the first to the last point of their shape."""
+    trips = [trip for trip in schedule.GetTripList() if trip.shape_id]
+    writer = RecordingWriter(path)
+    for k in range(snapshots):
+        timestamp = start_time + k * SNAPSHOT_INTERVAL
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.header.gtfs_realtime_version = '2.0'
+        feed.header.timestamp = timestamp
+        for trip in trips:
+            points = schedule.GetShape(trip.shape_id).points
+            lat, lng = points[k * (len(points) - 1) // max(snapshots - 1, 1)][:2]
+            entity = feed.entity.add()
+            entity.id = trip.trip_id
+            entity.vehicle.trip.trip_id = trip.trip_id
+            entity.vehicle.trip.route_id = trip.route_id
+            entity.vehicle.position.latitude = lat
+            entity.vehicle.position.longitude = lng
+            entity.vehicle.timestamp = timestamp
+        writer.write(timestamp, feed.SerializeToString())
+    writer.close()
+
+
+def replay(schedule, recording, db_file, decoder=DECODER_FAST, http=True):
+    """"Runs every snapshot of the recording through the pipeline. Snapshots are fetched from a ReplayServer with
+        http, otherwise read from the file. Returns (snapshots, entities, seconds, stage_times)."""
+    active_trips = ActiveTrips(get_time_zone(schedule))
+    geometry_cache = GeometryCache()
+    snapshot_diff = SnapshotDiff()
+    db_manager = DbManager(db_file)
+    stage_times = dict((stage, 0) for stage in STAGES)
+    snapshots = entities = 0
+    server = ReplayServer(recording).start() if http else None
+    session = requests.Session()
+    payloads = None if http else (data for fetch_time, data in read_recording(recording))
+    start = time.time()
+    try:
+        while True:
+            before = time.time()
+            if http:
+                if server.is_finished():
+                    break
+                data = session.get(server.url).content
+            else:
+                data = next(payloads, None)
+                if data is None:
+                    break
+            fetched = time.time()
+            feed = parse_feed(data, decoder)
+            stage_times['fetch'] += fetched - before
+            stage_times['parse'] += time.time() - fetched
+            process_feed(schedule, feed, active_trips, db_manager, geometry_cache, snapshot_diff=snapshot_diff,
+                         stage_times=stage_times)
+            committed = time.time()
+            db_manager.commit()
+            stage_times['write'] += time.time() - committed
+            active_trips.clean_inactive_trips(feed.header.timestamp)
+            snapshots += 1
+            entities += snapshot_diff.changed + snapshot_diff.unchanged + snapshot_diff.new + snapshot_diff.duplicates
+        seconds = time.time() - start
+    finally:
+        db_manager.close_connection()
+        if server is not None:
+            server.stop()
+    return snapshots, entities, seconds, stage_times
+
+
+def run(gtfs_zip_or_dir, recording, snapshots, engine, decoder, http, compiled_dir):
+    TripState.ENGINE = engine
+    schedule = load_schedule(gtfs_zip_or_dir, compiled_dir)
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if recording is None:
+            recording = os.path.join(tmp_dir, 'feed.rec')
+            build_recording(schedule, recording, snapshots)
+        count, entities, seconds, stage_times = replay(schedule, recording, os.path.join(tmp_dir, 'log.db'), decoder,
+                                                       http)
+    finally:
+        shutil.rmtree(tmp_dir)
+    print "snapshots {}, entities {}, {:.1f}s, {:.0f} entities/s, peak memory {:.1f} MB".format(
+        count, entities, seconds, entities / seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0)
+    print "{:>8} {:>12} {:>8}".format("stage", "ms/snapshot", "share")
+    total = sum(stage_times.values())
+    for stage in STAGES:
+        print "{:>8} {:>12.2f} {:>7.1f}%".format(stage, stage_times[stage] / count * 1000,
+                                                 stage_times[stage] / total * 100)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scraper pipeline benchmark on a feed recording.')
+    parser.add_argument('--gtfsZipOrDir', help='Gtfs zip file or directory', default='test/sample-feed')
+    parser.add_argument('--compiledDir', help='A directory for compiled schedules', required=False)
+    parser.add_argument('--recording', help='Recording made by recorder.py', required=False)
+    parser.add_argument('--snapshots', help='Number of generated snapshots', type=int, default=200)
+    parser.add_argument('--engine', help='Vehicle projection engine', choices=ENGINES, default=ENGINE_NUMPY)
+    parser.add_argument('--decoder', help='Realtime feed decoder', choices=DECODERS, default=DECODER_FAST)
+    parser.add_argument('--direct', help='Read snapshots from the file instead of the replay server',
+                        action='store_true')
+    args = parser.parse_args()
+    run(args.gtfsZipOrDir, args.recording, args.snapshots, args.engine, args.decoder, not args.direct,
+        args.compiledDir)
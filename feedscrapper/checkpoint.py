@@ -0,0 +1,126 @@
+from activetrips import TripRecord
+import logging
+import os
+import time
+import numpy as np
+
+FORMAT_VERSION = 1
+CHECKPOINT_INTERVAL = 60
+# float columns hold NaN and segment -1 for missing values
+FLOAT_COLUMNS = ('progress', 'distance', 'lat', 'lon')
+
+
+def save_checkpoint(active_trips, path, feed_timestamp, feed_url=''):
+    """"Writes the TripRecords of active_trips as columns of an npz file. The file is replaced atomically, so a crash
+        while saving leaves the previous checkpoint. Returns the number of saved trips."""
+    records = active_trips.trips.values()
+    arrays = {'trip_id': np.array([record.trip_id.encode('utf-8') for record in records], dtype=np.string_),
+              'timestamp': np.array([record.timestamp for record in records], dtype=np.int64),
+              'day': np.array([record.day for record in records], dtype=np.int16),
+              'segment': np.array([-1 if record.segment is None else record.segment for record in records],
+                                  dtype=np.int64),
+              'header': np.array([FORMAT_VERSION, feed_timestamp, int(time.time())], dtype=np.int64),
+              'feed_url': np.array([feed_url.encode('utf-8')], dtype=np.string_)}
+    for name in FLOAT_COLUMNS:
+        arrays[name] = np.array([_none_to_nan(getattr(record, name)) for record in records], dtype=np.float64)
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.rename(tmp_path, path)
+    return len(records)
+
+
+def load_checkpoint(path):
+    """"Returns (TripRecords, feed timestamp, save time, feed url) of a checkpoint written by save_checkpoint."""
+    with np.load(path) as data:
+        version, feed_timestamp, saved_at = data['header'].tolist()
+        if version != FORMAT_VERSION:
+            raise ValueError("Unsupported checkpoint version {}".format(version))
+        columns = dict((name, data[name]) for name in ('trip_id', 'timestamp', 'day', 'segment') + FLOAT_COLUMNS)
+        feed_url = data['feed_url'][0].decode('utf-8')
+    records = []
+    for i in range(len(columns['trip_id'])):
+        record = TripRecord(columns['trip_id'][i].decode('utf-8'), float(columns['progress'][i]),
+                            int(columns['timestamp'][i]), int(columns['day'][i]))
+        segment = int(columns['segment'][i])
+        record.segment = segment if segment >= 0 else None
+        record.distance, record.lat, record.lon = [_nan_to_none(columns[name][i]) for name in FLOAT_COLUMNS[1:]]
+        records.append(record)
+    return records, feed_timestamp, saved_at, feed_url
+
+
+class Checkpointer:
+    """"Saves the active trips to path every interval seconds and puts them back on start, so trips already under
+        way keep being tracked after a restart. The restored trips are checked against the first feed: they are all
+        dropped if the feed is older than the checkpoint, otherwise the ones inactive by the feed's timestamp."""
+
+    def __init__(self, path, interval=CHECKPOINT_INTERVAL, feed_url=''):
+        self.path = path
+        self.interval = interval
+        self.feed_url = feed_url
+        self.checkpoint_timestamp = None
+        self.last_save = 0
+        self.last_save_seconds = 0
+        self.saves = 0
+        self.restored = 0
+
+    def restore(self, active_trips):
+        """"Loads the checkpoint into active_trips. Returns the number of restored trips."""
+        if not os.path.isfile(self.path):
+            return 0
+        try:
+            records, feed_timestamp, saved_at, feed_url = load_checkpoint(self.path)
+        except (IOError, ValueError, KeyError) as e:
+            logging.warning("Can't read checkpoint {}. {}".format(self.path, e))
+            return 0
+        if feed_url != self.feed_url:
+            logging.warning("Checkpoint {} is of another feed {}".format(self.path, feed_url))
+            return 0
+        for record in records:
+            active_trips.add_record(record)
+        self.checkpoint_timestamp = feed_timestamp
+        self.restored = len(records)
+        logging.info("Restored {} active trips from {} saved {}s ago".format(len(records), self.path,
+                                                                         int(time.time()) - saved_at))
+        return len(records)
+
+    def validate(self, active_trips, feed_timestamp):
+        """"Checks the restored trips against the first feed after restore, later calls do nothing."""
+        if self.checkpoint_timestamp is None:
+            return
+        if feed_timestamp < self.checkpoint_timestamp:
+            logging.warning("Feed timestamp {} is older than the checkpoint {}, dropping the restored trips".format(
+                feed_timestamp, self.checkpoint_timestamp))
+            active_trips.clear()
+        else:
+            expired = active_trips.clean_inactive_trips(feed_timestamp)
+            logging.info("Resuming {} trips after a gap of {}s, {} expired".format(
+                len(active_trips), feed_timestamp - self.checkpoint_timestamp, expired))
+        self.checkpoint_timestamp = None
+
+    def update(self, active_trips, feed_timestamp, now=None):
+        """"Saves the checkpoint if the last one is older than interval."""
+        now = now or time.time()
+        if now - self.last_save >= self.interval:
+            self.save(active_trips, feed_timestamp, now)
+
+    def save(self, active_trips, feed_timestamp, now=None):
+        before = time.time()
+        try:
+            save_checkpoint(active_trips, self.path, feed_timestamp, self.feed_url)
+        except (IOError, OSError) as e:
+            logging.warning("Can't write checkpoint {}. {}".format(self.path, e))
+            return
+        self.last_save = now or time.time()
+        self.last_save_seconds = time.time() - before
+        self.saves += 1
+
+    def get_stats(self):
+        return {'saves': self.saves, 'last_save_seconds': self.last_save_seconds, 'restored': self.restored}
+
+
+def _none_to_nan(value):
+    return np.nan if value is None else value
+
+
+def _nan_to_none(value):
+    return None if np.isnan(value) else float(value)
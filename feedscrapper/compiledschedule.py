@@ -0,0 +1,291 @@
+from datetime import datetime
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import transitfeed
+
+FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+# artifacts of one feed kept in compiled_dir, the current one and the previous one, which may be still in use
+KEEP_ARTIFACTS = 2
+NO_TIME = -1
+NO_SHAPE = -1
+ARRAY_NAMES = ('stop_ids', 'stop_lat', 'stop_lon',
+               'shape_ids', 'shape_offsets', 'shape_lat', 'shape_lon',
+               'trip_ids', 'trip_route_ids', 'trip_shape', 'trip_offsets',
+               'stop_time_stop', 'stop_time_arrival', 'stop_time_departure')
+
+
+def get_feed_hash(gtfs_zip_or_dir):
+    """"SHA-1 of the feed files together with the artifact format version."""
+    sha = hashlib.sha1()
+    sha.update(str(FORMAT_VERSION))
+    if os.path.isdir(gtfs_zip_or_dir):
+        for name in sorted(os.listdir(gtfs_zip_or_dir)):
+            file_path = os.path.join(gtfs_zip_or_dir, name)
+            if os.path.isfile(file_path):
+                sha.update(name)
+                _update_hash(sha, file_path)
+    else:
+        _update_hash(sha, gtfs_zip_or_dir)
+    return sha.hexdigest()
+
+
+def compile_schedule(gtfs_zip_or_dir, compiled_dir, feed_hash=None, keep=KEEP_ARTIFACTS):
+    """"Loads the feed with transitfeed once and stores what the scraper needs as .npy arrays in a directory named by
+        the feed hash. Older artifacts of the same feed are removed, all but the keep newest ones. Returns the path of
+        the artifact."""
+    feed_hash = feed_hash or get_feed_hash(gtfs_zip_or_dir)
+    schedule = transitfeed.Loader(feed_path=gtfs_zip_or_dir, memory_db=False).Load()
+    agency = schedule.GetAgencyList()[0]
+
+    stops = schedule.GetStopList()
+    stop_index = dict((stop.stop_id, i) for i, stop in enumerate(stops))
+    shapes = schedule.GetShapeList()
+    shape_index = dict((shape.shape_id, i) for i, shape in enumerate(shapes))
+    trips = schedule.GetTripList()
+
+    shape_offsets = [0]
+    shape_lat, shape_lon = [], []
+    for shape in shapes:
+        shape_lat.extend(pt[0] for pt in shape.points)
+        shape_lon.extend(pt[1] for pt in shape.points)
+        shape_offsets.append(len(shape_lat))
+
+    trip_offsets = [0]
+    stop_time_stop, stop_time_arrival, stop_time_departure = [], [], []
+    for trip in trips:
+        for arrival, departure, stop in trip.GetTimeStops():
+            stop_time_stop.append(stop_index[stop.stop_id])
+            stop_time_arrival.append(NO_TIME if arrival is None else arrival)
+            stop_time_departure.append(NO_TIME if departure is None else departure)
+        trip_offsets.append(len(stop_time_stop))
+
+    arrays = {
+        'stop_ids': _to_bytes([stop.stop_id for stop in stops]),
+        'stop_lat': np.array([stop.stop_lat for stop in stops], dtype=np.float64),
+        'stop_lon': np.array([stop.stop_lon for stop in stops], dtype=np.float64),
+        'shape_ids': _to_bytes([shape.shape_id for shape in shapes]),
+        'shape_offsets': np.array(shape_offsets, dtype=np.int64),
+        'shape_lat': np.array(shape_lat, dtype=np.float64),
+        'shape_lon': np.array(shape_lon, dtype=np.float64),
+        'trip_ids': _to_bytes([trip.trip_id for trip in trips]),
+        'trip_route_ids': _to_bytes([trip.route_id for trip in trips]),
+        'trip_shape': np.array([shape_index.get(trip.shape_id, NO_SHAPE) for trip in trips], dtype=np.int32),
+        'trip_offsets': np.array(trip_offsets, dtype=np.int64),
+        'stop_time_stop': np.array(stop_time_stop, dtype=np.int32),
+        'stop_time_arrival': np.array(stop_time_arrival, dtype=np.int32),
+        'stop_time_departure': np.array(stop_time_departure, dtype=np.int32),
+    }
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'feed_hash': feed_hash,
+        'source': os.path.abspath(gtfs_zip_or_dir),
+        'created': datetime.now().isoformat(),
+        'agency_name': agency.agency_name,
+        'agency_timezone': agency.agency_timezone,
+    }
+
+    if not os.path.isdir(compiled_dir):
+        os.makedirs(compiled_dir)
+    artifact_path = os.path.join(compiled_dir, feed_hash)
+    tmp_path = tempfile.mkdtemp(prefix='.' + feed_hash, dir=compiled_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, name + '.npy'), array)
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    try:
+        os.rename(tmp_path, artifact_path)
+    except OSError:
+        # another process has compiled the same feed in the meantime
+        shutil.rmtree(tmp_path)
+    prune_artifacts(compiled_dir, manifest['source'], feed_hash, keep)
+    return artifact_path
+
+
+def prune_artifacts(compiled_dir, source, current_hash, keep=KEEP_ARTIFACTS):
+    """"Removes artifacts compiled from the source feed except the current one and the newest of the others up to
+        keep in total. Artifacts of other feeds sharing compiled_dir are left alone. Returns the removed hashes."""
+    artifacts = []
+    for name in os.listdir(compiled_dir):
+        manifest_path = os.path.join(compiled_dir, name, MANIFEST_FILE)
+        if name == current_hash or not os.path.isfile(manifest_path):
+            continue
+        try:
+            with open(manifest_path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except ValueError:
+            continue
+        if manifest.get('source') == source:
+            artifacts.append((manifest.get('created', ''), name))
+    artifacts.sort(reverse=True)
+    removed = []
+    for created, name in artifacts[max(keep - 1, 0):]:
+        shutil.rmtree(os.path.join(compiled_dir, name), ignore_errors=True)
+        removed.append(name)
+    if removed:
+        logging.info("Removed compiled schedules {} of {}".format(removed, source))
+    return removed
+
+
+def load_schedule(gtfs_zip_or_dir, compiled_dir=None):
+    """"Returns CompiledSchedule for the feed, compiling it first if there is no artifact for its current hash. Without
+        compiled_dir the feed is loaded by transitfeed."""
+    before = time.time()
+    if compiled_dir is None:
+        return transitfeed.Loader(feed_path=gtfs_zip_or_dir, memory_db=False).Load()
+    feed_hash = get_feed_hash(gtfs_zip_or_dir)
+    artifact_path = os.path.join(compiled_dir, feed_hash)
+    if not os.path.isfile(os.path.join(artifact_path, MANIFEST_FILE)):
+        logging.info("Compiling schedule {} to {}".format(gtfs_zip_or_dir, artifact_path))
+        compile_schedule(gtfs_zip_or_dir, compiled_dir, feed_hash)
+    schedule = CompiledSchedule(artifact_path)
+    logging.info("Schedule {} loaded in {}s".format(artifact_path, time.time() - before))
+    return schedule
+
+
+class CompiledSchedule:
+    """"Read-only schedule backed by the memory-mapped arrays of a compiled artifact, so scraper processes on one host
+        share the same pages. Only trip_id and shape_id lookup tables are kept in memory, Trip, Shape and Stop objects
+        are light views created on demand. It implements the part of transitfeed.Schedule used by the scraper:
+        GetTrip, GetTripList, GetShape, GetShapeList and GetAgencyList."""
+
+    def __init__(self, artifact_path):
+        with open(os.path.join(artifact_path, MANIFEST_FILE)) as manifest_file:
+            self.manifest = json.load(manifest_file)
+        if self.manifest['format_version'] != FORMAT_VERSION:
+            raise ValueError("Unsupported compiled schedule version {}".format(self.manifest['format_version']))
+        self.arrays = dict((name, np.load(os.path.join(artifact_path, name + '.npy'), mmap_mode='r'))
+                           for name in ARRAY_NAMES)
+        self._agency = CompiledAgency(self.manifest['agency_name'], self.manifest['agency_timezone'])
+        self._trip_index = dict((trip_id, i) for i, trip_id in enumerate(_from_bytes(self.arrays['trip_ids'])))
+        self._shape_ids = _from_bytes(self.arrays['shape_ids'])
+        self._shape_index = dict((shape_id, i) for i, shape_id in enumerate(self._shape_ids))
+
+    def GetTrip(self, trip_id):
+        return CompiledTrip(self, self._trip_index[trip_id])
+
+    def GetTripList(self):
+        return [CompiledTrip(self, i) for i in range(len(self._trip_index))]
+
+    def GetShape(self, shape_id):
+        return CompiledShape(self, self._shape_index[shape_id])
+
+    def GetShapeList(self):
+        return [CompiledShape(self, i) for i in range(len(self._shape_ids))]
+
+    def GetAgencyList(self):
+        return [self._agency]
+
+    def get_stop_times(self, trip_indx):
+        """"Returns (arrival, departure, stop index) array views for a trip, NO_TIME marks untimed stops."""
+        begin, end = self.arrays['trip_offsets'][trip_indx:trip_indx + 2]
+        return (self.arrays['stop_time_arrival'][begin:end], self.arrays['stop_time_departure'][begin:end],
+                self.arrays['stop_time_stop'][begin:end])
+
+    def get_shape_points(self, shape_indx):
+        """"Returns (lat, lon) array views for a shape."""
+        begin, end = self.arrays['shape_offsets'][shape_indx:shape_indx + 2]
+        return self.arrays['shape_lat'][begin:end], self.arrays['shape_lon'][begin:end]
+
+
+class CompiledAgency:
+    def __init__(self, agency_name, agency_timezone):
+        self.agency_name = agency_name
+        self.agency_timezone = agency_timezone
+
+
+class CompiledStop(object):
+    __slots__ = ('_schedule', '_indx')
+
+    def __init__(self, schedule, indx):
+        self._schedule = schedule
+        self._indx = indx
+
+    @property
+    def stop_id(self):
+        return self._schedule.arrays['stop_ids'][self._indx].decode('utf-8')
+
+    @property
+    def stop_lat(self):
+        return float(self._schedule.arrays['stop_lat'][self._indx])
+
+    @property
+    def stop_lon(self):
+        return float(self._schedule.arrays['stop_lon'][self._indx])
+
+
+class CompiledShape(object):
+    __slots__ = ('_schedule', '_indx')
+
+    def __init__(self, schedule, indx):
+        self._schedule = schedule
+        self._indx = indx
+
+    @property
+    def shape_id(self):
+        return self._schedule._shape_ids[self._indx]
+
+    @property
+    def points(self):
+        lat, lon = self._schedule.get_shape_points(self._indx)
+        return zip(lat.tolist(), lon.tolist())
+
+
+class CompiledTrip(object):
+    __slots__ = ('_schedule', '_indx')
+
+    def __init__(self, schedule, indx):
+        self._schedule = schedule
+        self._indx = indx
+
+    @property
+    def trip_id(self):
+        return self._schedule.arrays['trip_ids'][self._indx].decode('utf-8')
+
+    @property
+    def route_id(self):
+        return self._schedule.arrays['trip_route_ids'][self._indx].decode('utf-8')
+
+    @property
+    def shape_id(self):
+        shape_indx = self._schedule.arrays['trip_shape'][self._indx]
+        return self._schedule._shape_ids[shape_indx] if shape_indx != NO_SHAPE else None
+
+    def GetTimeStops(self):
+        arrival, departure, stops = self._schedule.get_stop_times(self._indx)
+        return [(_to_time(arr), _to_time(dep), CompiledStop(self._schedule, stop_indx))
+                for arr, dep, stop_indx in zip(arrival.tolist(), departure.tolist(), stops.tolist())]
+
+
+def _update_hash(sha, file_path):
+    with open(file_path, 'rb') as feed_file:
+        for chunk in iter(lambda: feed_file.read(1 << 20), b''):
+            sha.update(chunk)
+
+
+def _to_bytes(values):
+    return np.array([value.encode('utf-8') for value in values], dtype=np.string_)
+
+
+def _from_bytes(array):
+    return [value.decode('utf-8') for value in array.tolist()]
+
+
+def _to_time(value):
+    return None if value == NO_TIME else value
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compiles a gtfs feed for fast scraper startup.')
+    parser.add_argument('--gtfsZipOrDir', help='Gtfs zip file or directory', required=True)
+    parser.add_argument('--compiledDir', help='A directory for compiled schedules', required=True)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    print compile_schedule(args.gtfsZipOrDir, args.compiledDir)
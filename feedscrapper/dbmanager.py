@@ -3,17 +3,35 @@ from sqlite3 import Error
 import os
 
 class DbManager:
-    def __init__(self, db_file):
+    WAL_PRAGMAS = ("PRAGMA journal_mode=WAL;",
+                   "PRAGMA synchronous=NORMAL;",
+                   "PRAGMA temp_store=MEMORY;",
+                   "PRAGMA cache_size=-16000;",
+                   "PRAGMA wal_autocheckpoint=10000;")
+
+    def __init__(self, db_file, timeout=5.0, wal=False, indexes=True):
         if not os.path.isfile(db_file):
             open(db_file, 'wb')
         """ create a database connection to a SQLite database """
         try:
-            self.conn = sqlite3.connect(db_file)
+            self.conn = sqlite3.connect(db_file, timeout=timeout)
+            if wal:
+                self._enable_wal()
             self._create_db()
+            if indexes:
+                self.create_indexes()
         except Error as e:
             print e
             raise e
 
+    def _enable_wal(self):
+        """ write-ahead logging lets readers work while rows are appended and
+        makes commits cheaper with synchronous=NORMAL
+        """
+        cursor = self.conn.cursor()
+        for pragma in self.WAL_PRAGMAS:
+            cursor.execute(pragma)
+
     def _create_db(self):
         """ create a vehicle_log table
         """
@@ -29,9 +47,16 @@ class DbManager:
                                             delay_sec integer NOT NULL,
                                             progress real NOT NULL
                                         ); """)
+        except Error as e:
+            print e
+            raise e
 
+    def create_indexes(self):
+        try:
+            cursor = self.conn.cursor()
             cursor.execute("""CREATE INDEX IF NOT EXISTS trip_index ON vehicle_log (trip_id);""")
             cursor.execute("""CREATE INDEX IF NOT EXISTS time_index ON vehicle_log (time);""")
+            self.conn.commit()
         except Error as e:
             print e
             raise e
@@ -47,6 +72,20 @@ class DbManager:
             print e
             raise e
 
+    def insert_logs(self, rows):
+        """ rows are tuples in the order of insert_log arguments
+        """
+        try:
+            sql = ''' INSERT INTO vehicle_log(route_id, trip_id, stop_seq, time, day, delay_sec, progress,
+                        stop_progress) VALUES(?,?,?,?,?,?,?,?) '''
+            self.conn.executemany(sql, rows)
+        except Error as e:
+            print e
+            raise e
+
+    def rollback(self):
+        self.conn.rollback()
+
     def commit(self):
         self.conn.commit()
 
@@ -0,0 +1,174 @@
+from collections import deque
+from dbmanager import DbManager
+from sqlite3 import Error, OperationalError
+from threading import Thread
+from threading import Event
+from threading import Lock
+from itertools import islice
+import logging
+import time
+
+
+class DbWriter(Thread):
+    """"Queues vehicle_log rows in memory and writes them with executemany from a dedicated thread, so the polling loop
+        never waits for the disk. It has the same insert_log/commit interface as DbManager, commit only wakes the
+        writer up. Rows stay queued until their transaction is committed. Flushes failing with OperationalError, e.g.
+        a locked or full disk, are retried with growing delay. A batch rejected for its content, e.g. a NOT NULL
+        constraint, is written row by row and the rows that still fail are logged and dropped. If the thread dies
+        anyway, commit and is_overloaded raise DbWriterStoppedException."""
+    FLUSH_INTERVAL = 1.0
+    MAX_BATCH = 5000
+    HIGH_WATERMARK = 200000
+    RETRY_DELAY = 0.5
+    MAX_RETRY_DELAY = 30
+    SHUTDOWN_RETRIES = 10
+    BUSY_TIMEOUT = 1.0
+
+    def __init__(self, db_file, busy_timeout=None, wal=True, db_factory=None, metrics=None):
+        """"db_factory creates the database manager in the writer thread, DbManager(db_file) is used by default.
+            Flush durations are observed as stage.db_flush in the metrics registry when given."""
+        Thread.__init__(self, name='DbWriter')
+        self.daemon = True
+        self.db_file = db_file
+        self.busy_timeout = busy_timeout if busy_timeout is not None else self.BUSY_TIMEOUT
+        self.wal = wal
+        self.db_factory = db_factory
+        self.metrics = metrics
+        self._queue = deque()
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._stopped = Event()
+        self._ready = Event()
+        self._error = None
+
+        self.flushed_rows = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        self.rejected_rows = 0
+        self.last_flush_latency = 0
+        self.max_flush_latency = 0
+
+    def start(self):
+        """"Starts the thread and waits until the database is opened, so schema errors surface in the caller."""
+        Thread.start(self)
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def insert_log(self, route_id, trip_id, stop_seq, sampling_time, day, delay_sec, progress, inter_progress):
+        with self._lock:
+            self._queue.append((route_id, trip_id, stop_seq, sampling_time, day, delay_sec, progress, inter_progress))
+
+    def commit(self):
+        self._check_alive()
+        self._wakeup.set()
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    def is_overloaded(self):
+        """"The caller should slow down, rows are produced faster than the disk takes them."""
+        self._check_alive()
+        return self.queue_depth() > self.HIGH_WATERMARK
+
+    def get_stats(self):
+        return {'queue_depth': self.queue_depth(), 'flushed_rows': self.flushed_rows,
+                'flush_count': self.flush_count, 'failed_flushes': self.failed_flushes,
+                'rejected_rows': self.rejected_rows,
+                'last_flush_latency': self.last_flush_latency, 'max_flush_latency': self.max_flush_latency}
+
+    def close_connection(self):
+        """"Writes all queued rows and stops the thread."""
+        self._stopped.set()
+        self._wakeup.set()
+        self.join()
+
+    def run(self):
+        try:
+            if self.db_factory is not None:
+                db_manager = self.db_factory()
+            else:
+                db_manager = DbManager(self.db_file, timeout=self.busy_timeout, wal=self.wal)
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        try:
+            self._write_loop(db_manager)
+        except Exception as e:
+            logging.exception("The db writer has stopped, {} rows are not saved".format(self.queue_depth()))
+            self._error = e
+        db_manager.close_connection()
+
+    def _write_loop(self, db_manager):
+        retry_delay = self.RETRY_DELAY
+        shutdown_retries = 0
+        while True:
+            self._wakeup.wait(self.FLUSH_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self._flush(db_manager)
+                retry_delay = self.RETRY_DELAY
+            except OperationalError as e:
+                self.failed_flushes += 1
+                logging.warning("Hard drive overload, {} rows are waiting. {}".format(self.queue_depth(), e))
+                db_manager.rollback()
+                if self._stopped.is_set():
+                    shutdown_retries += 1
+                    if shutdown_retries > self.SHUTDOWN_RETRIES:
+                        logging.error("Giving up, {} rows are not saved".format(self.queue_depth()))
+                        break
+                self._stopped.wait(retry_delay)
+                retry_delay = min(retry_delay * 2, self.MAX_RETRY_DELAY)
+                continue
+            if self._stopped.is_set() and not self._queue:
+                break
+
+    def _check_alive(self):
+        if self._ready.is_set() and not self.is_alive() and not self._stopped.is_set():
+            raise DbWriterStoppedException("The db writer has stopped, {} rows are not saved. {}".format(
+                self.queue_depth(), self._error))
+
+    def _flush(self, db_manager):
+        while self._queue:
+            with self._lock:
+                rows = list(islice(self._queue, self.MAX_BATCH))
+            before = time.time()
+            rejected = 0
+            try:
+                db_manager.insert_logs(rows)
+                db_manager.commit()
+            except OperationalError:
+                raise
+            except Error as e:
+                db_manager.rollback()
+                logging.warning("A batch of {} rows is rejected, writing it row by row. {}".format(len(rows), e))
+                rejected = self._insert_one_by_one(db_manager, rows)
+            with self._lock:
+                for i in range(len(rows)):
+                    self._queue.popleft()
+            self.last_flush_latency = time.time() - before
+            self.max_flush_latency = max(self.max_flush_latency, self.last_flush_latency)
+            if self.metrics is not None:
+                self.metrics.observe('stage.db_flush', self.last_flush_latency)
+            self.flushed_rows += len(rows) - rejected
+            self.rejected_rows += rejected
+            self.flush_count += 1
+
+    def _insert_one_by_one(self, db_manager, rows):
+        """"Returns the number of rejected rows."""
+        rejected = 0
+        for row in rows:
+            try:
+                db_manager.insert_log(*row)
+            except OperationalError:
+                raise
+            except Error as e:
+                rejected += 1
+                logging.error("Row {} is not saved. {}".format(row, e))
+        db_manager.commit()
+        return rejected
+
+
+class DbWriterStoppedException(Exception): pass
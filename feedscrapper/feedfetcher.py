@@ -0,0 +1,129 @@
+from google.protobuf.message import DecodeError
+from wiredecoder import parse_feed, DECODER_FULL
+import hashlib
+import logging
+import requests
+import time
+
+RESULT_NEW = 'new'
+RESULT_UNCHANGED = 'unchanged'
+RESULT_DECODE_ERROR = 'decode_error'
+RESULT_ERROR = 'fetch_error'
+
+
+class FeedFetcher:
+    """"Downloads a gtfs realtime feed over a persistent requests session. Requests are conditional on the ETag and
+        Last-Modified of the last feed and the session negotiates gzip. fetch returns None when the server answers 304,
+        the payload hash or header.timestamp are the same as last time, so the caller can skip the whole cycle.
+        Failed requests are retried after exponentially growing delays. The decoder is one of wiredecoder.DECODERS.
+        last_result tells why the last fetch returned what it did, one of the RESULT_ constants."""
+    TIMEOUT = 10
+    RETRY_DELAY = 1
+    MAX_RETRY_DELAY = 300
+
+    def __init__(self, url, timeout=None, session=None, decoder=DECODER_FULL):
+        self.url = url
+        self.decoder = decoder
+        self.timeout = timeout or self.TIMEOUT
+        self.session = session or requests.Session()
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        self.feed_timestamp = None
+        self.retry_delay = self.RETRY_DELAY
+        self.retry_at = 0
+        self.last_fetch_seconds = 0
+        self.last_decode_seconds = 0
+        self.last_result = None
+
+        self.fetches = 0
+        self.not_modified = 0
+        self.same_content = 0
+        self.same_timestamp = 0
+        self.errors = 0
+        self.decode_errors = 0
+        self.received_bytes = 0
+
+    def fetch(self, retry=True):
+        """"Returns a new FeedMessage, DecodedFeed for the fast decoder, or None when the feed hasn't changed. With
+            retry failed requests are repeated until one succeeds, otherwise None is returned and the next calls
+            return None until the retry delay passes."""
+        self.last_fetch_seconds = self.last_decode_seconds = 0
+        while True:
+            if time.time() < self.retry_at:
+                if not retry:
+                    self.last_result = RESULT_ERROR
+                    return None
+                time.sleep(self.retry_at - time.time())
+            before = time.time()
+            try:
+                response = self.session.get(self.url, headers=self._get_conditional_headers(), timeout=self.timeout)
+                self.last_fetch_seconds = time.time() - before
+                if response.status_code == 304:
+                    self._succeeded()
+                    self.not_modified += 1
+                    self.last_result = RESULT_UNCHANGED
+                    return None
+                response.raise_for_status()
+            except requests.RequestException as e:
+                self.last_fetch_seconds = time.time() - before
+                self._failed("Can't read feed {}. {}".format(self.url, e))
+                if retry:
+                    continue
+                self.last_result = RESULT_ERROR
+                return None
+            self._succeeded()
+            before = time.time()
+            feed = self._parse(response)
+            self.last_decode_seconds = time.time() - before
+            return feed
+
+    def get_stats(self):
+        return {'fetches': self.fetches, 'not_modified': self.not_modified, 'same_content': self.same_content,
+                'same_timestamp': self.same_timestamp, 'errors': self.errors, 'decode_errors': self.decode_errors,
+                'received_bytes': self.received_bytes}
+
+    def _get_conditional_headers(self):
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def _parse(self, response):
+        content = response.content
+        self.fetches += 1
+        self.received_bytes += len(content)
+        content_hash = hashlib.sha1(content).digest()
+        self.last_result = RESULT_UNCHANGED
+        if content_hash == self.content_hash:
+            self.same_content += 1
+            return None
+        try:
+            feed = parse_feed(content, self.decoder)
+        except DecodeError as e:
+            logging.error("Error while parsing protobuf input. {}".format(e.message))
+            self.decode_errors += 1
+            self.last_result = RESULT_DECODE_ERROR
+            return None
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        self.content_hash = content_hash
+        timestamp = feed.header.timestamp
+        if timestamp and timestamp == self.feed_timestamp:
+            self.same_timestamp += 1
+            return None
+        self.feed_timestamp = timestamp
+        self.last_result = RESULT_NEW
+        return feed
+
+    def _succeeded(self):
+        self.retry_delay = self.RETRY_DELAY
+        self.retry_at = 0
+
+    def _failed(self, message):
+        self.errors += 1
+        logging.error("{}. Next attempt in {}s".format(message, self.retry_delay))
+        self.retry_at = time.time() + self.retry_delay
+        self.retry_delay = min(self.retry_delay * 2, self.MAX_RETRY_DELAY)
@@ -1,178 +1,328 @@
-from google.protobuf.message import DecodeError
-from google.transit import gtfs_realtime_pb2
 from datetime import datetime
-from dbmanager import DbManager
-from transitfeed.shapelib import Point
-from utils import TripState, StopFarFromPolylineException, AlgorithmErrorException
-from utils import VehicleOutOfPolylineException
-from sqlite3 import OperationalError
-import requests
-import transitfeed
+from activetrips import ActiveTrips
+from adaptivepoller import AdaptivePoller
+from checkpoint import Checkpointer
+from dbwriter import DbWriter
+from feedfetcher import FeedFetcher, RESULT_NEW, RESULT_UNCHANGED
+from metrics import MetricsRegistry, MetricsServer, MetricsDumper
+from profiler import CycleProfiler
+from wiredecoder import DECODERS, DECODER_FULL
+from partitioneddb import PartitionedDbManager, PERIODS
+from snapshotdiff import SnapshotDiff
+from utils import TripState, ENGINES, ENGINE_PYTHON
+from geometrycache import GeometryCache
+from compiledschedule import load_schedule
+from parallel import ProjectionPool, ProjectionWorkerError
+from tripbatch import TripStateBatch, get_vehicle_records, STATUS_NAMES, STATUS_OK, STATUS_FAULTY_TRIP, STATUS_OUT_OF_POLYLINE, STATUS_STOPS_UNREACHABLE
 import time
 import pytz
 import argparse
 import logging
+import numpy as np
 
 SEC_IN_DAY = 24 * 3600
 HOUR_SECS = 23 * 3600
 time_zone = None
 
 
-def main(gtfs_zip_or_dir, feed_url, db_file, interval):
-  loader = transitfeed.Loader(feed_path=gtfs_zip_or_dir, memory_db=False)
-  schedule = loader.Load()
-  agency = schedule.GetAgencyList()[0]
+def main(gtfs_zip_or_dir, feed_url, db_file, interval, geometry_cache_size=None, engine=ENGINE_PYTHON,
+         compiled_dir=None, partition=None, retention=None, workers=None, fetch_timeout=None,
+         decoder=DECODER_FULL, metrics_port=None, metrics_file=None, profile_dir=None, profile_threshold=None,
+         adaptive=False, checkpoint=None):
+  TripState.GEOMETRY_CACHE = GeometryCache(max_shapes=geometry_cache_size)
+  TripState.ENGINE = engine
+  schedule = load_schedule(gtfs_zip_or_dir, compiled_dir)
   global time_zone
-  time_zone = pytz.timezone(agency.agency_timezone)
-
-  db_manager = DbManager(db_file)
+  time_zone = get_time_zone(schedule)
 
   if not schedule.GetShapeList():
     logging.error("This feed doesn't contain shape.txt file. Exit...")
     return
 
-  active_trips = ActiveTrips()
+  metrics = MetricsRegistry()
+  projection_pool = None
+  if workers:
+    projection_pool = ProjectionPool(gtfs_zip_or_dir, workers, compiled_dir, engine, geometry_cache_size, schedule,
+                                     metrics)
+  db_manager = create_db_writer(db_file, time_zone, partition, retention, metrics)
+  active_trips = ActiveTrips(time_zone)
+  fetcher = FeedFetcher(feed_url, fetch_timeout, decoder=decoder)
+  snapshot_diff = SnapshotDiff()
+  failures = TripState.GEOMETRY_CACHE.failures
+  poller = AdaptivePoller(interval) if adaptive else None
+  checkpointer = None
+  if checkpoint is not None:
+    checkpointer = Checkpointer(checkpoint, feed_url=feed_url)
+    checkpointer.restore(active_trips)
+  add_gauges(metrics, active_trips, db_manager, fetcher, failures, poller, checkpointer)
+  metrics_server = MetricsServer(metrics.snapshot, metrics_port).start() if metrics_port else None
+  metrics_dumper = MetricsDumper(metrics.snapshot, metrics_file).start() if metrics_file else None
+  profiler = None
+  if profile_dir is not None:
+    profiler = CycleProfiler(profile_dir, profile_threshold or interval)
+    TripState.CONSTRUCTIONS = profiler.constructions
 
   logging.info("Start at local time {}".format(datetime.now()))
-  while True:
-    cnt, all = 0, 0
-    before = time.time()
-    feed = read_feed(feed_url)
-    for entity in feed.entity:
-      if entity.HasField('vehicle'):
-        trip_id = entity.vehicle.trip.trip_id
-        try:
-          trip = schedule.GetTrip(trip_id)
-        except KeyError as e:
-          logging.warning("Faulty trip_id for entity: {}".format(entity))
-          continue
-        all += 1
-        vehiclePoint = Point.FromLatLng(entity.vehicle.position.latitude, entity.vehicle.position.longitude)
-        try:
-          trip_state = TripState(trip, vehiclePoint, entity.vehicle.stop_id)
-        except VehicleOutOfPolylineException as e:
-          logging.warning("Vehicle {1} is out of shape for trip_id {0}".format(trip_id, (entity.vehicle.position.latitude, entity.vehicle.position.longitude)))
-          continue
-        except StopFarFromPolylineException as e:
-          logging.warning("Couldn't reach all stops for trip_id {}".format(trip_id))
-          continue
-
-        cur_trip_progress = active_trips.get_trip_progress(trip_id)
-        new_progress = trip_state.get_trip_progress()
-        if trip_state.get_distance_to_end_stop() < 100 and cur_trip_progress == new_progress:
-          continue
-        if cur_trip_progress is not None and new_progress < cur_trip_progress:
-          logging.warning("The trip_id {} seems to go backwards. Timestamp {}".format(trip_id, entity.vehicle.timestamp))
-          continue
-        if not active_trips.is_trip_active(trip_id) and trip_state.get_prev_stop_seq() > 2:
-          continue
-
-        prev_timestamp = active_trips.get_timestamp_for_trip(trip_id)
-        if active_trips.is_trip_active(trip_id):
-          speed = trip_state.get_avrg_speed(entity.vehicle.timestamp - prev_timestamp, new_progress - cur_trip_progress)
-          if speed > 120:#sanity check
-            logging.warning("Trip {} is trying to advance too quick -> {}km/h, timestamp {}".format(trip_id, speed, entity.vehicle.timestamp))
-            continue
-
-        if entity.vehicle.timestamp != prev_timestamp:
-          cnt += 1
-          estimated_time = trip_state.get_estimated_scheduled_time()
-          stop_progress = trip_state.get_stop_progress()
-          delay = calculate_delay(_normalize_time(entity.vehicle.timestamp), estimated_time)
-          active_trips.add_update_trip(trip_id, entity.vehicle.timestamp, new_progress)
-          start_day = active_trips.get_day_for_trip(trip_id)
-          db_manager.insert_log(entity.vehicle.trip.route_id, trip_id, trip_state.get_prev_stop_seq(),
-                                entity.vehicle.timestamp, start_day, delay, new_progress, stop_progress)
+  try:
+    while True:
+      before = time.time()
+      if profiler is not None:
+        profiler.start_cycle()
+      result = run_cycle(schedule, fetcher, active_trips, db_manager, metrics, snapshot_diff,
+                         projection_pool=projection_pool, failures=failures, poller=poller,
+                         checkpointer=checkpointer)
+      if profiler is not None:
+        info = {'saved': result[0], 'projected': result[1]} if result is not None else None
+        if profiler.end_cycle(time.time() - before, info):
+          metrics.count('cycles.profiled')
+      if result is not None:
+        cnt, all = result
+        logging.info("Procesing time {}. Saved {} out of {} records. Vehicles changed {}, unchanged {}, new {}. "
+                     "DB queue {}, last flush {}s".format(time.time() - before, cnt, all, snapshot_diff.changed,
+                                                          snapshot_diff.unchanged, snapshot_diff.new,
+                                                          db_manager.queue_depth(), db_manager.last_flush_latency))
+      proc_time = time.time() - before
+      if poller is not None:
+        time.sleep(poller.get_delay(time.time()))
+      elif interval - proc_time > 0:
+        time.sleep(interval - proc_time)
+      else:
+        metrics.count('cycles.overrun')
+        logging.warning("Processing is taking too long")
+  finally:
+    if checkpointer is not None and fetcher.feed_timestamp:
+      checkpointer.save(active_trips, fetcher.feed_timestamp)
+    db_manager.close_connection()
+    if projection_pool is not None:
+      projection_pool.close()
+    if metrics_server is not None:
+      metrics_server.stop()
+    if metrics_dumper is not None:
+      metrics_dumper.stop()
 
-    try:
-      db_manager.commit()
-    except OperationalError as e:
-      logging.warning("Hard drive overload")
-      continue
 
-    active_trips.clean_inactive_trips(feed.header.timestamp)
-    proc_time = time.time() - before
-    logging.info("Procesing time {}. Saved {} out of {} records".format(proc_time, cnt, all))
-    if interval - proc_time > 0:
-      time.sleep(interval - proc_time)
-    else:
-      logging.warning("Processing is taking too long")
+def run_cycle(schedule, fetcher, active_trips, db_manager, metrics, snapshot_diff=None, geometry_cache=None,
+              projection_pool=None, retry=True, failures=None, poller=None, checkpointer=None):
+  """"One polling cycle: fetch, decode, process and commit, with the duration of every stage and the rejection
+      reasons recorded in metrics. Staleness is the time from the feed's header.timestamp to the commit. Returns
+      (saved records, projected vehicles) or None when the cycle was skipped. failures is passed to process_feed,
+      the AdaptivePoller is told about every fetch and the Checkpointer checks restored trips against the first feed
+      and saves the active trips."""
+  before = time.time()
+  if db_manager.is_overloaded():
+    logging.warning("Skipping a cycle, {} rows are waiting to be written".format(db_manager.queue_depth()))
+    metrics.count('cycles.overloaded')
+    return None
+  feed = fetcher.fetch(retry)
+  if poller is not None and fetcher.last_result in (RESULT_NEW, RESULT_UNCHANGED):
+    poller.observe(time.time(), feed.header.timestamp if feed is not None else None)
+  metrics.observe('stage.fetch', fetcher.last_fetch_seconds)
+  if fetcher.last_decode_seconds:
+    metrics.observe('stage.decode', fetcher.last_decode_seconds)
+  if feed is None:
+    if fetcher.last_result == RESULT_UNCHANGED:
+      logging.info("The feed hasn't changed since the last request")
+    metrics.count('cycles.' + fetcher.last_result)
+    return None
+
+  if checkpointer is not None:
+    checkpointer.validate(active_trips, feed.header.timestamp)
+  stage_times, rejections = {}, {}
+  cnt, all = process_feed(schedule, feed, active_trips, db_manager, geometry_cache, projection_pool, snapshot_diff,
+                          stage_times, rejections, failures)
+  committed = time.time()
+  db_manager.commit()
+  active_trips.clean_inactive_trips(feed.header.timestamp)
+  _add_stage_time(stage_times, 'commit', time.time() - committed)
+  if checkpointer is not None:
+    checkpointer.update(active_trips, feed.header.timestamp)
+  if feed.header.timestamp:
+    metrics.observe('staleness', time.time() - feed.header.timestamp)
+
+  for stage, seconds in stage_times.items():
+    metrics.observe('stage.' + stage, seconds)
+  metrics.add_counts('rejected.', rejections)
+  metrics.count('records.saved', cnt)
+  metrics.count('vehicles.projected', all)
+  if snapshot_diff is not None:
+    metrics.add_counts('vehicles.', {'changed': snapshot_diff.changed, 'unchanged': snapshot_diff.unchanged,
+                                     'new': snapshot_diff.new})
+  metrics.count('cycles.processed')
+  metrics.observe('cycle', time.time() - before)
+  return cnt, all
+
 
+def add_gauges(metrics, active_trips, db_manager, fetcher, failures=None, poller=None, checkpointer=None):
+  metrics.set_gauge('active_trips', lambda: len(active_trips))
+  metrics.set_gauge('db', db_manager.get_stats)
+  metrics.set_gauge('fetcher', fetcher.get_stats)
+  if failures is not None:
+    metrics.set_gauge('unmatchable', failures.get_stats)
+    metrics.set_gauge('unmatchable_trips', failures.get_report)
+  if poller is not None:
+    metrics.set_gauge('poller', poller.get_stats)
+  if checkpointer is not None:
+    metrics.set_gauge('checkpoint', checkpointer.get_stats)
 
-def _normalize_time(timestamp):
-  localized_time = datetime.fromtimestamp(float(timestamp), time_zone)
-  return localized_time.hour * 3600 + localized_time.minute * 60 + localized_time.second
 
+def get_time_zone(schedule):
+  return pytz.timezone(schedule.GetAgencyList()[0].agency_timezone)
 
-def calculate_delay(reporting_time, estimated_time):
-  diff = reporting_time - estimated_time
-  if abs(diff) > HOUR_SECS:
-    if diff > 0:
-      return diff - SEC_IN_DAY
-    else:
-      return diff + SEC_IN_DAY
-  return diff
 
+def create_db_writer(db_file, time_zone, partition=None, retention=None, metrics=None):
+  """"Starts a DbWriter, with partition set it writes to PartitionedDbManager partitions."""
+  db_factory = None
+  if partition is not None:
+    db_factory = lambda: PartitionedDbManager(db_file, time_zone, partition, retention, DbWriter.BUSY_TIMEOUT, wal=True)
+  db_manager = DbWriter(db_file, db_factory=db_factory, metrics=metrics)
+  db_manager.start()
+  return db_manager
 
-def read_feed(url):
-  feed = gtfs_realtime_pb2.FeedMessage()
-  response = None
-  while response is None:
+
+def process_feed(schedule, feed, active_trips, db_manager, geometry_cache=None, projection_pool=None,
+                 snapshot_diff=None, stage_times=None, rejections=None, failures=None):
+  """"Projects all vehicles of the feed at once, filters out implausible updates and logs the rest. With
+      projection_pool the projection runs in its worker processes, or in this process when they fail and are being
+      restarted, with snapshot_diff only vehicles changed since the previous feed are projected. Seconds spent in the project, filter and write stages are added to the
+      stage_times dict and the numbers of rejected vehicles by reason to the rejections dict when given. Trips with
+      unknown trip_id or unreachable stops are in the failures NegativeCache of the geometry cache, which limits
+      their warnings. Vehicles before the first stop or between untimed stops have no scheduled time, they are
+      logged on the service day of their timestamp with the delay the placeholder scheduled time 0 always had.
+      Returns a tuple (saved records, projected vehicles with known trip)."""
+  before = time.time()
+  records = get_vehicle_records(feed)
+  if snapshot_diff is not None:
+    records = snapshot_diff.filter(records)
+  hints = [active_trips.get_last_segment(rec.trip_id) for rec in records]
+  batch = None
+  if projection_pool is not None:
     try:
-      response = requests.get(url)
-    except:
-      logging.error("Connection refused by the server..")
-      time.sleep(5)
+      batch = projection_pool.project(records, hints)
+    except ProjectionWorkerError as e:
+      logging.error("Projection workers failed, projecting in process. {}".format(e))
+      projection_pool.restart()
+  if batch is None:
+    batch = TripStateBatch(schedule, records, geometry_cache=geometry_cache, last_segments=hints)
+  projected = time.time()
+  _log_rejected(batch, failures)
+  if rejections is not None:
+    for status, count in enumerate(np.bincount(batch.status, minlength=len(STATUS_NAMES))):
+      if status != STATUS_OK and count:
+        _add_count(rejections, STATUS_NAMES[status], int(count))
+  accepted = filter_updates(batch, active_trips, rejections)
+  filtered = time.time()
+  rows = np.flatnonzero(accepted)
+  service_time = active_trips.service_time
+  # before the first stop there is no scheduled time, the estimated time 0 is only a placeholder
+  scheduled = np.where(batch.prev_stop_seq[rows] > 0, batch.estimated_time[rows], np.nan)
+  delays, dates = service_time.get_delays(batch.timestamps[rows], scheduled)
+  untimed = np.isnan(delays)
+  if untimed.any():
+    delays[untimed] = _get_placeholder_delays(service_time.get_seconds(batch.timestamps[rows[untimed]])[0])
+  for i, delay, day in zip(rows, delays.tolist(), service_time.get_day_of_year(dates).tolist()):
+    record, timestamp = batch.records[i], int(batch.timestamps[i])
+    trip = active_trips.add_update_trip(record.trip_id, timestamp, batch.progress[i], int(batch.segment[i]),
+                                        batch.distance[i], record.lat, record.lon, day)
+    db_manager.insert_log(batch.route_ids[i], record.trip_id, int(batch.prev_stop_seq[i]), timestamp, trip.day,
+                          delay, batch.progress[i], batch.stop_progress[i])
+  if stage_times is not None:
+    _add_stage_time(stage_times, 'project', projected - before)
+    _add_stage_time(stage_times, 'filter', filtered - projected)
+    _add_stage_time(stage_times, 'write', time.time() - filtered)
+  return int(accepted.sum()), int((batch.status != STATUS_FAULTY_TRIP).sum())
+
+
+def _get_placeholder_delays(seconds):
+  """"Delays against the scheduled time 0 given the seconds since the start of the service day, a day is taken off
+      after 23:00 as the time is closer to the next midnight."""
+  return np.where(seconds > HOUR_SECS, seconds - SEC_IN_DAY, seconds)
+
+
+def _add_stage_time(stage_times, stage, seconds):
+  stage_times[stage] = stage_times.get(stage, 0) + seconds
+
+
+def _add_count(counts, name, count):
+  counts[name] = counts.get(name, 0) + count
+
+
+def _reject(accepted, rejected, reason, rejections):
+  rejected &= accepted
+  if rejections is not None and rejected.any():
+    _add_count(rejections, reason, int(rejected.sum()))
+  accepted &= ~rejected
+
+
+def filter_updates(batch, active_trips, rejections=None):
+  """"Sanity checks over the whole batch. Returns a mask of vehicle updates worth saving. Rows of the batch
+      projected successfully and rejected here are counted by reason in the rejections dict when given."""
+  trips = [active_trips.get(trip_id) for trip_id in batch.trip_ids]
+  cur_progress = np.array([np.nan if trip is None else trip.progress for trip in trips], dtype=np.float64)
+  prev_timestamp = np.array([np.nan if trip is None else trip.timestamp for trip in trips], dtype=np.float64)
+  is_active = ~np.isnan(cur_progress)
+  new_progress = batch.progress
+  accepted = batch.status == STATUS_OK
+  _reject(accepted, ~_first_occurrence(batch.trip_ids), 'duplicate', rejections)
+
+  with np.errstate(invalid='ignore'):  # NaN marks inactive trips and rows without projection
+    _reject(accepted, (batch.distance_to_end_stop < 100) & (cur_progress == new_progress), 'at_end_stop', rejections)
+    backwards = accepted & is_active & (new_progress < cur_progress)
+    for i in np.flatnonzero(backwards):
+      logging.warning("The trip_id {} seems to go backwards. Timestamp {}".format(batch.trip_ids[i],
+                                                                                  batch.timestamps[i]))
+    _reject(accepted, backwards, 'backwards', rejections)
+    _reject(accepted, ~is_active & (batch.prev_stop_seq > 2), 'joined_late', rejections)
+
+    speed = batch.get_avrg_speed(batch.timestamps - prev_timestamp, new_progress - cur_progress)
+    too_fast = accepted & is_active & (speed > 120)  # sanity check
+    for i in np.flatnonzero(too_fast):
+      logging.warning("Trip {} is trying to advance too quick -> {}km/h, timestamp {}".format(
+        batch.trip_ids[i], speed[i], batch.timestamps[i]))
+    _reject(accepted, too_fast, 'too_fast', rejections)
+  _reject(accepted, batch.timestamps == prev_timestamp, 'same_timestamp', rejections)
+  return accepted
+
+
+def _log_rejected(batch, failures=None):
+  """"A TripStateBatch has recorded its failures in its geometry cache, those of the projection workers are recorded
+      in failures when they are first seen."""
+  geometry_cache = getattr(batch, 'geometry_cache', None)
+  recorded = geometry_cache.failures if geometry_cache is not None else None
+  for i in np.flatnonzero(batch.status != STATUS_OK):
+    record = batch.records[i]
+    if batch.status[i] == STATUS_OUT_OF_POLYLINE:
+      logging.warning("Vehicle {1} is out of shape for trip_id {0}".format(record.trip_id, (record.lat, record.lon)))
       continue
+    suffix = ''
+    if failures is not None:
+      if failures is not recorded and record.trip_id not in failures:
+        failures.add(record.trip_id, STATUS_NAMES[batch.status[i]], record.route_id)
+      suppressed = failures.should_warn(record.trip_id)
+      if suppressed is None:
+        continue
+      if suppressed:
+        suffix = ", {} warnings suppressed".format(suppressed)
+    if batch.status[i] == STATUS_FAULTY_TRIP:
+      logging.warning("Faulty trip_id for entity: {}{}".format(record, suffix))
+    elif batch.status[i] == STATUS_STOPS_UNREACHABLE:
+      logging.warning("Couldn't reach all stops for trip_id {}{}".format(record.trip_id, suffix))
+
+
+def _first_occurrence(trip_ids):
+  """"A trip reported by several entities is processed only once per feed."""
+  seen = set()
+  mask = np.zeros(len(trip_ids), dtype=bool)
+  for i, trip_id in enumerate(trip_ids):
+    if trip_id not in seen:
+      seen.add(trip_id)
+      mask[i] = True
+  return mask
 
-  try:
-    feed.ParseFromString(response.content)
-  except DecodeError as e:
-    logging.error("Error while parsing protobuf input. {}".format(e.message))
-  return feed
-
-class ActiveTrips:
-  def __init__(self):
-    self.active_trips = {}
-
-  def is_trip_active(self, trip_id):
-    return self.active_trips.has_key(trip_id)
-
-  def get_trip_progress(self, trip_id):
-    if self.is_trip_active(trip_id):
-      return self.active_trips.get(trip_id)[0]
-    else:
-      return None
-
-  def get_day_for_trip(self, trip_id):
-    if self.is_trip_active(trip_id):
-      return self.active_trips.get(trip_id)[2]
-    else:
-      return None
-
-  def get_timestamp_for_trip(self, trip_id):
-    if self.is_trip_active(trip_id):
-      return self.active_trips.get(trip_id)[1]
-    else:
-      return None
-
-  def add_update_trip(self, trip_id, timestamp, progress):
-    if self.is_trip_active(trip_id):
-      day = self.active_trips[trip_id][2]
-    else:
-      localized_time = datetime.fromtimestamp(float(timestamp), time_zone)
-      day = localized_time.timetuple().tm_yday
-    self.active_trips[trip_id] = (progress, timestamp, day)
-
-  def clean_inactive_trips(self, timestamp):
-    """"Non-active trips are removed after 2 hours"""
-    cnt = 0
-    for trip_id in self.active_trips.keys():
-      if timestamp - self.active_trips[trip_id][1] > 7200:
-        del self.active_trips[trip_id]
-        cnt += 1
-    logging.info("{} trips are no longer active".format(cnt))
 
+def read_feed(url, timeout=None, retry=True):
+  """"Unconditional download, returns None when the feed can't be parsed or, without retry, when the server can't be
+      reached. Use FeedFetcher for polling."""
+  return FeedFetcher(url, timeout).fetch(retry)
 
 if __name__ == "__main__":
   try:
@@ -182,9 +332,32 @@ if __name__ == "__main__":
     parser.add_argument('--sqliteDb', help='A path to sqlite db file', required=True)
     parser.add_argument('--interval', help='A time interval between requests (in secs)', type=int, required=True)
     parser.add_argument('--logFile', help='A time interval between requests (in secs)', required=False)
+    parser.add_argument('--geometryCacheSize', help='Max number of shapes kept in the geometry cache', type=int,
+                        required=False)
+    parser.add_argument('--engine', help='Vehicle projection engine', choices=ENGINES, default=ENGINE_PYTHON)
+    parser.add_argument('--compiledDir', help='A directory for compiled schedules, the gtfs feed is compiled there '
+                                              'and loaded from there on next starts', required=False)
+    parser.add_argument('--partition', help='Split vehicle_log into one db file per service day or week',
+                        choices=PERIODS, required=False)
+    parser.add_argument('--retention', help='Number of newest partitions to keep', type=int, required=False)
+    parser.add_argument('--workers', help='Number of projection worker processes', type=int, required=False)
+    parser.add_argument('--fetchTimeout', help='Realtime feed request timeout (in secs)', type=float, required=False)
+    parser.add_argument('--decoder', help='Realtime feed decoder', choices=DECODERS, default=DECODER_FULL)
+    parser.add_argument('--metricsPort', help='Serve metrics as json on this local port', type=int, required=False)
+    parser.add_argument('--metricsFile', help='Dump metrics as json to this file every minute', required=False)
+    parser.add_argument('--adaptive', help='Time requests by the observed feed regeneration, --interval is used '
+                                           'until it is learned', action='store_true')
+    parser.add_argument('--checkpoint', help='Save active trips to this file and resume them on restart',
+                        required=False)
+    parser.add_argument('--profileDir', help='Write profiles of slow cycles to this directory', required=False)
+    parser.add_argument('--profileThreshold', help='Profile cycles slower than this (in secs), interval by default',
+                        type=float, required=False)
     args = parser.parse_args()
     if args.logFile is not None:
       logging.basicConfig(filename=args.logFile, level=logging.DEBUG)
-    main(args.gtfsZipOrDir, args.feedUrl, args.sqliteDb, args.interval)
+    main(args.gtfsZipOrDir, args.feedUrl, args.sqliteDb, args.interval, args.geometryCacheSize,
+         args.engine, args.compiledDir, args.partition, args.retention, args.workers,
+         args.fetchTimeout, args.decoder, args.metricsPort, args.metricsFile, args.profileDir, args.profileThreshold,
+         args.adaptive, args.checkpoint)
   except KeyboardInterrupt as err:
     logging.info("Ended at {}".format(datetime.now()))
\ No newline at end of file
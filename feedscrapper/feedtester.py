@@ -14,6 +14,8 @@ class FeedTester:
     def compare_feeds(self):
       now = time.time()
       feed = read_feed(self.url)
+      if feed is None:
+        return
       timestamp = feed.header.timestamp
       if timestamp != self.last_timestamp:
         if self.last_timestamp is not None:
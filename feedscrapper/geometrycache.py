@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from transitfeed import Poly
+from transitfeed import Point
+from negativecache import NegativeCache
+from projection import ShapeArrays
+from shapeindex import SegmentIndex
+
+
+class ShapeGeometry:
+    """"Polyline of a single shape with precomputed segment lengths. Instances are shared between TripState objects,
+        so they must be treated as read-only."""
+
+    def __init__(self, shape_id, points):
+        self.shape_id = shape_id
+        self.poly = Poly()
+        for pt in points:
+            self.poly.AddPoint(Point.FromLatLng(pt[0], pt[1]))
+        self.poly.distance = [self.poly.GetPoint(i-1).GetDistanceMeters(self.poly.GetPoint(i))
+                              for i in range(1, len(self.poly.GetPoints()))]
+
+        # cumulative[i] is the distance along the shape to the i-th point
+        self.cumulative = [0]
+        accum_distance = 0
+        for segment_len in self.poly.distance:
+            accum_distance += segment_len
+            self.cumulative.append(accum_distance)
+        self.length = sum(self.poly.distance)
+        self._arrays = None
+        self._index = None
+
+    def get_arrays(self):
+        """"NumPy representation of the segments, built on first use."""
+        if self._arrays is None:
+            self._arrays = ShapeArrays(self)
+        return self._arrays
+
+    def get_index(self):
+        """"Grid index of the segments, built on first use."""
+        if self._index is None:
+            self._index = SegmentIndex(self)
+        return self._index
+
+    def get_num_points(self):
+        return len(self.poly.GetPoints())
+
+    def get_num_segments(self):
+        return len(self.poly.distance)
+
+
+class GeometryCache:
+    """"Bounded LRU store of shape geometries, of StopPatterns keyed by (shape_id, stop_ids) and of TripTimes keyed
+        by trip_id. failures holds trips and stop patterns that can't be projected at all, with the reason, it is the
+        only NegativeCache of a feed."""
+    MAX_SHAPES = 2000
+    MAX_PATTERNS = 10000
+    MAX_TRIPS = 20000
+
+    def __init__(self, max_shapes=None, max_patterns=None, max_trips=None):
+        self.max_shapes = max_shapes or self.MAX_SHAPES
+        self.max_patterns = max_patterns or self.MAX_PATTERNS
+        self.max_trips = max_trips or self.MAX_TRIPS
+        self._shapes = OrderedDict()
+        self._patterns = OrderedDict()
+        self._trips = OrderedDict()
+        self.failures = NegativeCache()
+        self.hits = 0
+        self.misses = 0
+
+    def get_shape(self, schedule, shape_id):
+        geometry = self._lookup(self._shapes, shape_id)
+        if geometry is None:
+            geometry = ShapeGeometry(shape_id, schedule.GetShape(shape_id).points)
+            self._store(self._shapes, shape_id, geometry, self.max_shapes)
+        return geometry
+
+    def get_pattern(self, shape_id, stop_ids):
+        """"Returns the StopPattern stored for this shape and stop sequence or None."""
+        return self._lookup(self._patterns, (shape_id, tuple(stop_ids)))
+
+    def add_pattern(self, pattern):
+        self._store(self._patterns, pattern.get_key(), pattern, self.max_patterns)
+
+    def get_trip_times(self, trip_id):
+        return self._lookup(self._trips, trip_id)
+
+    def add_trip_times(self, trip_times):
+        self._store(self._trips, trip_times.trip_id, trip_times, self.max_trips)
+
+    def get_num_patterns(self):
+        return len(self._patterns)
+
+    def get_num_trips(self):
+        return len(self._trips)
+
+    def clear(self):
+        self._shapes.clear()
+        self._patterns.clear()
+        self._trips.clear()
+        self.failures.clear()
+
+    def __len__(self):
+        return len(self._shapes)
+
+    def _lookup(self, store, key):
+        value = store.pop(key, None)
+        if value is None:
+            self.misses += 1
+            return None
+        store[key] = value  # re-insert to mark it as most recently used
+        self.hits += 1
+        return value
+
+    @staticmethod
+    def _store(store, key, value, max_size):
+        store[key] = value
+        while len(store) > max_size:
+            store.popitem(last=False)
@@ -0,0 +1,154 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Event, Lock, Thread
+from bisect import bisect_left
+from timerthread import TimerThread
+import json
+import logging
+import os
+import time
+
+# upper bounds of histogram buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DUMP_INTERVAL = 60
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def to_dict(self):
+        buckets = dict((str(bound), count) for bound, count in zip(self.buckets, self.counts))
+        buckets['+Inf'] = self.counts[-1]
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'mean': self.sum / self.count if self.count else 0, 'buckets': buckets}
+
+
+class MetricsRegistry:
+    """"Counters, histograms of durations and gauges of the polling loop. Counters and histograms are updated under a
+        lock from any thread, gauges are callables evaluated when a snapshot is taken. A gauge returning a dict adds
+        one value per key."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.started = time.time()
+        self._lock = Lock()
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_counts(self, prefix, counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.counters[prefix + name] = self.counters.get(prefix + name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def set_gauge(self, name, func):
+        self.gauges[name] = func
+
+    def snapshot(self):
+        gauges = {}
+        for name, func in self.gauges.items():
+            try:
+                value = func()
+            except Exception as e:
+                logging.warning("Gauge {} failed. {}".format(name, e))
+                continue
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    gauges[name + '.' + key] = item
+            else:
+                gauges[name] = value
+        with self._lock:
+            return {'time': time.time(), 'uptime': time.time() - self.started, 'counters': dict(self.counters),
+                    'gauges': gauges,
+                    'histograms': dict((name, hist.to_dict()) for name, hist in self.histograms.items())}
+
+
+def dump_json(path, data):
+    """"Replaces the file atomically, so readers never see a partial dump."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as json_file:
+        json.dump(data, json_file, indent=1, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+class MetricsDumper:
+    """"Writes snapshot_func() to a json file every interval seconds and once more on stop."""
+
+    def __init__(self, snapshot_func, path, interval=DUMP_INTERVAL):
+        self.snapshot_func = snapshot_func
+        self.path = path
+        self._stopped = Event()
+        self._thread = TimerThread(self._stopped, interval, self.dump)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def dump(self):
+        try:
+            dump_json(self.path, self.snapshot_func())
+        except (IOError, OSError) as e:
+            logging.warning("Can't write metrics to {}. {}".format(self.path, e))
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.dump()
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """"Serves snapshot_func() as json on every GET from a daemon thread."""
+    daemon_threads = True
+
+    def __init__(self, snapshot_func, port, host='127.0.0.1'):
+        HTTPServer.__init__(self, (host, port), _MetricsHandler)
+        self.snapshot_func = snapshot_func
+
+    @property
+    def url(self):
+        return "http://{}:{}/".format(*self.server_address)
+
+    def start(self):
+        thread = Thread(target=self.serve_forever, name='MetricsServer')
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        content = json.dumps(self.server.snapshot_func(), sort_keys=True)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
@@ -0,0 +1,244 @@
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+from threading import Event
+from threading import Lock
+from adaptivepoller import AdaptivePoller
+from checkpoint import Checkpointer
+from compiledschedule import load_schedule
+from feedfetcher import FeedFetcher
+from feedscrapper import ActiveTrips, get_time_zone, create_db_writer, run_cycle, add_gauges
+from geometrycache import GeometryCache
+from metrics import MetricsRegistry, MetricsServer, MetricsDumper
+from snapshotdiff import SnapshotDiff
+from utils import TripState, ENGINES, ENGINE_PYTHON
+from wiredecoder import DECODER_FULL
+import argparse
+import heapq
+import json
+import logging
+import time
+
+WORKERS = 4
+FETCH_TIMEOUT = 10
+
+
+def load_config(config_file):
+    """"Reads a json config:
+        {"workers": 4, "engine": "numpy", "geometry_cache_size": 500, "compiled_dir": "compiled", "decoder": "fast",
+         "feeds": [{"name": "sofia", "gtfs": "sofia.zip", "feed_url": "http://...", "db": "sofia.db",
+                    "interval": 30, "partition": "day", "retention": 60, "adaptive": true,
+                    "checkpoint": "sofia.trips.npz"}, ...]}
+        Top level compiled_dir, partition, retention and adaptive are defaults for the feeds. Optional top level metrics_port and
+        metrics_file expose the metrics of all feeds keyed by feed name."""
+    with open(config_file) as json_file:
+        config = json.load(json_file)
+    if not config.get('feeds'):
+        raise ValueError("No feeds in {}".format(config_file))
+    names = set()
+    for feed_config in config['feeds']:
+        for key in ('gtfs', 'feed_url', 'db', 'interval'):
+            if key not in feed_config:
+                raise ValueError("Feed {} misses {}".format(feed_config, key))
+        feed_config.setdefault('name', feed_config['feed_url'])
+        if feed_config['name'] in names:
+            raise ValueError("Duplicate feed name {}".format(feed_config['name']))
+        names.add(feed_config['name'])
+        for key in ('compiled_dir', 'partition', 'retention', 'adaptive'):
+            feed_config.setdefault(key, config.get(key))
+        feed_config.setdefault('checkpoint', None)
+    return config
+
+
+class FeedScraper:
+    """"State of one agency: schedule, active trips, geometry cache and db writer. poll runs one scraping cycle, the
+        same as an iteration of the main loop. Shape and trip ids are unique only within a feed, so every feed has
+        its own geometry cache and metrics registry."""
+
+    def __init__(self, name, gtfs_zip_or_dir, feed_url, db_file, interval, compiled_dir=None, partition=None,
+                 retention=None, geometry_cache_size=None, decoder=DECODER_FULL, adaptive=False, checkpoint=None):
+        self.name = name
+        self.gtfs_zip_or_dir = gtfs_zip_or_dir
+        self.feed_url = feed_url
+        self.db_file = db_file
+        self.interval = interval
+        self.compiled_dir = compiled_dir
+        self.partition = partition
+        self.retention = retention
+        self.geometry_cache = GeometryCache(max_shapes=geometry_cache_size)
+        self.fetcher = FeedFetcher(feed_url, FETCH_TIMEOUT, decoder=decoder)
+        self.snapshot_diff = SnapshotDiff()
+        self.metrics = MetricsRegistry()
+        self.failures = self.geometry_cache.failures
+        self.poller = AdaptivePoller(interval) if adaptive else None
+        self.checkpointer = Checkpointer(checkpoint, feed_url=feed_url) if checkpoint else None
+        self.schedule = None
+        self.db_manager = None
+        self.active_trips = None
+        self.running = False
+
+        self.polls = 0
+        self.failed_polls = 0
+        self.overruns = 0
+        self.last_proc_time = 0
+
+    def open(self):
+        """"Loads the schedule and starts the db writer. Returns False for feeds without shapes."""
+        self.schedule = load_schedule(self.gtfs_zip_or_dir, self.compiled_dir)
+        if not self.schedule.GetShapeList():
+            logging.error("Feed {} doesn't contain shape.txt file".format(self.name))
+            return False
+        time_zone = get_time_zone(self.schedule)
+        self.active_trips = ActiveTrips(time_zone)
+        if self.checkpointer is not None:
+            self.checkpointer.restore(self.active_trips)
+        self.db_manager = create_db_writer(self.db_file, time_zone, self.partition, self.retention, self.metrics)
+        add_gauges(self.metrics, self.active_trips, self.db_manager, self.fetcher, self.failures, self.poller,
+                   self.checkpointer)
+        return True
+
+    def poll(self):
+        before = time.time()
+        result = run_cycle(self.schedule, self.fetcher, self.active_trips, self.db_manager, self.metrics,
+                           self.snapshot_diff, self.geometry_cache, retry=False, failures=self.failures,
+                           poller=self.poller, checkpointer=self.checkpointer)
+        if result is None:
+            return
+        cnt, all = result
+        self.polls += 1
+        self.last_proc_time = time.time() - before
+        logging.info("{}: procesing time {}. Saved {} out of {} records. Vehicles changed {}, unchanged {}, new {}. "
+                     "DB queue {}".format(self.name, self.last_proc_time, cnt, all, self.snapshot_diff.changed,
+                                          self.snapshot_diff.unchanged, self.snapshot_diff.new,
+                                          self.db_manager.queue_depth()))
+
+    def close(self):
+        if self.checkpointer is not None and self.active_trips is not None and self.fetcher.feed_timestamp:
+            self.checkpointer.save(self.active_trips, self.fetcher.feed_timestamp)
+        if self.db_manager is not None:
+            self.db_manager.close_connection()
+            self.db_manager = None
+
+
+def get_next_due(due, interval, now):
+    """"Next poll time on the grid started by the first poll, so the processing time doesn't shift the schedule. Ticks
+        that already passed are skipped."""
+    next_due = due + interval
+    if next_due <= now:
+        next_due += ((now - next_due) // interval + 1) * interval
+    return next_due
+
+
+class MultiFeedScheduler:
+    """"Polls many feeds from one process. The scheduler thread keeps the feeds in a heap ordered by their next due
+        time and hands due feeds to a pool of worker threads, so a slow download or projection delays only its own
+        feed. A feed still being processed when it is due again skips that tick and counts an overrun. Feeds with an
+        AdaptivePoller are put back into the heap when their poll completes, at the time the poller asks for."""
+    MAX_WAIT = 1
+
+    def __init__(self, scrapers, workers=WORKERS):
+        self.scrapers = scrapers
+        self.workers = workers
+        self._stopped = Event()
+        self._wakeup = Event()
+        self._lock = Lock()
+        self._heap = []
+
+    def run(self, duration=None):
+        """"Polls until stop is called or for duration seconds."""
+        pool = ThreadPool(self.workers)
+        start = time.time()
+        self._heap = [(start, i, scraper) for i, scraper in enumerate(self.scrapers)]
+        heapq.heapify(self._heap)
+        try:
+            while self.scrapers and not self._stopped.is_set():
+                now = time.time()
+                if duration is not None and now - start >= duration:
+                    break
+                with self._lock:
+                    due, seq, scraper = self._heap[0] if self._heap else (None, None, None)
+                    if due is not None and due <= now:
+                        heapq.heappop(self._heap)
+                        busy = scraper.running
+                        scraper.running = True
+                if due is None or due > now:
+                    wait_until = due if due is not None else now + self.MAX_WAIT
+                    if duration is not None:
+                        wait_until = min(wait_until, start + duration)
+                    self._wakeup.wait(wait_until - now)
+                    self._wakeup.clear()
+                    continue
+                if busy:
+                    scraper.overruns += 1
+                    scraper.metrics.count('cycles.overrun')
+                    logging.warning("{}: previous poll is still running".format(scraper.name))
+                else:
+                    pool.apply_async(self._poll, (scraper, seq))
+                if busy or scraper.poller is None:
+                    self._push(get_next_due(due, scraper.interval, now), seq, scraper)
+        finally:
+            pool.close()
+            pool.join()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def _push(self, due, seq, scraper):
+        with self._lock:
+            heapq.heappush(self._heap, (due, seq, scraper))
+        self._wakeup.set()
+
+    def _poll(self, scraper, seq):
+        try:
+            scraper.poll()
+        except Exception:
+            scraper.failed_polls += 1
+            logging.exception("{}: poll failed".format(scraper.name))
+        finally:
+            with self._lock:
+                scraper.running = False
+            if scraper.poller is not None:
+                now = time.time()
+                self._push(now + scraper.poller.get_delay(now), seq, scraper)
+
+
+def main(config_file):
+    config = load_config(config_file)
+    TripState.ENGINE = config.get('engine', ENGINE_PYTHON)
+    if TripState.ENGINE not in ENGINES:
+        raise ValueError("Unknown engine {}".format(TripState.ENGINE))
+    scrapers = []
+    snapshot = lambda: dict((scraper.name, scraper.metrics.snapshot()) for scraper in scrapers)
+    metrics_server = MetricsServer(snapshot, config['metrics_port']).start() if config.get('metrics_port') else None
+    metrics_dumper = MetricsDumper(snapshot, config['metrics_file']).start() if config.get('metrics_file') else None
+    try:
+        for feed_config in config['feeds']:
+            scraper = FeedScraper(feed_config['name'], feed_config['gtfs'], feed_config['feed_url'], feed_config['db'],
+                                  feed_config['interval'], feed_config['compiled_dir'], feed_config['partition'],
+                                  feed_config['retention'], config.get('geometry_cache_size'),
+                                  config.get('decoder', DECODER_FULL), feed_config['adaptive'],
+                                  feed_config['checkpoint'])
+            if scraper.open():
+                scrapers.append(scraper)
+        logging.info("Start polling {} feeds at local time {}".format(len(scrapers), datetime.now()))
+        MultiFeedScheduler(scrapers, config.get('workers', WORKERS)).run()
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        if metrics_dumper is not None:
+            metrics_dumper.stop()
+        for scraper in scrapers:
+            scraper.close()
+
+
+if __name__ == "__main__":
+    try:
+        parser = argparse.ArgumentParser(description='Scrapes many gtfs realtime feeds from one process.')
+        parser.add_argument('--config', help='A json file listing the feeds', required=True)
+        parser.add_argument('--logFile', help='A path to log file', required=False)
+        args = parser.parse_args()
+        if args.logFile is not None:
+            logging.basicConfig(filename=args.logFile, level=logging.DEBUG)
+        main(args.config)
+    except KeyboardInterrupt as err:
+        logging.info("Ended at {}".format(datetime.now()))
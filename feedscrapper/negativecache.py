@@ -0,0 +1,94 @@
+from collections import OrderedDict
+import time
+
+
+class NegativeCache:
+    """"Remembers keys, e.g. trip_ids, that can't be processed and why, so the work isn't repeated for every feed
+        snapshot. Entries expire ttl seconds after they were added, the oldest ones are evicted above max_entries.
+        should_warn lets a caller log a failure once per warning_interval instead of on every sighting."""
+    TTL = 3600
+    WARNING_INTERVAL = 900
+    MAX_ENTRIES = 10000
+    REPORT_SIZE = 100
+
+    def __init__(self, ttl=None, warning_interval=None, max_entries=None):
+        self.ttl = ttl or self.TTL
+        self.warning_interval = warning_interval or self.WARNING_INTERVAL
+        self.max_entries = max_entries or self.MAX_ENTRIES
+        self._entries = OrderedDict()
+        self.hits = 0
+
+    def get(self, key, now=None):
+        """"Returns the reason stored for the key or None if there is no live entry."""
+        entry = self._get_entry(key, now)
+        if entry is None:
+            return None
+        entry['seen'] += 1
+        entry['last_seen'] = now or time.time()
+        self.hits += 1
+        return entry['reason']
+
+    def add(self, key, reason, detail=None, now=None):
+        """"Stores a new entry or counts one more sighting of a live one without extending its expiry."""
+        now = now or time.time()
+        entry = self._get_entry(key, now)
+        if entry is None or entry['reason'] != reason:
+            entry = {'key': key, 'reason': reason, 'detail': detail, 'first_seen': now, 'last_seen': now, 'seen': 0,
+                     'expires': now + self.ttl, 'warned': None, 'suppressed': 0}
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        entry['seen'] += 1
+        entry['last_seen'] = now
+        return entry
+
+    def should_warn(self, key, now=None):
+        """"Returns the number of warnings suppressed since the last one if it is time to warn about the key again,
+            otherwise None."""
+        now = now or time.time()
+        entry = self._get_entry(key, now)
+        if entry is None:
+            return None
+        if entry['warned'] is not None and now - entry['warned'] < self.warning_interval:
+            entry['suppressed'] += 1
+            return None
+        suppressed = entry['suppressed']
+        entry['warned'] = now
+        entry['suppressed'] = 0
+        return suppressed
+
+    def get_report(self, size=None, now=None):
+        """"Live entries seen most often first."""
+        now = now or time.time()
+        entries = [entry for entry in self._entries.values() if entry['expires'] > now]
+        entries.sort(key=lambda entry: entry['seen'], reverse=True)
+        return [{'key': entry['key'], 'reason': entry['reason'], 'detail': entry['detail'], 'seen': entry['seen'],
+                 'first_seen': entry['first_seen'], 'last_seen': entry['last_seen']}
+                for entry in entries[:size or self.REPORT_SIZE]]
+
+    def get_stats(self, now=None):
+        now = now or time.time()
+        stats = {'entries': 0, 'hits': self.hits}
+        for entry in self._entries.values():
+            if entry['expires'] > now:
+                stats['entries'] += 1
+                stats[entry['reason']] = stats.get(entry['reason'], 0) + 1
+        return stats
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """"Tells whether the key has a live entry without counting a sighting."""
+        return self._get_entry(key, None) is not None
+
+    def _get_entry(self, key, now):
+        entry = self._entries.get(key)
+        if entry is not None and entry['expires'] <= (now or time.time()):
+            del self._entries[key]
+            return None
+        return entry
@@ -0,0 +1,158 @@
+from multiprocessing import Process, Queue
+from Queue import Empty
+from compiledschedule import load_schedule
+from geometrycache import GeometryCache
+from tripbatch import TripStateBatch, BatchResult, VehicleRecord, RESULT_COLUMNS, empty_columns, get_vehicle_records
+from utils import TripState
+import logging
+import traceback
+import zlib
+
+
+class ProjectionWorkerError(Exception):
+    pass
+
+
+class ProjectionPool:
+    """"Projects vehicles in worker processes. Vehicles are sharded by the shape of their trip, so a shape always goes
+        to the same worker and stays warm in that worker's geometry cache. Trips unknown to the schedule, or all trips
+        without schedule, are sharded by trip_id. Workers get compact (trip_id, stop_id, lat, lon, timestamp) tuples
+        and send back the result columns of a TripStateBatch, ActiveTrips and the db writes stay in the calling
+        process.
+        Every worker loads the schedule itself, with compiled_dir the workers share the memory-mapped arrays. restart
+        replaces failed workers, restarts are counted as projection.restarts in the metrics registry when given."""
+    RESULT_TIMEOUT = 60
+
+    def __init__(self, gtfs_zip_or_dir, workers, compiled_dir=None, engine=None, geometry_cache_size=None,
+                 schedule=None, metrics=None):
+        self.workers = workers
+        self.schedule = schedule
+        self.metrics = metrics
+        self._worker_args = (gtfs_zip_or_dir, compiled_dir, engine or TripState.ENGINE, geometry_cache_size)
+        self._shapes = {}
+        self._cycle = 0
+        self._start()
+
+    def _start(self):
+        self._results = Queue()
+        self._tasks = []
+        self._processes = []
+        self._running = False
+        for worker_id in range(self.workers):
+            tasks = Queue()
+            process = Process(target=_run_worker, name='ProjectionWorker-{}'.format(worker_id),
+                              args=(worker_id,) + self._worker_args + (tasks, self._results))
+            process.daemon = True
+            process.start()
+            self._tasks.append(tasks)
+            self._processes.append(process)
+        for i in range(self.workers):
+            cycle, worker_id, columns, error = self._get_result()
+            if error is not None:
+                self.close()
+                raise ProjectionWorkerError("Worker {} failed to start\n{}".format(worker_id, error))
+        self._running = True
+        logging.info("{} projection workers started".format(self.workers))
+
+    def restart(self):
+        """"Replaces the workers after a failure. Returns False if they can't be started, the next project call then
+            fails right away."""
+        if self.metrics is not None:
+            self.metrics.count('projection.restarts')
+        for process in self._processes:
+            process.terminate()
+            process.join()
+        try:
+            self._start()
+        except ProjectionWorkerError as e:
+            logging.error("Projection workers can't be restarted. {}".format(e))
+            return False
+        return True
+
+    def get_shard_key(self, trip_id):
+        shape_id = self._shapes.get(trip_id)
+        if shape_id is None and self.schedule is not None:
+            try:
+                shape_id = self._shapes[trip_id] = self.schedule.GetTrip(trip_id).shape_id
+            except KeyError:
+                pass
+        return shape_id or trip_id
+
+    def get_shard(self, key):
+        return zlib.crc32(key.encode('utf-8')) % self.workers
+
+    def project(self, records, last_segments=None):
+        """"Returns BatchResult for the VehicleRecords, last_segments are hints as in TripStateBatch."""
+        if not self._running:
+            raise ProjectionWorkerError("Projection workers are not running")
+        self._cycle += 1
+        shards = [[] for i in range(self.workers)]
+        for i, rec in enumerate(records):
+            shards[self.get_shard(self.get_shard_key(rec.trip_id))].append(i)
+        pending = 0
+        for worker_id, rows in enumerate(shards):
+            if rows:
+                vehicles = [(records[i].trip_id, records[i].stop_id, records[i].lat, records[i].lon,
+                             records[i].timestamp) for i in rows]
+                hints = [last_segments[i] for i in rows] if last_segments is not None else None
+                self._tasks[worker_id].put((self._cycle, vehicles, hints))
+                pending += 1
+
+        columns = empty_columns(len(records))
+        while pending:
+            cycle, worker_id, part, error = self._get_result()
+            if cycle != self._cycle:
+                # left by a cycle that failed
+                continue
+            pending -= 1
+            if error is not None:
+                raise ProjectionWorkerError("Worker {} failed\n{}".format(worker_id, error))
+            for name in RESULT_COLUMNS:
+                columns[name][shards[worker_id]] = part[name]
+        return BatchResult(records, columns)
+
+    def project_feed(self, feed, last_segments=None):
+        """"last_segments is a callable as in TripStateBatch.from_feed."""
+        records = get_vehicle_records(feed)
+        hints = [last_segments(rec.trip_id) for rec in records] if last_segments is not None else None
+        return self.project(records, hints)
+
+    def close(self):
+        self._running = False
+        for tasks in self._tasks:
+            tasks.put(None)
+        for process in self._processes:
+            process.join(self.RESULT_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+
+    def _get_result(self):
+        while True:
+            try:
+                return self._results.get(timeout=self.RESULT_TIMEOUT)
+            except Empty:
+                dead = [process.name for process in self._processes if not process.is_alive()]
+                if dead:
+                    raise ProjectionWorkerError("Projection workers {} are not running".format(dead))
+
+
+def _run_worker(worker_id, gtfs_zip_or_dir, compiled_dir, engine, geometry_cache_size, tasks, results):
+    try:
+        schedule = load_schedule(gtfs_zip_or_dir, compiled_dir)
+        geometry_cache = GeometryCache(max_shapes=geometry_cache_size)
+    except Exception:
+        results.put((0, worker_id, None, traceback.format_exc()))
+        return
+    results.put((0, worker_id, None, None))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        cycle, vehicles, hints = task
+        try:
+            records = [VehicleRecord(trip_id, '', stop_id, lat, lon, timestamp)
+                       for trip_id, stop_id, lat, lon, timestamp in vehicles]
+            batch = TripStateBatch(schedule, records, engine, geometry_cache, hints)
+            results.put((cycle, worker_id, batch.get_columns(), None))
+        except Exception:
+            results.put((cycle, worker_id, None, traceback.format_exc()))
@@ -0,0 +1,211 @@
+from datetime import datetime, timedelta
+from dbmanager import DbManager
+import glob
+import logging
+import os
+import re
+import sqlite3
+
+PERIOD_DAY = 'day'
+PERIOD_WEEK = 'week'
+PERIODS = (PERIOD_DAY, PERIOD_WEEK)
+SQLITE_MAX_ATTACHED = 10
+ROLLOVER_HOUR = 3
+INDEX_NAMES = frozenset(('trip_index', 'time_index'))
+
+
+def get_partition_key(timestamp, time_zone, period=PERIOD_DAY, rollover_hour=ROLLOVER_HOUR):
+    """"Service day as YYYYMMDD or ISO week as YYYYWww of the timestamp, a day ends at rollover_hour local time."""
+    local_time = datetime.fromtimestamp(float(timestamp), time_zone) - timedelta(hours=rollover_hour)
+    if period == PERIOD_WEEK:
+        year, week, weekday = local_time.isocalendar()
+        return "{}W{:02d}".format(year, week)
+    return local_time.strftime("%Y%m%d")
+
+
+class PartitionedDbManager:
+    """"vehicle_log split into one SQLite file per service day or week, next to db_file: log.db is stored as
+        log.20180219.db or log.2018W08.db. It has the DbManager write interface, so DbWriter can use it.
+
+        The live partitions are written without secondary indexes, they are built when a partition is closed on
+        rollover. Closed partitions can be compacted or dropped without touching the live one. A service day ends at
+        ROLLOVER_HOUR local time, so trips running past midnight stay in their day's partition. The previous partition
+        stays open for late rows, rows of older ones are written through a short-lived connection. Partitions left
+        without indexes, e.g. the live one after a crash, are indexed when the first partition is opened."""
+    ROLLOVER_HOUR = ROLLOVER_HOUR
+
+    def __init__(self, db_file, time_zone, period=PERIOD_DAY, retention=None, timeout=5.0, wal=False):
+        """"retention is the number of newest partitions to keep, older ones are deleted on rollover."""
+        if period not in PERIODS:
+            raise ValueError("Unknown partition period {}".format(period))
+        self.base, self.ext = os.path.splitext(db_file)
+        self.time_zone = time_zone
+        self.period = period
+        self.retention = retention
+        self.timeout = timeout
+        self.wal = wal
+        self._open = {}
+        self._live_key = None
+
+    def get_partition_key(self, timestamp):
+        return get_partition_key(timestamp, self.time_zone, self.period, self.ROLLOVER_HOUR)
+
+    def get_partition_path(self, key):
+        return "{}.{}{}".format(self.base, key, self.ext or '.db')
+
+    def list_partitions(self):
+        """"Keys of partitions existing on disk, oldest first."""
+        pattern = re.compile(re.escape(os.path.basename(self.base)) + r'\.(\d{8}|\d{4}W\d{2})' +
+                             re.escape(self.ext or '.db') + '$')
+        keys = []
+        for path in glob.glob(self.get_partition_path('*')):
+            match = pattern.match(os.path.basename(path))
+            if match:
+                keys.append(match.group(1))
+        return sorted(keys)
+
+    def insert_log(self, route_id, trip_id, stop_seq, sampling_time, day, delay_sec, progress, inter_progress):
+        self.insert_logs([(route_id, trip_id, stop_seq, sampling_time, day, delay_sec, progress, inter_progress)])
+
+    def insert_logs(self, rows):
+        by_partition = {}
+        for row in rows:
+            by_partition.setdefault(self.get_partition_key(row[3]), []).append(row)
+        for key in sorted(by_partition):
+            if self._live_key is not None and key < self._live_key and key not in self._open:
+                self._insert_late(key, by_partition[key])
+            else:
+                self._get_partition(key).insert_logs(by_partition[key])
+
+    def commit(self):
+        for db_manager in self._open.values():
+            db_manager.commit()
+
+    def rollback(self):
+        for db_manager in self._open.values():
+            db_manager.rollback()
+
+    def close_connection(self):
+        for key in self._open.keys():
+            self._close_partition(key)
+
+    def _get_partition(self, key):
+        db_manager = self._open.get(key)
+        if db_manager is None:
+            db_manager = DbManager(self.get_partition_path(key), timeout=self.timeout, wal=self.wal, indexes=False)
+            self._open[key] = db_manager
+            if self._live_key is None or key > self._live_key:
+                self._rollover(key)
+        return db_manager
+
+    def _insert_late(self, key, rows):
+        """"Rows of a closed partition are committed right away, so the partition stays closed and indexed."""
+        db_manager = DbManager(self.get_partition_path(key), timeout=self.timeout)
+        try:
+            db_manager.insert_logs(rows)
+            db_manager.commit()
+        finally:
+            db_manager.close_connection()
+
+    def _rollover(self, key):
+        """"Late rows of the previous partition can still come, older partitions are closed."""
+        previous_key = self._live_key
+        self._live_key = key
+        if previous_key is None:
+            self._index_partitions(key)
+        for open_key in self._open.keys():
+            if open_key < key and open_key != previous_key:
+                self._close_partition(open_key)
+        if previous_key is not None:
+            logging.info("vehicle_log rolled over to partition {}".format(key))
+        if self.retention:
+            self.prune_partitions(self.retention)
+
+    def _close_partition(self, key):
+        db_manager = self._open.pop(key)
+        db_manager.commit()
+        db_manager.create_indexes()
+        db_manager.close_connection()
+
+    def _index_partitions(self, live_key):
+        for key in self.list_partitions():
+            if key < live_key and key not in self._open and not self._has_indexes(key):
+                logging.info("Building missing indexes of partition {}".format(key))
+                DbManager(self.get_partition_path(key), timeout=self.timeout).close_connection()
+
+    def is_closed(self, key):
+        """"Tells whether the partition was closed on rollover, closed partitions are indexed and get only late rows."""
+        return key not in self._open and self._has_indexes(key)
+
+    def _has_indexes(self, key):
+        conn = sqlite3.connect(self.get_partition_path(key), timeout=self.timeout)
+        try:
+            names = set(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'"))
+        finally:
+            conn.close()
+        return INDEX_NAMES <= names
+
+    def prune_partitions(self, keep):
+        """"Deletes all but the keep newest partitions, open ones are never deleted."""
+        keys = self.list_partitions()
+        removed = []
+        for key in keys[:max(len(keys) - keep, 0)]:
+            if key in self._open:
+                continue
+            for suffix in ('', '-wal', '-shm', '-journal'):
+                path = self.get_partition_path(key) + suffix
+                if os.path.isfile(path):
+                    os.remove(path)
+            removed.append(key)
+        if removed:
+            logging.info("Removed vehicle_log partitions {}".format(removed))
+        return removed
+
+    def compact_partition(self, key):
+        """"Rewrites a closed partition with VACUUM INTO, the copy replaces the original file."""
+        if key in self._open:
+            raise ValueError("Partition {} is in use".format(key))
+        path = self.get_partition_path(key)
+        tmp_path = path + '.compact'
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        conn = sqlite3.connect(path, timeout=self.timeout)
+        try:
+            conn.execute("VACUUM INTO ?", (tmp_path,))
+        finally:
+            conn.close()
+        os.rename(tmp_path, path)
+
+    def open_reader(self, start_key=None, end_key=None):
+        """"Returns a connection with a temporary vehicle_log view over the partitions from start_key to end_key. SQLite
+            attaches at most SQLITE_MAX_ATTACHED databases, use query_log for longer ranges."""
+        keys = self._get_keys(start_key, end_key)
+        if len(keys) > SQLITE_MAX_ATTACHED:
+            raise ValueError("Too many partitions for a view: {}".format(len(keys)))
+        conn = sqlite3.connect(':memory:', timeout=self.timeout)
+        selects = []
+        for i, key in enumerate(keys):
+            conn.execute("ATTACH DATABASE ? AS p{}".format(i), (self.get_partition_path(key),))
+            selects.append("SELECT * FROM p{}.vehicle_log".format(i))
+        if not selects:
+            selects.append("SELECT * FROM (SELECT NULL AS route_id, NULL AS trip_id, NULL AS time, NULL AS day, "
+                           "NULL AS stop_seq, NULL AS stop_progress, NULL AS delay_sec, NULL AS progress) WHERE 0")
+        conn.execute("CREATE TEMP VIEW vehicle_log AS " + " UNION ALL ".join(selects))
+        return conn
+
+    def query_log(self, where='', params=(), start_key=None, end_key=None):
+        """"Yields vehicle_log rows from all partitions in the key range, optionally filtered by a WHERE clause."""
+        sql = "SELECT route_id, trip_id, time, day, stop_seq, stop_progress, delay_sec, progress FROM vehicle_log"
+        if where:
+            sql += " WHERE " + where
+        for key in self._get_keys(start_key, end_key):
+            conn = sqlite3.connect(self.get_partition_path(key), timeout=self.timeout)
+            try:
+                for row in conn.execute(sql, params):
+                    yield row
+            finally:
+                conn.close()
+
+    def _get_keys(self, start_key, end_key):
+        return [key for key in self.list_partitions()
+                if (start_key is None or key >= start_key) and (end_key is None or key <= end_key)]
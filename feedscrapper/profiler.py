@@ -0,0 +1,127 @@
+from datetime import datetime
+import heapq
+import json
+import logging
+import os
+import signal
+import time
+
+SAMPLE_INTERVAL = 0.005
+TOP_N = 20
+TOP_FUNCTIONS = 30
+
+
+class StackSampler:
+    """"Statistical profiler of the main thread. A SIGPROF timer fires every interval seconds of CPU time and the
+        handler counts the current call stack, so the overhead stays small enough to sample every cycle. Interrupted
+        system calls are restarted, waiting for the network or the db isn't sampled."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self._previous_handler = None
+
+    def start(self):
+        self.stacks = {}
+        self.samples = 0
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append("{} ({}:{})".format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+        self.samples += 1
+
+    def get_folded(self):
+        """"Stacks in the folded format of flame graph tools, one 'outer;inner count' line per stack."""
+        return ["{} {}".format(';'.join(stack), count) for stack, count in sorted(self.stacks.items())]
+
+    def get_top_functions(self, count=TOP_FUNCTIONS):
+        """"Functions with the most samples in their own code (self) and anywhere below them (total)."""
+        own, total = {}, {}
+        for stack, samples in self.stacks.items():
+            own[stack[-1]] = own.get(stack[-1], 0) + samples
+            for function in set(stack):
+                total[function] = total.get(function, 0) + samples
+        top = sorted(total, key=lambda function: (-own.get(function, 0), -total[function]))[:count]
+        return [{'function': function, 'self': own.get(function, 0), 'total': total[function]} for function in top]
+
+
+class ConstructionLog:
+    """"The top_n most expensive vehicle projections of a cycle, one entry per TripState construction or
+        TripStateBatch row, including the build of the trip schedule when it wasn't cached. scanned tells that the stops were snapped to the shape, not found in the geometry cache,
+        fallback that some stop was reachable only with the 3 times bigger tolerance."""
+
+    def __init__(self, top_n=TOP_N):
+        self.top_n = top_n
+        self._heap = []
+        self._seq = 0
+
+    def add(self, seconds, trip_id, shape_id, points, stops, scanned, fallback):
+        self._seq += 1
+        entry = (seconds, self._seq, {'seconds': seconds, 'trip_id': trip_id, 'shape_id': shape_id, 'points': points,
+                                      'stops': stops, 'scanned': scanned, 'fallback': fallback})
+        if len(self._heap) < self.top_n:
+            heapq.heappush(self._heap, entry)
+        elif seconds > self._heap[0][0]:
+            heapq.heapreplace(self._heap, entry)
+
+    def get_top(self):
+        return [entry[2] for entry in sorted(self._heap, reverse=True)]
+
+    def clear(self):
+        self._heap = []
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class CycleProfiler:
+    """"Samples every cycle and writes the profile of cycles slower than threshold seconds to output_dir: a json
+        report with the top functions and the most expensive trip projections and the folded stacks for flame graphs.
+        Only the main thread is sampled, projections in worker processes show up as waiting for results."""
+
+    def __init__(self, output_dir, threshold, interval=SAMPLE_INTERVAL, top_n=TOP_N):
+        self.output_dir = output_dir
+        self.threshold = threshold
+        self.sampler = StackSampler(interval)
+        self.constructions = ConstructionLog(top_n)
+        self.profiled = 0
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+    def start_cycle(self):
+        self.constructions.clear()
+        self.sampler.start()
+
+    def end_cycle(self, seconds, info=None):
+        """"Returns the path of the written report or None when the cycle was fast enough."""
+        self.sampler.stop()
+        if seconds < self.threshold:
+            return None
+        path = os.path.join(self.output_dir, "cycle-{}".format(datetime.now().strftime('%Y%m%d-%H%M%S-%f')))
+        report = {'seconds': seconds, 'threshold': self.threshold, 'interval': self.sampler.interval,
+                  'samples': self.sampler.samples, 'info': info or {},
+                  'functions': self.sampler.get_top_functions(), 'constructions': self.constructions.get_top()}
+        try:
+            with open(path + '.json', 'w') as json_file:
+                json.dump(report, json_file, indent=1, sort_keys=True)
+            with open(path + '.folded', 'w') as folded_file:
+                folded_file.write('\n'.join(self.sampler.get_folded()) + '\n')
+        except (IOError, OSError) as e:
+            logging.warning("Can't write cycle profile to {}. {}".format(path, e))
+            return None
+        self.profiled += 1
+        logging.warning("Cycle took {}s, profile written to {}.json".format(seconds, path))
+        return path + '.json'
@@ -0,0 +1,147 @@
+"""Vectorized counterpart of utils.reach_to_point for projecting points on a whole shape at once.
+
+It reproduces the arithmetic of transitfeed.shapelib on arrays of unit vectors, so results match the pure Python
+engine up to floating point rounding."""
+import copy
+import numpy as np
+
+EARTH_RADIUS_METERS = 6371010.0
+MAPPING_ERROR = 10
+MAX_MATRIX_SIZE = 2 ** 21
+
+
+class ShapeArrays:
+    """"Segments of a ShapeGeometry stored as NumPy arrays."""
+
+    def __init__(self, geometry):
+        self.points = to_vectors(geometry.poly.GetPoints())
+        self.pt_a = self.points[:-1]
+        self.pt_b = self.points[1:]
+        self.segment_len = np.array(geometry.poly.distance, dtype=np.float64)
+        self.cumulative = np.array(geometry.cumulative[:-1], dtype=np.float64)
+
+        # RobustCrossProd from shapelib, degenerate segments are marked and never projected on
+        cross = np.cross(self.pt_a + self.pt_b, self.pt_b - self.pt_a)
+        self.degenerate = ~(np.abs(cross) > 1e-15).any(axis=1)
+        norm = _norm(cross)
+        norm[self.degenerate] = 1
+        self.a_cross_b = cross / norm[:, np.newaxis]
+        self.segment_ids = np.arange(len(self.segment_len))
+
+    def subset(self, segments):
+        """"ShapeArrays restricted to the given segment indexes."""
+        subset = copy.copy(self)
+        segments = np.asarray(segments, dtype=np.int64)
+        for name in ('pt_a', 'pt_b', 'segment_len', 'cumulative', 'degenerate', 'a_cross_b', 'segment_ids'):
+            setattr(subset, name, getattr(self, name)[segments])
+        return subset
+
+    def __len__(self):
+        return len(self.segment_len)
+
+
+def get_angle(u, v):
+    return np.arctan2(_norm(np.cross(u, v)), (u * v).sum(axis=-1))
+
+
+def to_vectors(points):
+    """"Converts a sequence of transitfeed Points to an (n, 3) array."""
+    return np.array([(pt.x, pt.y, pt.z) for pt in points], dtype=np.float64).reshape(-1, 3)
+
+
+def get_closest_points(x, a, b, a_cross_b, degenerate):
+    """"Row-wise shapelib.GetClosestPoint."""
+    p = x - a_cross_b * ((x * a_cross_b).sum(axis=1) / (a_cross_b * a_cross_b).sum(axis=1))[:, np.newaxis]
+    inside = ~degenerate & ((np.cross(p, a_cross_b) * a).sum(axis=1) > 0) & \
+        ((np.cross(a_cross_b, p) * b).sum(axis=1) > 0)
+    closer_to_a = _norm(x - a) <= _norm(x - b)
+    closest = np.where(closer_to_a[:, np.newaxis], a, b)
+    closest[inside] = p[inside] / _norm(p[inside])[:, np.newaxis]
+    return closest
+
+
+def project_points(arrays, vectors, allowed_error, min_distance=None, max_distance=None, start_segment=None,
+                   segments=None, end_segment=None):
+    """"Projects every row of vectors on the shape and returns (distance, error, segment) arrays.
+
+        For each point the closest reachable segment within (min_distance, max_distance] is taken, otherwise the closest
+        one on the whole shape. Points that are farther than allowed_error from every segment get segment -1 and NaN
+        distance and error. Only segments from start_segment to end_segment inclusive are checked and if segments are
+        given, only those of them."""
+    if segments is not None:
+        arrays = arrays.subset(segments)
+    count = len(vectors)
+    distance = np.full(count, np.nan)
+    error = np.full(count, np.nan)
+    segment = np.full(count, -1, dtype=np.int64)
+    if count == 0 or len(arrays) == 0:
+        return distance, error, segment
+
+    min_distance = _broadcast(min_distance, count, -0.1)
+    max_distance = _broadcast(max_distance, count, float("inf"))
+    start_segment = _broadcast(start_segment, count, 0).astype(np.int64)
+    end_segment = _broadcast(end_segment, count, arrays.segment_ids[-1]).astype(np.int64)
+
+    rows_per_chunk = max(1, MAX_MATRIX_SIZE // len(arrays))
+    for begin in range(0, count, rows_per_chunk):
+        end = min(begin + rows_per_chunk, count)
+        rows = slice(begin, end)
+        res = _project_chunk(arrays, vectors[rows], allowed_error, min_distance[rows], max_distance[rows],
+                             start_segment[rows], end_segment[rows])
+        distance[rows], error[rows], segment[rows] = res
+    return distance, error, segment
+
+
+def _project_chunk(arrays, vectors, allowed_error, min_distance, max_distance, start_segment, end_segment):
+    count, num_segments = len(vectors), len(arrays)
+    a_x_len = get_angle(arrays.pt_a[np.newaxis, :, :], vectors[:, np.newaxis, :]) * EARTH_RADIUS_METERS
+    segment_len = arrays.segment_len[np.newaxis, :]
+    candidates = (a_x_len < 50) | (segment_len > a_x_len - MAPPING_ERROR) | \
+        (np.abs(segment_len - a_x_len) < allowed_error)
+    candidates &= arrays.segment_ids[np.newaxis, :] >= start_segment[:, np.newaxis]
+    candidates &= arrays.segment_ids[np.newaxis, :] <= end_segment[:, np.newaxis]
+
+    rows, cols = np.nonzero(candidates)
+    x = vectors[rows]
+    pt_a = arrays.pt_a[cols]
+    closest = get_closest_points(x, pt_a, arrays.pt_b[cols], arrays.a_cross_b[cols], arrays.degenerate[cols])
+    err = get_angle(closest, x) * EARTH_RADIUS_METERS
+    reached = err <= allowed_error
+    rows, cols, err = rows[reached], cols[reached], err[reached]
+    dist = arrays.cumulative[cols] + get_angle(pt_a[reached], closest[reached]) * EARTH_RADIUS_METERS
+
+    restricted = (min_distance[rows] < dist) & (dist <= max_distance[rows])
+    best_any = _pick_best(rows, cols, err, count, num_segments)
+    best_restricted = _pick_best(rows[restricted], cols[restricted], err[restricted], count, num_segments)
+    has_restricted = best_restricted >= 0
+    best_restricted[has_restricted] = np.flatnonzero(restricted)[best_restricted[has_restricted]]
+    best = np.where(best_restricted >= 0, best_restricted, best_any)
+
+    distance = np.full(count, np.nan)
+    error = np.full(count, np.nan)
+    segment = np.full(count, -1, dtype=np.int64)
+    found = best >= 0
+    distance[found] = dist[best[found]]
+    error[found] = err[best[found]]
+    segment[found] = arrays.segment_ids[cols[best[found]]]
+    return distance, error, segment
+
+
+def _pick_best(rows, cols, err, count, num_segments):
+    """"Index of the (row, col) pair with the smallest error for every row, the first segment wins on ties and -1 is
+        returned for rows without pairs."""
+    errors = np.full((count, num_segments), np.inf)
+    errors[rows, cols] = err
+    pair_index = np.full((count, num_segments), -1, dtype=np.int64)
+    pair_index[rows, cols] = np.arange(len(rows))
+    return pair_index[np.arange(count), errors.argmin(axis=1)]
+
+
+def _broadcast(value, count, default):
+    if value is None:
+        value = default
+    return np.array(np.broadcast_to(np.asarray(value, dtype=np.float64), (count,)))
+
+
+def _norm(v):
+    return np.sqrt((v * v).sum(axis=-1))
@@ -0,0 +1,169 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+from threading import Thread, Lock
+import argparse
+import hashlib
+import logging
+import requests
+import struct
+import time
+
+MAGIC = 'GTFSREC1'
+_RECORD_HEADER = struct.Struct('<dI')
+
+
+class RecordingWriter:
+    """"Appends raw feed snapshots with their fetch time to a recording file: MAGIC followed by (time, length)
+        headers and payloads."""
+
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.count = 0
+
+    def write(self, fetch_time, data):
+        self.file.write(_RECORD_HEADER.pack(fetch_time, len(data)))
+        self.file.write(data)
+        self.count += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_recording(path):
+    """"Yields (fetch time, payload) of every snapshot in a recording."""
+    with open(path, 'rb') as rec_file:
+        if rec_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a feed recording".format(path))
+        while True:
+            header = rec_file.read(_RECORD_HEADER.size)
+            if not header:
+                break
+            if len(header) < _RECORD_HEADER.size:
+                raise ValueError("Truncated recording {}".format(path))
+            fetch_time, length = _RECORD_HEADER.unpack(header)
+            data = rec_file.read(length)
+            if len(data) < length:
+                raise ValueError("Truncated recording {}".format(path))
+            yield fetch_time, data
+
+
+def record_feed(url, path, interval, count=None, duration=None, timeout=10):
+    """"Polls url every interval seconds and records the snapshots that differ from the previous one, until count
+        snapshots are recorded or duration seconds pass. Returns the number of recorded snapshots."""
+    session = requests.Session()
+    writer = RecordingWriter(path)
+    start = time.time()
+    last_hash = None
+    try:
+        while (count is None or writer.count < count) and (duration is None or time.time() - start < duration):
+            before = time.time()
+            try:
+                response = session.get(url, timeout=timeout)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                logging.error("Can't read feed {}. {}".format(url, e))
+            else:
+                content_hash = hashlib.sha1(response.content).digest()
+                if content_hash != last_hash:
+                    writer.write(before, response.content)
+                    last_hash = content_hash
+                    logging.info("Recorded snapshot {}, {} bytes".format(writer.count, len(response.content)))
+            time.sleep(max(interval - (time.time() - before), 0))
+    finally:
+        writer.close()
+    return writer.count
+
+
+class ReplayServer(ThreadingMixIn, HTTPServer):
+    """"Serves a recording over HTTP as a stand-in for a live feed. With speed the snapshots follow the recorded times
+        accelerated speed times, without it every request gets the next snapshot. The last snapshot is served once
+        the recording ends."""
+    daemon_threads = True
+
+    def __init__(self, path, speed=None, host='127.0.0.1', port=0):
+        HTTPServer.__init__(self, (host, port), _ReplayHandler)
+        self.snapshots = list(read_recording(path))
+        if not self.snapshots:
+            raise ValueError("Empty recording {}".format(path))
+        self.speed = speed
+        self.served = 0
+        self._next = 0
+        self._started = None
+        self._lock = Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        return "http://{}:{}/".format(*self.server_address)
+
+    def start(self):
+        self._thread = Thread(target=self.serve_forever, name='ReplayServer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def is_finished(self):
+        if self.speed is None:
+            return self._next >= len(self.snapshots)
+        return self._next == len(self.snapshots) - 1
+
+    def get_snapshot(self):
+        with self._lock:
+            self.served += 1
+            if self.speed is None:
+                indx = min(self._next, len(self.snapshots) - 1)
+                self._next += 1
+                return self.snapshots[indx][1]
+            now = time.time()
+            if self._started is None:
+                self._started = now
+            replay_time = self.snapshots[0][0] + (now - self._started) * self.speed
+            while self._next + 1 < len(self.snapshots) and self.snapshots[self._next + 1][0] <= replay_time:
+                self._next += 1
+            return self.snapshots[self._next][1]
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        content = self.server.get_snapshot()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Records a gtfs realtime feed or replays a recording over HTTP.')
+    subparsers = parser.add_subparsers(dest='command')
+    record_parser = subparsers.add_parser('record', help='Record snapshots of a live feed')
+    record_parser.add_argument('--feedUrl', help='Gtfs realtime vehicle position url', required=True)
+    record_parser.add_argument('--recording', help='Output recording file', required=True)
+    record_parser.add_argument('--interval', help='A time interval between requests (in secs)', type=float,
+                               required=True)
+    record_parser.add_argument('--count', help='Number of snapshots to record', type=int, required=False)
+    record_parser.add_argument('--duration', help='Recording time (in secs)', type=float, required=False)
+    serve_parser = subparsers.add_parser('serve', help='Serve a recording as a local feed url')
+    serve_parser.add_argument('--recording', help='Recording file', required=True)
+    serve_parser.add_argument('--port', help='Port to listen on', type=int, default=8000)
+    serve_parser.add_argument('--speed', help='Replay speed, every request gets the next snapshot if not given',
+                              type=float, required=False)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'record':
+        print record_feed(args.feedUrl, args.recording, args.interval, args.count, args.duration)
+    else:
+        server = ReplayServer(args.recording, args.speed, port=args.port)
+        logging.info("Serving {} snapshots at {}".format(len(server.snapshots), server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
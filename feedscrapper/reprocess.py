@@ -0,0 +1,174 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+from google.protobuf.message import DecodeError
+from activetrips import ActiveTrips
+from compiledschedule import load_schedule
+from dbmanager import DbManager
+from feedscrapper import get_time_zone, process_feed
+from geometrycache import GeometryCache
+from partitioneddb import get_partition_key
+from snapshotdiff import SnapshotDiff
+from utils import TripState, ENGINES, ENGINE_PYTHON
+from wiredecoder import DECODERS, DECODER_FAST, decode_feed, parse_feed
+import argparse
+import logging
+import os
+import re
+import time
+
+SNAPSHOT_EXT = '.pb'
+# trips are forgotten after INACTIVE_AFTER seconds, so replaying that much of the previous day restores their state
+WARMUP = ActiveTrips.INACTIVE_AFTER
+# a fresh db is rebuilt from scratch on failure, so it is written without a journal
+BULK_PRAGMAS = ("PRAGMA journal_mode=OFF;", "PRAGMA synchronous=OFF;")
+_TIME_PATTERN = re.compile(r'(?<!\d)(\d{10})(?!\d)')
+
+
+def list_snapshots(snapshot_dir):
+    """"(timestamp, path) of the .pb files of snapshot_dir ordered by time. The timestamp is the 10 digit unix time in
+        the file name or, if there is none, header.timestamp of the snapshot."""
+    snapshots = []
+    for name in os.listdir(snapshot_dir):
+        if not name.endswith(SNAPSHOT_EXT):
+            continue
+        path = os.path.join(snapshot_dir, name)
+        match = _TIME_PATTERN.search(name)
+        if match:
+            timestamp = int(match.group(1))
+        else:
+            with open(path, 'rb') as snapshot_file:
+                timestamp = decode_feed(snapshot_file.read()).header.timestamp
+        snapshots.append((timestamp, path))
+    snapshots.sort()
+    return snapshots
+
+
+def plan_partitions(snapshots, time_zone, warmup=WARMUP):
+    """"Splits time ordered snapshots by service day. Returns (day, warm-up snapshots, snapshots of the day) for
+        every day, the warm-up snapshots are the ones of the last warmup seconds before the day's first snapshot."""
+    days = OrderedDict()
+    for snapshot in snapshots:
+        days.setdefault(get_partition_key(snapshot[0], time_zone), []).append(snapshot)
+    times = [snapshot[0] for snapshot in snapshots]
+    partitions = []
+    for key, day_snapshots in days.items():
+        first = bisect_left(times, day_snapshots[0][0])
+        warmup_snapshots = snapshots[bisect_left(times, day_snapshots[0][0] - warmup):first]
+        partitions.append((key, warmup_snapshots, day_snapshots))
+    return partitions
+
+
+class RowCollector:
+    """"Stands in for the db manager in process_feed and keeps the vehicle_log rows in memory. Rows are dropped while
+        enabled is False."""
+
+    def __init__(self):
+        self.rows = []
+        self.enabled = True
+
+    def insert_log(self, route_id, trip_id, stop_seq, sampling_time, day, delay_sec, progress, inter_progress):
+        if self.enabled:
+            self.rows.append((route_id, trip_id, stop_seq, sampling_time, day, delay_sec, progress, inter_progress))
+
+    def commit(self):
+        pass
+
+
+def reprocess_partition(schedule, warmup_snapshots, snapshots, decoder=DECODER_FAST, geometry_cache=None):
+    """"Replays the snapshots through process_feed in time order with fresh ActiveTrips, the same way the live loop
+        does. The warm-up snapshots only build up the state of trips already running. Returns (vehicle_log rows,
+        number of replayed snapshots)."""
+    active_trips = ActiveTrips(get_time_zone(schedule))
+    snapshot_diff = SnapshotDiff()
+    collector = RowCollector()
+    failures = (geometry_cache or TripState.GEOMETRY_CACHE).failures
+    replayed = 0
+    for enabled, items in ((False, warmup_snapshots), (True, snapshots)):
+        collector.enabled = enabled
+        for timestamp, path in items:
+            with open(path, 'rb') as snapshot_file:
+                data = snapshot_file.read()
+            try:
+                feed = parse_feed(data, decoder)
+            except DecodeError as e:
+                logging.error("Can't parse snapshot {}. {}".format(path, e))
+                continue
+            process_feed(schedule, feed, active_trips, collector, geometry_cache, snapshot_diff=snapshot_diff,
+                         failures=failures)
+            active_trips.clean_inactive_trips(feed.header.timestamp)
+            replayed += 1
+    return collector.rows, replayed
+
+
+_schedule = None
+_geometry_cache = None
+
+
+def _init_worker(gtfs_zip_or_dir, compiled_dir, engine):
+    global _schedule, _geometry_cache
+    TripState.ENGINE = engine
+    _schedule = load_schedule(gtfs_zip_or_dir, compiled_dir)
+    _geometry_cache = GeometryCache()
+
+
+def _run_partition(task):
+    key, warmup_snapshots, snapshots, decoder = task
+    before = time.time()
+    rows, replayed = reprocess_partition(_schedule, warmup_snapshots, snapshots, decoder, _geometry_cache)
+    return key, rows, replayed, time.time() - before
+
+
+def reprocess(gtfs_zip_or_dir, snapshot_dir, db_file, workers=None, compiled_dir=None, engine=ENGINE_PYTHON,
+              decoder=DECODER_FAST, warmup=WARMUP):
+    """"Rebuilds vehicle_log from archived snapshots into db_file, which must not exist yet. Service days are
+        replayed in parallel by a pool of worker processes, each with its own schedule and geometry cache, and their
+        rows are loaded into the db in day order. Indexes are built at the end.
+        Returns (snapshots, replayed snapshots including warm-up, rows, seconds)."""
+    if os.path.exists(db_file):
+        raise ValueError("{} already exists, reprocessing writes a fresh db".format(db_file))
+    schedule = load_schedule(gtfs_zip_or_dir, compiled_dir)
+    snapshots = list_snapshots(snapshot_dir)
+    tasks = [(key, warmup_snapshots, day_snapshots, decoder) for key, warmup_snapshots, day_snapshots
+             in plan_partitions(snapshots, get_time_zone(schedule), warmup)]
+    start = time.time()
+    db_manager = DbManager(db_file, indexes=False)
+    for pragma in BULK_PRAGMAS:
+        db_manager.conn.execute(pragma)
+    pool = Pool(min(workers or cpu_count(), max(len(tasks), 1)), _init_worker,
+                (gtfs_zip_or_dir, compiled_dir, engine))
+    replayed = num_rows = 0
+    try:
+        for key, rows, day_replayed, seconds in pool.imap(_run_partition, tasks):
+            db_manager.insert_logs(rows)
+            db_manager.commit()
+            replayed += day_replayed
+            num_rows += len(rows)
+            logging.info("Day {}: {} rows from {} snapshots in {:.1f}s".format(key, len(rows), day_replayed, seconds))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    db_manager.create_indexes()
+    db_manager.close_connection()
+    return len(snapshots), replayed, num_rows, time.time() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Rebuilds vehicle_log from archived gtfs realtime snapshots.')
+    parser.add_argument('--gtfsZipOrDir', help='Gtfs zip file or directory', required=True)
+    parser.add_argument('--snapshotDir', help='A directory of .pb snapshots with unix time in their names',
+                        required=True)
+    parser.add_argument('--sqliteDb', help='A path to the new sqlite db file', required=True)
+    parser.add_argument('--workers', help='Number of worker processes, one per CPU by default', type=int,
+                        required=False)
+    parser.add_argument('--compiledDir', help='A directory for compiled schedules', required=False)
+    parser.add_argument('--engine', help='Vehicle projection engine', choices=ENGINES, default=ENGINE_PYTHON)
+    parser.add_argument('--decoder', help='Realtime feed decoder', choices=DECODERS, default=DECODER_FAST)
+    parser.add_argument('--logFile', help='A path to log file', required=False)
+    args = parser.parse_args()
+    logging.basicConfig(filename=args.logFile, level=logging.INFO if args.logFile else logging.WARNING)
+    count, replayed, num_rows, seconds = reprocess(args.gtfsZipOrDir, args.snapshotDir, args.sqliteDb, args.workers,
+                                                   args.compiledDir, args.engine, args.decoder)
+    print "snapshots {} ({} replayed with warm-up), rows {}, {:.1f}s, {:.1f} snapshots/s".format(
+        count, replayed, num_rows, seconds, count / seconds if seconds else 0)
@@ -0,0 +1,82 @@
+from datetime import date, datetime
+import calendar
+import time
+import numpy as np
+
+NOON = 12 * 3600
+
+
+class ServiceTime:
+    """"Converts arrays of unix timestamps to GTFS service time of the agency. A GTFS service day starts 12 hours
+        before its local noon, i.e. at midnight except on days when the UTC offset changes, and its stop times may
+        exceed 24:00 for trips running past midnight. The UTC start of every service day in the range seen so far is
+        computed once, so conversions are a searchsorted over that table instead of a time zone call per row. The
+        table grows by RANGE_DAYS when timestamps fall outside of it. Service dates are date ordinals."""
+    RANGE_DAYS = 31
+    MARGIN_DAYS = 3
+
+    def __init__(self, time_zone=None):
+        """"time_zone is a tzinfo, local time by default."""
+        self.time_zone = time_zone
+        self._first_date = 0
+        self._starts = np.zeros(0, dtype=np.int64)
+        self._yday = np.zeros(0, dtype=np.int16)
+
+    def get_day_start(self, service_date):
+        """"Unix time of the start of the service day with the date ordinal."""
+        local_noon = datetime.fromordinal(service_date).replace(hour=12)
+        if self.time_zone is None:
+            return int(time.mktime(local_noon.timetuple())) - NOON
+        if hasattr(self.time_zone, 'localize'):
+            local_noon = self.time_zone.localize(local_noon)
+        else:
+            local_noon = local_noon.replace(tzinfo=self.time_zone)
+        return calendar.timegm(local_noon.utctimetuple()) - NOON
+
+    def get_seconds(self, timestamps):
+        """"Returns (seconds since the start of the service day, service date) arrays of the service days the
+            timestamps fall into."""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        indexes = self._locate(timestamps)
+        return timestamps - self._starts[indexes], self._first_date + indexes
+
+    def get_delays(self, timestamps, scheduled_times):
+        """"Returns (delay in seconds, service date) arrays. scheduled_times are GTFS times in seconds, possibly over
+            24 hours. Every timestamp is compared with its scheduled time on the service day it falls into, the day
+            before and the day after, the smallest delay in absolute value wins. NaN scheduled times, e.g. of
+            vehicles before the first stop, get NaN delays on the service day of the timestamp."""
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        scheduled_times = np.asarray(scheduled_times, dtype=np.float64)
+        indexes = self._locate(timestamps)
+        candidates = indexes[:, np.newaxis] + np.arange(-1, 2)
+        delays = (timestamps[:, np.newaxis] - self._starts[candidates]) - scheduled_times[:, np.newaxis]
+        with np.errstate(invalid='ignore'):
+            best = np.where(np.isnan(scheduled_times), 1, np.argmin(np.abs(delays), axis=1))
+        rows = np.arange(len(timestamps))
+        return delays[rows, best], self._first_date + candidates[rows, best]
+
+    def get_day_of_year(self, service_dates):
+        """"Day of year of service dates returned by this instance."""
+        return self._yday[np.asarray(service_dates, dtype=np.int64) - self._first_date]
+
+    def _locate(self, timestamps):
+        """"Indexes of the service days containing the timestamps, the table covers the day before and after them."""
+        if len(timestamps):
+            self._ensure(int(timestamps.min()), int(timestamps.max()))
+        return np.searchsorted(self._starts, timestamps, 'right') - 1
+
+    def _ensure(self, first_timestamp, last_timestamp):
+        first = datetime.utcfromtimestamp(first_timestamp).toordinal() - self.MARGIN_DAYS
+        last = datetime.utcfromtimestamp(last_timestamp).toordinal() + self.MARGIN_DAYS
+        if len(self._starts) and self._first_date <= first and last < self._first_date + len(self._starts):
+            return
+        if len(self._starts):
+            first = min(first, self._first_date)
+            last = max(last, self._first_date + len(self._starts) - 1 + self.RANGE_DAYS)
+        else:
+            last += self.RANGE_DAYS
+        dates = range(first, last + 1)
+        self._starts = np.array([self.get_day_start(service_date) for service_date in dates], dtype=np.int64)
+        self._yday = np.array([date.fromordinal(service_date).timetuple().tm_yday for service_date in dates],
+                              dtype=np.int16)
+        self._first_date = first
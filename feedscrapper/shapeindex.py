@@ -0,0 +1,58 @@
+import math
+
+EARTH_RADIUS_METERS = 6371010.0
+
+
+class SegmentIndex:
+    """"Uniform grid over the segments of a shape. Coordinates are projected to a local equirectangular plane and every
+        segment is registered in all cells touched by its bounding box, so a query returns a superset of the segments
+        that come within the given radius of a point."""
+    CELL_SIZE = 250
+    DISTORTION_MARGIN = 1.1
+    MIN_MARGIN = 5
+
+    def __init__(self, geometry, cell_size=None):
+        self.cell_size = float(cell_size or self.CELL_SIZE)
+        latlngs = [pt.ToLatLng() for pt in geometry.poly.GetPoints()]
+        self.lat0 = latlngs[0][0] if latlngs else 0
+        self.lng0 = latlngs[0][1] if latlngs else 0
+        mean_lat = sum(lat for lat, lng in latlngs) / len(latlngs) if latlngs else 0
+        self.cos_lat = math.cos(math.radians(mean_lat))
+        coords = [self._to_plane(lat, lng) for lat, lng in latlngs]
+
+        self.boxes = []
+        self.cells = {}
+        for i in range(len(coords) - 1):
+            (xa, ya), (xb, yb) = coords[i], coords[i + 1]
+            box = (min(xa, xb), min(ya, yb), max(xa, xb), max(ya, yb))
+            self.boxes.append(box)
+            for cell in self._get_cells(box):
+                self.cells.setdefault(cell, []).append(i)
+
+    def query(self, point, radius):
+        """"Returns sorted indexes of segments which may come within radius meters of a transitfeed Point."""
+        x, y = self._to_plane(*point.ToLatLng())
+        margin = radius * self.DISTORTION_MARGIN + self.MIN_MARGIN
+        candidates = set()
+        for cell in self._get_cells((x - margin, y - margin, x + margin, y + margin)):
+            candidates.update(self.cells.get(cell, ()))
+        return sorted(i for i in candidates if self._box_distance(self.boxes[i], x, y) <= margin)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _to_plane(self, lat, lng):
+        d_lng = (lng - self.lng0 + 180) % 360 - 180
+        return (math.radians(d_lng) * self.cos_lat * EARTH_RADIUS_METERS,
+                math.radians(lat - self.lat0) * EARTH_RADIUS_METERS)
+
+    def _get_cells(self, box):
+        min_x, min_y = int(math.floor(box[0] / self.cell_size)), int(math.floor(box[1] / self.cell_size))
+        max_x, max_y = int(math.floor(box[2] / self.cell_size)), int(math.floor(box[3] / self.cell_size))
+        return [(cx, cy) for cx in range(min_x, max_x + 1) for cy in range(min_y, max_y + 1)]
+
+    @staticmethod
+    def _box_distance(box, x, y):
+        dx = max(box[0] - x, 0, x - box[2])
+        dy = max(box[1] - y, 0, y - box[3])
+        return math.sqrt(dx * dx + dy * dy)
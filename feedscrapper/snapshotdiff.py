@@ -0,0 +1,41 @@
+class SnapshotDiff:
+    """"Compares every feed snapshot with the previous one, so vehicles which haven't reported anything new are not
+        projected again. Vehicles are identified by trip_id, a vehicle with the same timestamp and position as in the
+        previous snapshot is unchanged. A trip reported by several entities is kept only once, as in filter_updates.
+        Counters hold the numbers of the last snapshot."""
+
+    def __init__(self):
+        self._previous = {}
+        self.changed = 0
+        self.unchanged = 0
+        self.new = 0
+        self.gone = 0
+        self.duplicates = 0
+
+    def filter(self, records):
+        """"Returns the VehicleRecords of the snapshot which are new or changed."""
+        current = {}
+        result = []
+        self.changed = self.unchanged = self.new = self.duplicates = 0
+        for rec in records:
+            if rec.trip_id in current:
+                self.duplicates += 1
+                continue
+            state = (rec.timestamp, rec.lat, rec.lon)
+            current[rec.trip_id] = state
+            previous = self._previous.get(rec.trip_id)
+            if previous is None:
+                self.new += 1
+            elif previous == state:
+                self.unchanged += 1
+                continue
+            else:
+                self.changed += 1
+            result.append(rec)
+        self.gone = len(self._previous) - (self.changed + self.unchanged)
+        self._previous = current
+        return result
+
+    def get_stats(self):
+        return {'changed': self.changed, 'unchanged': self.unchanged, 'new': self.new, 'gone': self.gone,
+                'duplicates': self.duplicates}
@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class StopPattern(object):
+    """"Stop sequence of trips on one shape with the distances of its stops along the shape. Trips that differ only
+        in their times share one instance, so the stops are snapped once per pattern. fallback tells that some stop
+        was reachable only with the bigger tolerance. It is read-only."""
+    __slots__ = ('geometry', 'stop_ids', 'distances', 'end_stop', 'fallback')
+
+    def __init__(self, geometry, stop_ids, distances, end_stop, fallback=False):
+        self.geometry = geometry
+        self.stop_ids = tuple(stop_ids)
+        self.distances = np.array(distances, dtype=np.float64)
+        self.end_stop = end_stop
+        self.fallback = fallback
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    @property
+    def shape_id(self):
+        return self.geometry.shape_id
+
+    def get_key(self):
+        return self.geometry.shape_id, self.stop_ids
+
+    def get_stop_idx(self, stop_id):
+        """"Index of the first stop with stop_id or None."""
+        if stop_id and stop_id in self.stop_ids:
+            return self.stop_ids.index(stop_id)
+        return None
+
+    def get_distance_range(self, next_stop_id):
+        """"(min, max] distance along the shape where a vehicle heading to next_stop_id can be."""
+        next_stop_idx = self.get_stop_idx(next_stop_id)
+        if next_stop_idx is None:
+            return -0.1, float("inf")
+        if next_stop_idx == 0:
+            return 0, self.distances[0]
+        return self.distances[next_stop_idx - 1], self.distances[next_stop_idx]
+
+    def get_prev_stop_idx(self, distance):
+        """"Index of the last stop at or before the distance, -1 before the first stop."""
+        return int(np.searchsorted(self.distances, distance, 'right')) - 1
+
+
+class TripTimes(object):
+    """"Schedule of a single trip on its StopPattern. Arrival and departure times of the stops are float32 offsets
+        from start, seconds from midnight of the service day, NaN marks untimed stops."""
+    __slots__ = ('trip_id', 'pattern', 'start', 'arrival', 'departure')
+
+    def __init__(self, trip_id, pattern, stop_times):
+        self.trip_id = trip_id
+        self.pattern = pattern
+        first = stop_times[0]
+        self.start = first[1] if first[1] is not None else first[0] or 0
+        self.arrival = np.array([_to_offset(st_time[0], self.start) for st_time in stop_times], dtype=np.float32)
+        self.departure = np.array([_to_offset(st_time[1], self.start) for st_time in stop_times], dtype=np.float32)
+
+    def get_arrival(self):
+        return self.start + self.arrival.astype(np.float64)
+
+    def get_departure(self):
+        return self.start + self.departure.astype(np.float64)
+
+    def get_scheduled_time(self, distance, prev_stop_idx=None):
+        """"Scheduled time of the position distance meters along the shape, interpolated between the departure from
+            the previous stop and the arrival to the next one. It is 0 before the first stop and the arrival time
+            after the last one."""
+        distances = self.pattern.distances
+        if prev_stop_idx is None:
+            prev_stop_idx = self.pattern.get_prev_stop_idx(distance)
+        if prev_stop_idx == -1:
+            return 0
+        if prev_stop_idx == len(distances) - 1:
+            return self.start + float(self.arrival[-1])
+        prev_departure = float(self.departure[prev_stop_idx])
+        duration = float(self.arrival[prev_stop_idx + 1]) - prev_departure
+        fraction = (distance - distances[prev_stop_idx]) / (distances[prev_stop_idx + 1] - distances[prev_stop_idx])
+        return self.start + prev_departure + duration * fraction
+
+
+def _to_offset(value, start):
+    return np.nan if value is None else value - start
@@ -0,0 +1,47 @@
+import unittest
+import pytz
+from activetrips import ActiveTrips
+
+
+class ActiveTripsTester(unittest.TestCase):
+
+    def test_update_keeps_the_first_day(self):
+        active_trips = ActiveTrips(pytz.timezone('Europe/Sofia'))
+        # 2018-02-19 23:50 in Sofia
+        record = active_trips.add_update_trip('247284', 1519077000, 0.5, 10, 1500.0, 42.14, 24.8)
+        self.assertEqual(50, record.day)
+        active_trips.add_update_trip('247284', 1519077900, 0.6, 12, 1700.0, 42.15, 24.81)
+        self.assertEqual(50, active_trips.get_day_for_trip('247284'))
+        self.assertEqual(0.6, active_trips.get_trip_progress('247284'))
+        self.assertEqual(1519077900, active_trips.get_timestamp_for_trip('247284'))
+        self.assertEqual(12, active_trips.get_last_segment('247284'))
+        self.assertEqual(1700.0, active_trips.get_last_distance('247284'))
+        self.assertEqual((42.15, 24.81), active_trips.get_last_position('247284'))
+        self.assertEqual(None, active_trips.get_trip_progress('247285'))
+        self.assertTrue('247284' in active_trips)
+
+    def test_clean_inactive_trips(self):
+        active_trips = ActiveTrips()
+        active_trips.add_update_trip('1', 1000, 0.1)
+        active_trips.add_update_trip('2', 1000, 0.1)
+        active_trips.add_update_trip('3', 5000, 0.1)
+        # the stale heap entry of the first update doesn't expire the trip
+        active_trips.add_update_trip('2', 6000, 0.2)
+        self.assertEqual(0, active_trips.clean_inactive_trips(8200))
+        self.assertEqual(1, active_trips.clean_inactive_trips(8201))
+        self.assertEqual(['2', '3'], sorted(active_trips.trips))
+        self.assertEqual(1, active_trips.clean_inactive_trips(12201))
+        self.assertEqual(['2'], sorted(active_trips.trips))
+
+    def test_expiry_index_is_compacted(self):
+        active_trips = ActiveTrips()
+        for timestamp in range(0, 30000, 10):
+            active_trips.add_update_trip('1', timestamp, 0.5)
+        self.assertTrue(len(active_trips._expiry) <= ActiveTrips.MIN_COMPACT_SIZE)
+        self.assertEqual(0, active_trips.clean_inactive_trips(30000))
+        self.assertEqual(1, active_trips.clean_inactive_trips(40000))
+        self.assertEqual(0, len(active_trips))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from adaptivepoller import AdaptivePoller
+
+
+class AdaptivePollerTester(unittest.TestCase):
+
+    def test_fetch_after_regeneration(self):
+        poller = AdaptivePoller(interval=10)
+        # the feed is regenerated every 30s and shows up 2s later
+        for k in range(3):
+            poller.observe(1000 + 30 * k + 2, 1000 + 30 * k)
+            self.assertEqual(10, poller.get_delay(1000 + 30 * k + 2))
+        poller.observe(1092, 1090)
+        self.assertEqual(30, poller.get_period())
+        self.assertEqual(2, poller.get_lag())
+        # the next feed is expected at 1120 and available at 1122, it is fetched a second early
+        self.assertEqual(29, poller.get_delay(1092))
+
+    def test_back_off_when_nothing_changes(self):
+        poller = AdaptivePoller(interval=10)
+        for k in range(4):
+            poller.observe(1000 + 30 * k, 1000 + 30 * k)
+        delays = []
+        for k in range(8):
+            poller.observe(1200 + k, None)
+            delays.append(poller.get_delay(1200 + k))
+        self.assertEqual([1, 2, 4, 8, 16, 32, 40, 40], delays)
+        self.assertEqual({'period': 30, 'lag': 0, 'polls': 12, 'unchanged_polls': 8}, poller.get_stats())
+
+        poller.observe(1300, 1300)
+        self.assertEqual(0, poller.unchanged)
+        self.assertEqual(29, poller.get_delay(1300))
+
+    def test_lag_does_not_grow(self):
+        # the server regenerates the feed every 30s and publishes it 2s later, a fetch takes 0.3s
+        poller = AdaptivePoller(interval=10)
+        now = 1000.0
+        staleness = []
+        for i in range(500):
+            now += 0.3
+            timestamp = int((now - 2) // 30) * 30
+            if timestamp != poller.last_timestamp:
+                if poller.last_timestamp is not None:
+                    self.assertEqual(30, timestamp - poller.last_timestamp)
+                staleness.append(now - timestamp)
+                poller.observe(now, timestamp)
+            else:
+                poller.observe(now, None)
+            now += poller.get_delay(now)
+        self.assertTrue(2 <= poller.get_lag() < 3)
+        self.assertTrue(max(staleness[-100:]) < 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pytz
+from archive import export_log, export_partitions, ArchiveReader, read_archives
+from dbmanager import DbManager
+from partitioneddb import PartitionedDbManager
+
+
+class ArchiveTester(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'log.db')
+        self.rows = [('2718' if i % 3 else '2719', '24728{}'.format(i % 5), i % 7, 1519059600 + 7 * i, 50, i - 10,
+                      i * 0.01, i * 0.001) for i in range(25)]
+        db_manager = DbManager(self.db_file)
+        db_manager.insert_logs(reversed(self.rows))
+        db_manager.commit()
+        db_manager.close_connection()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        archive_path = os.path.join(self.tmp_dir, 'log.npz')
+        self.assertEqual(25, export_log(self.db_file, archive_path, row_group_size=10))
+        reader = ArchiveReader(archive_path)
+        self.assertEqual(3, reader.num_groups)
+        self.assertEqual(['24728{}'.format(i) for i in range(5)], sorted(reader.trip_ids.tolist()))
+        groups = list(reader.iter_row_groups(columns=('time',)))
+        self.assertEqual([10, 10, 5], [len(group['time']) for group in groups])
+
+        log = reader.read(decode=True)
+        reader.close()
+        self.assertEqual([row[0] for row in self.rows], log['route_id'].tolist())
+        self.assertEqual([row[1] for row in self.rows], log['trip_id'].tolist())
+        self.assertEqual([row[3] for row in self.rows], log['time'].tolist())
+        self.assertEqual([row[2] for row in self.rows], log['stop_seq'].tolist())
+        self.assertEqual([row[5] for row in self.rows], log['delay_sec'].tolist())
+        np.testing.assert_allclose([row[7] for row in self.rows], log['stop_progress'], atol=1e-6)
+        np.testing.assert_allclose([row[6] for row in self.rows], log['progress'], atol=1e-6)
+
+        both = read_archives([archive_path, archive_path], columns=('trip_id', 'time'))
+        self.assertEqual(50, len(both['time']))
+
+    def test_only_closed_partitions_are_exported(self):
+        time_zone = pytz.timezone('America/Toronto')
+        db_file = os.path.join(self.tmp_dir, 'parts.db')
+        archive_dir = os.path.join(self.tmp_dir, 'archive')
+        db_manager = PartitionedDbManager(db_file, time_zone)
+        for day in range(3):
+            db_manager.insert_logs([row[:3] + (row[3] + day * 24 * 3600,) + row[4:] for row in self.rows])
+            db_manager.commit()
+        # the previous partition is still open for late rows
+        written = export_partitions(db_file, archive_dir, time_zone)
+        self.assertEqual([os.path.join(archive_dir, 'parts.20180219.npz')], written)
+        self.assertEqual([], export_partitions(db_file, archive_dir, time_zone))
+
+        # a late row changes the closed partition, it is archived again
+        db_manager.insert_logs([self.rows[0]])
+        db_manager.close_connection()
+        written = export_partitions(db_file, archive_dir, time_zone)
+        self.assertEqual(3, len(written))
+        reader = ArchiveReader(written[0])
+        self.assertEqual(26, len(reader))
+        reader.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
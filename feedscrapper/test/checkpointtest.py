@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+from transitfeed import Loader
+from activetrips import ActiveTrips
+from checkpoint import Checkpointer, load_checkpoint, save_checkpoint
+from feedscrapper import filter_updates
+from tripbatch import TripStateBatch
+from tripbatchtest import VEHICLES, build_feed
+
+
+class CheckpointTester(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'trips.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_save_and_load(self):
+        active_trips = ActiveTrips()
+        active_trips.add_update_trip(u'247284', 1517000000, 0.25, 12, 1500.5, 42.14, 24.8)
+        active_trips.add_update_trip(u'247285', 1517000010, 0.5)
+        self.assertEqual(2, save_checkpoint(active_trips, self.path, 1517000010, 'http://feed'))
+        records, feed_timestamp, saved_at, feed_url = load_checkpoint(self.path)
+        self.assertEqual((1517000010, 'http://feed'), (feed_timestamp, feed_url))
+        records = dict((record.trip_id, record) for record in records)
+        first, second = records['247284'], records['247285']
+        self.assertEqual((0.25, 1517000000, active_trips.get_day_for_trip('247284'), 12, 1500.5, 42.14, 24.8),
+                         (first.progress, first.timestamp, first.day, first.segment, first.distance, first.lat,
+                          first.lon))
+        self.assertEqual((None, None, None), (second.segment, second.distance, second.lat))
+
+    def test_restore_is_checked_against_the_feed(self):
+        active_trips = ActiveTrips()
+        active_trips.add_update_trip('1', 1517000000, 0.25)
+        active_trips.add_update_trip('2', 1517003000, 0.5)
+        Checkpointer(self.path, feed_url='http://feed').save(active_trips, 1517003000)
+
+        self.assertEqual(0, Checkpointer(self.path, feed_url='http://other').restore(ActiveTrips()))
+
+        restored = ActiveTrips()
+        checkpointer = Checkpointer(self.path, feed_url='http://feed')
+        self.assertEqual(2, checkpointer.restore(restored))
+        checkpointer.validate(restored, 1517007500)
+        self.assertEqual(['2'], list(restored.trips))
+        # only the first feed is checked
+        checkpointer.validate(restored, 1517000000)
+        self.assertEqual(1, len(restored))
+
+        restored = ActiveTrips()
+        checkpointer = Checkpointer(self.path, feed_url='http://feed')
+        checkpointer.restore(restored)
+        checkpointer.validate(restored, 1517002000)
+        self.assertEqual(0, len(restored))
+
+    def test_restored_trips_are_tracked(self):
+        schedule = Loader(feed_path="./sample-feed").Load()
+        batch = TripStateBatch.from_feed(schedule, build_feed([VEHICLES[5]], 1517000600))
+        self.assertFalse(filter_updates(batch, ActiveTrips())[0])  # far from the first stops
+
+        active_trips = ActiveTrips()
+        active_trips.add_update_trip('247284', 1517000000, 0.2)
+        checkpointer = Checkpointer(self.path)
+        checkpointer.update(active_trips, 1517000000)
+        checkpointer.update(active_trips, 1517000030)
+        self.assertEqual(1, checkpointer.saves)
+        restored = ActiveTrips()
+        checkpointer.restore(restored)
+        checkpointer.validate(restored, 1517000600)
+        self.assertTrue(filter_updates(batch, restored)[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from transitfeed import Loader
+from transitfeed import Point
+from compiledschedule import load_schedule, get_feed_hash, compile_schedule
+from geometrycache import GeometryCache
+from utils import TripState
+
+
+class CompiledScheduleTester(unittest.TestCase):
+
+    def setUp(self):
+        self.compiled_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.compiled_dir)
+
+    def test_same_as_transitfeed(self):
+        schedule = Loader(feed_path="./sample-feed").Load()
+        compiled = load_schedule("./sample-feed", self.compiled_dir)
+        self.assertEqual(schedule.GetAgencyList()[0].agency_timezone, compiled.GetAgencyList()[0].agency_timezone)
+        for trip_id in ('247284', '247285'):
+            trip, compiled_trip = schedule.GetTrip(trip_id), compiled.GetTrip(trip_id)
+            self.assertEqual(trip.shape_id, compiled_trip.shape_id)
+            self.assertEqual([(st[0], st[1], st[2].stop_id, st[2].stop_lat, st[2].stop_lon) for st in trip.GetTimeStops()],
+                             [(st[0], st[1], st[2].stop_id, st[2].stop_lat, st[2].stop_lon)
+                              for st in compiled_trip.GetTimeStops()])
+            vehicle = Point.FromLatLng(42.13851564680248, 24.79707830644129)
+            trip_state = TripState(trip, vehicle, '', geometry_cache=GeometryCache())
+            compiled_state = TripState(compiled_trip, vehicle, '', geometry_cache=GeometryCache())
+            self.assertEqual(trip_state.distance, compiled_state.distance)
+            self.assertEqual(trip_state.get_estimated_scheduled_time(), compiled_state.get_estimated_scheduled_time())
+        self.assertRaises(KeyError, compiled.GetTrip, 'unknown')
+
+    def test_array_views(self):
+        compiled = load_schedule("./sample-feed", self.compiled_dir)
+        self.assertTrue(isinstance(compiled.arrays['stop_time_arrival'], np.memmap))
+        arrival, departure, stops = compiled.get_stop_times(compiled._trip_index['247284'])
+        self.assertEqual([0, 600, 1200, 1800, 2400], arrival.tolist())
+        self.assertEqual(['1', '2', '3', '4', '5'], [compiled.arrays['stop_ids'][i] for i in stops])
+        lat, lon = compiled.get_shape_points(compiled._shape_index['8093'])
+        self.assertEqual(36, len(lat))
+        self.assertEqual(compiled.GetShape('8093').points[0], (lat[0], lon[0]))
+
+    def test_recompiled_on_change(self):
+        feed_dir = os.path.join(self.compiled_dir, 'feed')
+        shutil.copytree("./sample-feed", feed_dir)
+        load_schedule(feed_dir, self.compiled_dir)
+        old_hash = get_feed_hash(feed_dir)
+        self.assertTrue(os.path.isdir(os.path.join(self.compiled_dir, old_hash)))
+
+        with open(os.path.join(feed_dir, 'transfers.txt'), 'a') as transfers:
+            transfers.write('1,2,0,\n')
+        new_hash = get_feed_hash(feed_dir)
+        self.assertNotEqual(old_hash, new_hash)
+        load_schedule(feed_dir, self.compiled_dir)
+        self.assertTrue(os.path.isdir(os.path.join(self.compiled_dir, new_hash)))
+        self.assertTrue(os.path.isdir(os.path.join(self.compiled_dir, old_hash)))
+
+    def test_old_artifacts_are_removed(self):
+        feed_dir = os.path.join(self.compiled_dir, 'feed')
+        shutil.copytree("./sample-feed", feed_dir)
+        other = compile_schedule("./sample-feed", self.compiled_dir)
+        hashes = []
+        for version in range(4):
+            with open(os.path.join(feed_dir, 'transfers.txt'), 'a') as transfers:
+                transfers.write('1,2,0,\n')
+            load_schedule(feed_dir, self.compiled_dir)
+            hashes.append(get_feed_hash(feed_dir))
+        # the current and the previous artifact are kept, the ones of another feed aren't touched
+        self.assertEqual(sorted(hashes[-2:] + [os.path.basename(other), 'feed']), sorted(os.listdir(self.compiled_dir)))
+
+
+if __name__ == "__main__":
+    unittest.main()
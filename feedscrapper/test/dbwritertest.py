@@ -0,0 +1,88 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from dbwriter import DbWriter, DbWriterStoppedException
+
+
+class DbWriterTester(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'log.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _count_rows(self):
+        conn = sqlite3.connect(self.db_file)
+        count = conn.execute("SELECT COUNT(*) FROM vehicle_log").fetchone()[0]
+        conn.close()
+        return count
+
+    def test_rows_are_written(self):
+        writer = DbWriter(self.db_file)
+        writer.MAX_BATCH = 7
+        writer.start()
+        for i in range(100):
+            writer.insert_log('2718', '247284', 2, 1517000000 + i, 26, 30, 0.5, 0.25)
+        writer.commit()
+        writer.close_connection()
+        self.assertEqual(100, self._count_rows())
+        self.assertEqual(0, writer.queue_depth())
+        self.assertEqual(100, writer.get_stats()['flushed_rows'])
+
+    def test_retry_when_database_is_locked(self):
+        writer = DbWriter(self.db_file, busy_timeout=0.01)
+        writer.RETRY_DELAY = 0.01
+        writer.start()
+        lock = sqlite3.connect(self.db_file)
+        lock.execute("BEGIN EXCLUSIVE")
+        writer.insert_log('2718', '247284', 2, 1517000000, 26, 30, 0.5, 0.25)
+        writer.commit()
+        while writer.failed_flushes == 0:
+            writer._stopped.wait(0.01)
+        self.assertEqual(1, writer.queue_depth())
+        lock.rollback()
+        lock.close()
+        writer.close_connection()
+        self.assertEqual(1, self._count_rows())
+
+    def test_rows_breaking_a_constraint_are_dropped(self):
+        writer = DbWriter(self.db_file)
+        writer.start()
+        writer.insert_log('2718', '247284', 2, 1517000000, 26, 30, 0.5, 0.25)
+        writer.insert_log('2718', '247284', 3, 1517000030, 26, None, 0.6, 0.1)
+        writer.insert_log('2718', '247284', 3, 1517000060, 26, 45, 0.7, 0.5)
+        writer.commit()
+        while writer.flushed_rows < 2:
+            writer._stopped.wait(0.01)
+        self.assertTrue(writer.is_alive())
+        self.assertFalse(writer.is_overloaded())
+        writer.insert_log('2718', '247284', 4, 1517000090, 26, 50, 0.8, 0.2)
+        writer.close_connection()
+        self.assertEqual(3, self._count_rows())
+        self.assertEqual(1, writer.get_stats()['rejected_rows'])
+
+    def test_stopped_writer_is_reported(self):
+        writer = DbWriter(self.db_file, db_factory=BrokenDbManager)
+        writer.start()
+        writer.insert_log('2718', '247284', 2, 1517000000, 26, 30, 0.5, 0.25)
+        writer.commit()
+        writer.join()
+        self.assertRaises(DbWriterStoppedException, writer.is_overloaded)
+        self.assertRaises(DbWriterStoppedException, writer.commit)
+
+
+class BrokenDbManager:
+
+    def insert_logs(self, rows):
+        raise ValueError("broken")
+
+    def close_connection(self):
+        pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import gzip
+import threading
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from StringIO import StringIO
+from activetrips import ActiveTrips
+from adaptivepoller import AdaptivePoller
+from feedfetcher import FeedFetcher, RESULT_DECODE_ERROR
+from feedscrapper import run_cycle
+from metrics import MetricsRegistry
+from tripbatchtest import VEHICLES, build_feed
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    content = ''
+    etag = None
+    status = 200
+    requests = []
+
+    def do_GET(self):
+        FeedHandler.requests.append(dict(self.headers))
+        if self.status != 200:
+            self.send_error(self.status)
+            return
+        if self.etag is not None and self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        content = self.content
+        self.send_response(200)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buf = StringIO()
+            with gzip.GzipFile(fileobj=buf, mode='wb') as gzip_file:
+                gzip_file.write(content)
+            content = buf.getvalue()
+            self.send_header('Content-Encoding', 'gzip')
+        if self.etag is not None:
+            self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeedFetcherTester(unittest.TestCase):
+
+    def setUp(self):
+        FeedHandler.content = build_feed(VEHICLES, 1517000000).SerializeToString()
+        FeedHandler.etag = None
+        FeedHandler.status = 200
+        FeedHandler.requests = []
+        self.server = HTTPServer(('127.0.0.1', 0), FeedHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.fetcher = FeedFetcher('http://127.0.0.1:{}/'.format(self.server.server_port), timeout=5)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_unchanged_feed_is_skipped(self):
+        feed = self.fetcher.fetch()
+        self.assertEqual(len(VEHICLES), len(feed.entity))
+        self.assertEqual(None, self.fetcher.fetch())
+        self.assertEqual(1, self.fetcher.same_content)
+        # new payload with the same header timestamp
+        FeedHandler.content = build_feed(VEHICLES[:3], 1517000000).SerializeToString()
+        self.assertEqual(None, self.fetcher.fetch())
+        self.assertEqual(1, self.fetcher.same_timestamp)
+        FeedHandler.content = build_feed(VEHICLES[:3], 1517000030).SerializeToString()
+        self.assertEqual(3, len(self.fetcher.fetch().entity))
+        self.assertTrue('gzip' in FeedHandler.requests[0]['accept-encoding'])
+
+    def test_conditional_request(self):
+        FeedHandler.etag = '"v1"'
+        self.assertTrue(self.fetcher.fetch() is not None)
+        self.assertEqual(None, self.fetcher.fetch())
+        self.assertEqual('"v1"', FeedHandler.requests[1]['if-none-match'])
+        self.assertEqual(1, self.fetcher.not_modified)
+        self.assertEqual(1, self.fetcher.fetches)
+
+    def test_backoff(self):
+        FeedHandler.status = 500
+        self.assertEqual(None, self.fetcher.fetch(retry=False))
+        self.assertEqual(None, self.fetcher.fetch(retry=False))
+        self.assertEqual(1, len(FeedHandler.requests))
+        self.assertEqual(2, self.fetcher.retry_delay)
+        FeedHandler.status = 200
+        self.fetcher.retry_at = 0
+        self.assertTrue(self.fetcher.fetch(retry=False) is not None)
+        self.assertEqual(FeedFetcher.RETRY_DELAY, self.fetcher.retry_delay)
+
+    def test_corrupt_payload(self):
+        FeedHandler.content = '\x0a\xff\xff\xff'
+        metrics = MetricsRegistry()
+        poller = AdaptivePoller(30)
+        self.assertEqual(None, run_cycle(None, self.fetcher, ActiveTrips(), IdleDb(), metrics, poller=poller))
+        self.assertEqual(RESULT_DECODE_ERROR, self.fetcher.last_result)
+        self.assertEqual(1, self.fetcher.decode_errors)
+        self.assertEqual(1, metrics.snapshot()['counters']['cycles.decode_error'])
+        # the poller isn't told that the feed hasn't changed
+        self.assertEqual(0, poller.polls)
+
+
+class IdleDb:
+
+    def is_overloaded(self):
+        return False
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import requests
+from metrics import Histogram, MetricsRegistry, MetricsServer, dump_json
+
+
+class MetricsTester(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+        result = histogram.to_dict()
+        self.assertEqual({'0.1': 2, '1': 1, '+Inf': 1}, result['buckets'])
+        self.assertEqual((4, 3), (result['count'], result['max']))
+        self.assertAlmostEqual(0.9125, result['mean'])
+
+    def test_snapshot(self):
+        metrics = MetricsRegistry()
+        metrics.count('cycles')
+        metrics.count('cycles')
+        metrics.add_counts('rejected.', {'too_fast': 2})
+        metrics.observe('stage.fetch', 0.2)
+        metrics.set_gauge('active_trips', lambda: 7)
+        metrics.set_gauge('db', lambda: {'queue_depth': 3})
+        metrics.set_gauge('broken', lambda: 1 / 0)
+        snapshot = metrics.snapshot()
+        self.assertEqual({'cycles': 2, 'rejected.too_fast': 2}, snapshot['counters'])
+        self.assertEqual({'active_trips': 7, 'db.queue_depth': 3}, snapshot['gauges'])
+        self.assertEqual(1, snapshot['histograms']['stage.fetch']['count'])
+
+    def test_dump_and_serve(self):
+        metrics = MetricsRegistry()
+        metrics.count('cycles')
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'metrics.json')
+            dump_json(path, metrics.snapshot())
+            with open(path) as json_file:
+                self.assertEqual({'cycles': 1}, json.load(json_file)['counters'])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+        server = MetricsServer(metrics.snapshot, 0).start()
+        try:
+            self.assertEqual({'cycles': 1}, requests.get(server.url).json()['counters'])
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from metrics import MetricsRegistry
+from multifeed import FeedScraper, MultiFeedScheduler, get_next_due, load_config
+from tripbatchtest import VEHICLES, build_feed
+
+
+class FakeScraper:
+    def __init__(self, name, interval, proc_time=0):
+        self.name = name
+        self.interval = interval
+        self.proc_time = proc_time
+        self.running = False
+        self.overruns = 0
+        self.failed_polls = 0
+        self.poll_times = []
+        self.metrics = MetricsRegistry()
+        self.poller = None
+
+    def poll(self):
+        self.poll_times.append(time.time())
+        time.sleep(self.proc_time)
+
+
+class FixedDelayPoller:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def get_delay(self, now):
+        return self.delay
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        content = build_feed(VEHICLES).SerializeToString()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class MultiFeedTester(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_next_due(self):
+        self.assertEqual(130, get_next_due(100, 30, 101))
+        # a late poll doesn't shift the schedule
+        self.assertEqual(130, get_next_due(100, 30, 129))
+        # missed ticks are skipped
+        self.assertEqual(190, get_next_due(100, 30, 170))
+
+    def test_feeds_are_polled_on_their_intervals(self):
+        fast, slow, busy = FakeScraper('fast', 0.1), FakeScraper('slow', 0.25), FakeScraper('busy', 0.1, 0.25)
+        MultiFeedScheduler([fast, slow, busy], workers=3).run(duration=0.58)
+        self.assertEqual(6, len(fast.poll_times))
+        self.assertEqual(3, len(slow.poll_times))
+        self.assertEqual(2, len(busy.poll_times))
+        self.assertTrue(busy.overruns >= 3)
+        self.assertEqual(busy.overruns, busy.metrics.snapshot()['counters']['cycles.overrun'])
+        # no drift: the n-th poll happens about n intervals after the first one
+        self.assertTrue(fast.poll_times[-1] - fast.poll_times[0] < 0.55)
+
+    def test_adaptive_feeds_are_polled_after_completion(self):
+        adaptive = FakeScraper('adaptive', 10, 0.05)
+        adaptive.poller = FixedDelayPoller(0.1)
+        MultiFeedScheduler([adaptive], workers=1).run(duration=0.5)
+        self.assertEqual(4, len(adaptive.poll_times))
+        self.assertEqual(0, adaptive.overruns)
+
+    def test_load_config(self):
+        config_file = os.path.join(self.tmp_dir, 'feeds.json')
+        with open(config_file, 'w') as json_file:
+            json.dump({'partition': 'day', 'feeds': [{'gtfs': 'a.zip', 'feed_url': 'http://a', 'db': 'a.db',
+                                                      'interval': 30, 'partition': 'week'},
+                                                     {'gtfs': 'b.zip', 'feed_url': 'http://b', 'db': 'b.db',
+                                                      'interval': 20}]}, json_file)
+        config = load_config(config_file)
+        self.assertEqual(['week', 'day'], [feed['partition'] for feed in config['feeds']])
+        self.assertEqual('http://b', config['feeds'][1]['name'])
+        self.assertEqual(None, config['feeds'][1]['compiled_dir'])
+
+    def test_feed_scraper_poll(self):
+        server = HTTPServer(('127.0.0.1', 0), FeedHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        db_file = os.path.join(self.tmp_dir, 'log.db')
+        scraper = FeedScraper('sample', './sample-feed', 'http://127.0.0.1:{}/'.format(server.server_port), db_file, 30)
+        try:
+            self.assertTrue(scraper.open())
+            scraper.poll()
+            self.assertEqual(1, scraper.polls)
+            snapshot = scraper.metrics.snapshot()
+            self.assertEqual(1, snapshot['counters']['cycles.processed'])
+            self.assertEqual(1, snapshot['counters']['records.saved'])
+            self.assertEqual(1, snapshot['counters']['rejected.joined_late'])
+            self.assertEqual(1, snapshot['histograms']['stage.fetch']['count'])
+            self.assertEqual(1, snapshot['gauges']['active_trips'])
+        finally:
+            scraper.close()
+            server.shutdown()
+        conn = sqlite3.connect(db_file)
+        trip_ids = [row[0] for row in conn.execute("SELECT trip_id FROM vehicle_log ORDER BY trip_id")]
+        conn.close()
+        self.assertEqual(['247284'], trip_ids)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from negativecache import NegativeCache
+
+
+class NegativeCacheTester(unittest.TestCase):
+
+    def test_entries_expire(self):
+        cache = NegativeCache(ttl=60)
+        cache.add('247284', 'faulty_trip', '2718', now=1000)
+        self.assertEqual('faulty_trip', cache.get('247284', now=1010))
+        self.assertEqual(None, cache.get('247285', now=1010))
+        # sightings don't extend the expiry
+        cache.add('247284', 'faulty_trip', '2718', now=1050)
+        self.assertEqual(None, cache.get('247284', now=1060))
+        self.assertEqual(0, len(cache))
+        self.assertEqual(1, cache.hits)
+
+    def test_warnings_are_rate_limited(self):
+        cache = NegativeCache(warning_interval=100)
+        self.assertEqual(None, cache.should_warn('247284', now=1000))
+        cache.add('247284', 'stops_unreachable', now=1000)
+        self.assertEqual(0, cache.should_warn('247284', now=1000))
+        self.assertEqual(None, cache.should_warn('247284', now=1030))
+        self.assertEqual(None, cache.should_warn('247284', now=1060))
+        self.assertEqual(2, cache.should_warn('247284', now=1100))
+
+    def test_report(self):
+        cache = NegativeCache(max_entries=2)
+        cache.add('1', 'faulty_trip', now=1000)
+        cache.add('2', 'stops_unreachable', 'shape', now=1000)
+        cache.add('2', 'stops_unreachable', 'shape', now=1010)
+        self.assertEqual([('2', 2), ('1', 1)], [(entry['key'], entry['seen'])
+                                                for entry in cache.get_report(now=1020)])
+        self.assertEqual({'entries': 2, 'hits': 0, 'faulty_trip': 1, 'stops_unreachable': 1},
+                         cache.get_stats(now=1020))
+        # the oldest entry is evicted
+        cache.add('3', 'faulty_trip', now=1030)
+        self.assertEqual(['2', '3'], sorted(entry['key'] for entry in cache.get_report(now=1030)))
+
+
+if __name__ == "__main__":
+    unittest.main()
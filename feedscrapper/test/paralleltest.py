@@ -0,0 +1,92 @@
+import unittest
+import numpy as np
+from transitfeed import Loader
+from activetrips import ActiveTrips
+from feedscrapper import process_feed
+from geometrycache import GeometryCache
+from parallel import ProjectionPool, ProjectionWorkerError
+from tripbatch import TripStateBatch, RESULT_COLUMNS, get_vehicle_records
+from reprocess import RowCollector
+from tripbatchtest import VEHICLES, build_feed
+
+
+class ProjectionPoolTester(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.schedule = Loader(feed_path="./sample-feed").Load()
+        cls.pool = ProjectionPool("./sample-feed", 2, schedule=cls.schedule)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_pool_matches_batch(self):
+        records = get_vehicle_records(build_feed(VEHICLES))
+        hints = [None, 30, None, None, 0, None, None, None, None, None]
+        batch = TripStateBatch(self.schedule, records, last_segments=hints)
+        for i in range(2):
+            result = self.pool.project(records, hints)
+            self.assertEqual(batch.trip_ids, result.trip_ids)
+            self.assertEqual(batch.route_ids, result.route_ids)
+            for name in RESULT_COLUMNS:
+                np.testing.assert_array_equal(getattr(batch, name), getattr(result, name))
+
+    def test_shards_by_shape(self):
+        records = [rec._replace(route_id='') for rec in get_vehicle_records(build_feed(VEHICLES))]
+        self.assertEqual(['8093'], list(set(self.pool.get_shard_key(rec.trip_id) for rec in records[:8])))
+        self.assertEqual('unknown', self.pool.get_shard_key('unknown'))
+        self.assertEqual(2, len(set(self.pool.get_shard(str(i)) for i in range(10))))
+
+    def test_restart_after_worker_failure(self):
+        records = get_vehicle_records(build_feed(VEHICLES))
+        self.pool._processes[0].terminate()
+        self.pool._processes[0].join()
+        self.pool.RESULT_TIMEOUT = 0.1
+        try:
+            self.assertRaises(ProjectionWorkerError, self.pool.project, records)
+            self.assertTrue(self.pool.restart())
+        finally:
+            self.pool.RESULT_TIMEOUT = ProjectionPool.RESULT_TIMEOUT
+        self.assertEqual(len(records), len(self.pool.project(records)))
+
+    def test_process_feed_falls_back_to_in_process_projection(self):
+        pool = BrokenPool()
+        feed = build_feed(VEHICLES[3:4], 1517000000)
+        rows = RowCollector()
+        saved, projected = process_feed(self.schedule, feed, ActiveTrips(), rows, GeometryCache(), pool)
+        self.assertEqual((1, 1), (saved, projected))
+        self.assertEqual(1, len(rows.rows))
+        self.assertEqual(1, pool.restarts)
+
+    def test_failures_are_recorded_once(self):
+        feed = build_feed(VEHICLES[9:])
+        for pool in (self.pool, None):
+            geometry_cache = GeometryCache()
+            for i in range(2):
+                process_feed(self.schedule, feed, ActiveTrips(), RowCollector(), geometry_cache, pool,
+                             failures=geometry_cache.failures)
+            # the workers' failures are recorded when first seen, the in-process ones on every sighting
+            self.assertEqual([('unknown', 'faulty_trip', 1 if pool else 2)],
+                             [(entry['key'], entry['reason'], entry['seen'])
+                              for entry in geometry_cache.failures.get_report()])
+
+    def test_empty_feed(self):
+        self.assertEqual(0, len(self.pool.project([])))
+
+
+class BrokenPool:
+
+    def __init__(self):
+        self.restarts = 0
+
+    def project(self, records, last_segments=None):
+        raise ProjectionWorkerError("Worker 0 failed")
+
+    def restart(self):
+        self.restarts += 1
+        return True
+
+
+if __name__ == "__main__":
+    unittest.main()
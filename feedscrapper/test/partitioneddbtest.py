@@ -0,0 +1,93 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import pytz
+from partitioneddb import PartitionedDbManager, PERIOD_WEEK
+
+DAY = 24 * 3600
+# 2018-02-19 12:00 in Toronto
+NOON = 1519059600
+
+
+class PartitionedDbManagerTester(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, 'log.db')
+        self.time_zone = pytz.timezone('America/Toronto')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_days(self, db_manager, days):
+        for day in range(days):
+            db_manager.insert_logs([('2718', '247284', 2, NOON + day * DAY + i, 50 + day, 30, 0.5, 0.25)
+                                    for i in range(10)])
+            db_manager.commit()
+
+    def test_partition_key(self):
+        db_manager = PartitionedDbManager(self.db_file, self.time_zone)
+        self.assertEqual('20180219', db_manager.get_partition_key(NOON))
+        # after midnight rows belong to the previous service day
+        self.assertEqual('20180219', db_manager.get_partition_key(NOON + 13 * 3600))
+        self.assertEqual('20180220', db_manager.get_partition_key(NOON + 16 * 3600))
+        self.assertEqual('2018W08', PartitionedDbManager(self.db_file, self.time_zone, PERIOD_WEEK)
+                         .get_partition_key(NOON))
+
+    def test_rollover_and_union(self):
+        db_manager = PartitionedDbManager(self.db_file, self.time_zone)
+        self._write_days(db_manager, 4)
+        self.assertEqual(['20180219', '20180220', '20180221', '20180222'], db_manager.list_partitions())
+        self.assertEqual(['20180221', '20180222'], sorted(db_manager._open.keys()))
+        conn = sqlite3.connect(db_manager.get_partition_path('20180219'))
+        indexes = conn.execute("SELECT name FROM sqlite_master WHERE type='index'").fetchall()
+        conn.close()
+        self.assertEqual(2, len(indexes))
+
+        self.assertEqual(40, len(list(db_manager.query_log())))
+        self.assertEqual(10, len(list(db_manager.query_log("day = ?", (51,)))))
+        self.assertEqual(20, len(list(db_manager.query_log(start_key='20180221'))))
+        reader = db_manager.open_reader('20180220', '20180221')
+        self.assertEqual(20, reader.execute("SELECT COUNT(*) FROM vehicle_log").fetchone()[0])
+        reader.close()
+        db_manager.close_connection()
+
+    def _get_indexes(self, db_manager, key):
+        conn = sqlite3.connect(db_manager.get_partition_path(key))
+        indexes = conn.execute("SELECT name FROM sqlite_master WHERE type='index'").fetchall()
+        conn.close()
+        return indexes
+
+    def test_late_rows_keep_partition_closed(self):
+        db_manager = PartitionedDbManager(self.db_file, self.time_zone)
+        self._write_days(db_manager, 4)
+        db_manager.insert_log('2718', '247285', 2, NOON + 5, 50, 30, 0.5, 0.25)
+        db_manager.commit()
+        self.assertEqual(['20180221', '20180222'], sorted(db_manager._open.keys()))
+        self.assertEqual(11, len(list(db_manager.query_log(start_key='20180219', end_key='20180219'))))
+        self.assertEqual(2, len(self._get_indexes(db_manager, '20180219')))
+        db_manager.close_connection()
+
+    def test_missing_indexes_are_built_on_start(self):
+        crashed = PartitionedDbManager(self.db_file, self.time_zone)
+        self._write_days(crashed, 1)
+        self.assertEqual(0, len(self._get_indexes(crashed, '20180219')))
+        db_manager = PartitionedDbManager(self.db_file, self.time_zone)
+        db_manager.insert_log('2718', '247285', 2, NOON + DAY, 51, 30, 0.5, 0.25)
+        self.assertEqual(2, len(self._get_indexes(db_manager, '20180219')))
+        db_manager.close_connection()
+        crashed._open.clear()
+
+    def test_retention_and_compaction(self):
+        db_manager = PartitionedDbManager(self.db_file, self.time_zone, retention=2)
+        self._write_days(db_manager, 4)
+        self.assertEqual(['20180221', '20180222'], db_manager.list_partitions())
+        db_manager.close_connection()
+        db_manager.compact_partition('20180221')
+        self.assertEqual(10, len(list(db_manager.query_log(start_key='20180221', end_key='20180221'))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from transitfeed import Loader
+from transitfeed import Point
+from geometrycache import GeometryCache
+from profiler import ConstructionLog, CycleProfiler, StackSampler
+from tripbatch import TripStateBatch
+from utils import TripState, ENGINE_PYTHON, ENGINE_NUMPY
+from tripbatchtest import VEHICLES, build_feed
+
+
+def spin(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class ProfilerTester(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_sampler(self):
+        sampler = StackSampler(0.001)
+        sampler.start()
+        try:
+            spin(0.2)
+        finally:
+            sampler.stop()
+        self.assertTrue(sampler.samples > 10)
+        self.assertTrue(any('spin (profilertest.py' in line for line in sampler.get_folded()))
+        top = sampler.get_top_functions(1)[0]
+        self.assertTrue(top['function'].startswith('spin '))
+        self.assertEqual(top['self'], top['total'])
+
+    def test_construction_log_keeps_the_slowest(self):
+        log = ConstructionLog(top_n=2)
+        for i, seconds in enumerate([0.1, 0.5, 0.2, 0.05]):
+            log.add(seconds, str(i), 'shape', 10, 5, True, False)
+        self.assertEqual(['1', '2'], [entry['trip_id'] for entry in log.get_top()])
+
+    def test_trip_state_constructions(self):
+        schedule = Loader(feed_path="./sample-feed").Load()
+        TripState.CONSTRUCTIONS = ConstructionLog()
+        try:
+            geometry_cache = GeometryCache()
+            TripState(schedule.GetTrip('247285'), Point.FromLatLng(42.14446157431765, 24.80178254507307), '',
+                      geometry_cache=geometry_cache)
+            TripState(schedule.GetTrip('247285'), Point.FromLatLng(42.14446157431765, 24.80178254507307), '',
+                      geometry_cache=geometry_cache)
+            entries = sorted(TripState.CONSTRUCTIONS.get_top(), key=lambda entry: not entry['scanned'])
+        finally:
+            TripState.CONSTRUCTIONS = None
+        # the second TripState reuses the cached schedule
+        self.assertEqual([True, False], [entry['scanned'] for entry in entries])
+        # a displaced stop is reachable only with the bigger tolerance, also in the cached pattern
+        self.assertEqual([True, True], [entry['fallback'] for entry in entries])
+        self.assertEqual('247285', entries[0]['trip_id'])
+        self.assertTrue(entries[0]['points'] > 0 and entries[0]['stops'] > 0)
+
+    def test_batch_constructions(self):
+        schedule = Loader(feed_path="./sample-feed").Load()
+        feed = build_feed(VEHICLES)
+        for engine in (ENGINE_PYTHON, ENGINE_NUMPY):
+            TripState.CONSTRUCTIONS = ConstructionLog()
+            try:
+                geometry_cache = GeometryCache()
+                TripStateBatch.from_feed(schedule, feed, engine=engine, geometry_cache=geometry_cache)
+                TripStateBatch.from_feed(schedule, feed, engine=engine, geometry_cache=geometry_cache)
+                entries = TripState.CONSTRUCTIONS.get_top()
+            finally:
+                TripState.CONSTRUCTIONS = None
+            # every vehicle with a known trip in both snapshots, the schedules are built once
+            self.assertEqual(['247284'] * 16 + ['247285'] * 2, sorted(entry['trip_id'] for entry in entries))
+            self.assertEqual(2, sum(entry['scanned'] for entry in entries))
+            self.assertEqual(2, sum(entry['fallback'] for entry in entries))
+
+    def test_only_slow_cycles_are_written(self):
+        profiler = CycleProfiler(os.path.join(self.tmp_dir, 'profiles'), threshold=0.1, interval=0.001)
+        profiler.start_cycle()
+        spin(0.01)
+        self.assertEqual(None, profiler.end_cycle(0.01))
+
+        profiler.start_cycle()
+        profiler.constructions.add(0.3, '247284', '2718', 40, 5, True, True)
+        spin(0.15)
+        path = profiler.end_cycle(0.15, {'saved': 1})
+        with open(path) as json_file:
+            report = json.load(json_file)
+        self.assertEqual('247284', report['constructions'][0]['trip_id'])
+        self.assertEqual({'saved': 1}, report['info'])
+        self.assertTrue(report['samples'] > 0)
+        self.assertTrue(os.path.exists(path.replace('.json', '.folded')))
+        self.assertEqual(2, len(os.listdir(profiler.output_dir)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+import requests
+from recorder import RecordingWriter, ReplayServer, read_recording
+
+
+class RecorderTester(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'feed.rec')
+        self.snapshots = [(1517000000.5 + 30 * i, 'snapshot {}'.format(i)) for i in range(3)]
+        writer = RecordingWriter(self.path)
+        for fetch_time, data in self.snapshots:
+            writer.write(fetch_time, data)
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_read_recording(self):
+        self.assertEqual(self.snapshots, list(read_recording(self.path)))
+        with open(self.path, 'ab') as rec_file:
+            rec_file.write('\x00\x01')
+        self.assertRaises(ValueError, list, read_recording(self.path))
+
+    def test_replay_server(self):
+        server = ReplayServer(self.path).start()
+        try:
+            contents = [requests.get(server.url).content for i in range(4)]
+            self.assertTrue(server.is_finished())
+        finally:
+            server.stop()
+        self.assertEqual(['snapshot 0', 'snapshot 1', 'snapshot 2', 'snapshot 2'], contents)
+
+    def test_replay_speed(self):
+        server = ReplayServer(self.path, speed=1000).start()
+        try:
+            self.assertEqual('snapshot 0', requests.get(server.url).content)
+            server._started -= 0.035
+            self.assertEqual('snapshot 1', requests.get(server.url).content)
+            server._started -= 1
+            self.assertEqual('snapshot 2', requests.get(server.url).content)
+            self.assertTrue(server.is_finished())
+        finally:
+            server.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
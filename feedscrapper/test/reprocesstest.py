@@ -0,0 +1,59 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from transitfeed import Loader
+from reprocess import list_snapshots, plan_partitions, reprocess, reprocess_partition
+from feedscrapper import get_time_zone
+from tripbatchtest import VEHICLES, build_feed
+
+ROLLOVER = 1517040000  # 2018-01-27 03:00 in the sample feed's America/Toronto
+
+
+class ReprocessTester(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.snapshot_dir = os.path.join(self.tmp_dir, 'snapshots')
+        os.mkdir(self.snapshot_dir)
+        # a trip running across the end of the service day
+        for vehicle, timestamp in ((3, ROLLOVER - 1200), (4, ROLLOVER - 600), (5, ROLLOVER), (6, ROLLOVER + 600)):
+            name = 'vehicles-{}.pb'.format(timestamp) if vehicle != 6 else 'latest.pb'
+            with open(os.path.join(self.snapshot_dir, name), 'wb') as snapshot_file:
+                snapshot_file.write(build_feed([VEHICLES[vehicle]], timestamp).SerializeToString())
+        self.schedule = Loader(feed_path="./sample-feed").Load()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_plan_partitions(self):
+        snapshots = list_snapshots(self.snapshot_dir)
+        self.assertEqual([ROLLOVER - 1200, ROLLOVER - 600, ROLLOVER, ROLLOVER + 600], [s[0] for s in snapshots])
+        partitions = plan_partitions(snapshots, get_time_zone(self.schedule), warmup=900)
+        self.assertEqual(['20180126', '20180127'], [partition[0] for partition in partitions])
+        self.assertEqual([[], [snapshots[1]]], [partition[1] for partition in partitions])
+        self.assertEqual([snapshots[:2], snapshots[2:]], [partition[2] for partition in partitions])
+
+    def test_days_match_a_continuous_replay(self):
+        snapshots = list_snapshots(self.snapshot_dir)
+        expected, replayed = reprocess_partition(self.schedule, [], snapshots)
+        self.assertEqual(4, len(expected))
+
+        db_file = os.path.join(self.tmp_dir, 'log.db')
+        count, replayed, num_rows, seconds = reprocess('./sample-feed', self.snapshot_dir, db_file, workers=2)
+        self.assertEqual((4, 6, 4), (count, replayed, num_rows))
+        conn = sqlite3.connect(db_file)
+        rows = conn.execute("SELECT route_id, trip_id, stop_seq, time, day, delay_sec, progress, stop_progress "
+                            "FROM vehicle_log ORDER BY time").fetchall()
+        conn.close()
+        self.assertEqual([row[:6] for row in expected], [row[:6] for row in rows])
+        self.assertRaises(ValueError, reprocess, './sample-feed', self.snapshot_dir, db_file)
+
+        # without warm-up the trip is rejected in the new day as it's already far from its first stops
+        db_file = os.path.join(self.tmp_dir, 'cold.db')
+        self.assertEqual(2, reprocess('./sample-feed', self.snapshot_dir, db_file, warmup=0)[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
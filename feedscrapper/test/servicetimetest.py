@@ -0,0 +1,72 @@
+from datetime import date, datetime
+import unittest
+import numpy as np
+import pytz
+from servicetime import ServiceTime
+
+
+class ServiceTimeTester(unittest.TestCase):
+
+    def setUp(self):
+        self.time_zone = pytz.timezone('America/Toronto')
+        self.service_time = ServiceTime(self.time_zone)
+
+    def _timestamp(self, *local_time):
+        local_time = self.time_zone.localize(datetime(*local_time))
+        return int((local_time - pytz.utc.localize(datetime(1970, 1, 1))).total_seconds())
+
+    def test_seconds_match_local_time(self):
+        timestamps = np.arange(1517000000, 1517000000 + 3 * 24 * 3600, 997)
+        seconds, dates = self.service_time.get_seconds(timestamps)
+        for timestamp, second, service_date in zip(timestamps, seconds, dates):
+            local_time = datetime.fromtimestamp(timestamp, self.time_zone)
+            self.assertEqual(local_time.hour * 3600 + local_time.minute * 60 + local_time.second, second)
+            self.assertEqual(local_time.date().toordinal(), service_date)
+
+    def test_trip_past_midnight(self):
+        # 00:40 of 2018-01-27 is 24:40 of the 26th
+        delays, dates = self.service_time.get_delays([self._timestamp(2018, 1, 27, 0, 40)], [24 * 3600 + 30 * 60])
+        self.assertEqual([600], list(delays))
+        self.assertEqual([date(2018, 1, 26).toordinal()], list(dates))
+        self.assertEqual([26], list(self.service_time.get_day_of_year(dates)))
+
+    def test_early_before_midnight(self):
+        delays, dates = self.service_time.get_delays([self._timestamp(2018, 1, 26, 23, 58)], [5 * 60])
+        self.assertEqual([-420], list(delays))
+        self.assertEqual([date(2018, 1, 27).toordinal()], list(dates))
+
+    def test_day_with_offset_change(self):
+        # the service day of 2018-03-11 starts at 23:00 EST of the 10th, an hour before the midnight
+        service_date = date(2018, 3, 11).toordinal()
+        self.assertEqual(self._timestamp(2018, 3, 10, 23), self.service_time.get_day_start(service_date))
+        delays, dates = self.service_time.get_delays([self._timestamp(2018, 3, 11, 8, 5)], [8 * 3600])
+        self.assertEqual([300], list(delays))
+        self.assertEqual([service_date], list(dates))
+
+    def test_unknown_scheduled_time(self):
+        timestamp = self._timestamp(2018, 1, 27, 10)
+        delays, dates = self.service_time.get_delays([timestamp, timestamp], [np.nan, 36000])
+        self.assertTrue(np.isnan(delays[0]))
+        self.assertEqual(0, delays[1])
+        self.assertEqual([date(2018, 1, 27).toordinal()] * 2, list(dates))
+        self.assertEqual((0, 0), tuple(len(array) for array in self.service_time.get_delays([], [])))
+
+    def test_afternoon_without_scheduled_time(self):
+        time_zone = pytz.timezone('Europe/Sofia')
+        service_time = ServiceTime(time_zone)
+        timestamp = int((time_zone.localize(datetime(2024, 5, 10, 14)) -
+                         pytz.utc.localize(datetime(1970, 1, 1))).total_seconds())
+        delays, dates = service_time.get_delays([timestamp], [np.nan])
+        self.assertTrue(np.isnan(delays[0]))
+        self.assertEqual([131], list(service_time.get_day_of_year(dates)))
+
+    def test_table_grows(self):
+        self.service_time.get_seconds([1517000000])
+        seconds, dates = self.service_time.get_seconds([1517000000 + 400 * 24 * 3600, 1517000000 - 400 * 24 * 3600])
+        self.assertEqual(list(seconds), list(self.service_time.get_seconds([1517000000 + 400 * 24 * 3600])[0]) +
+                         list(self.service_time.get_seconds([1517000000 - 400 * 24 * 3600])[0]))
+        self.assertEqual(800, dates[0] - dates[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from transitfeed import Loader
+from transitfeed import Point
+from transitfeed import GetClosestPoint
+from geometrycache import ShapeGeometry
+
+
+class SegmentIndexTester(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(SegmentIndexTester, self).__init__(*args, **kwargs)
+        loader = Loader(feed_path="./sample-feed")
+        schedule = loader.Load()
+        self.geometry = ShapeGeometry('8093', schedule.GetShape('8093').points)
+
+    def test_query_returns_all_close_segments(self):
+        poly = self.geometry.poly
+        index = self.geometry.get_index()
+        for radius in (30, 100):
+            for i in range(-5, 25):
+                for j in range(-5, 10):
+                    pt = Point.FromLatLng(42.145 - i * 0.0006, 24.794 + j * 0.0008)
+                    close = [k for k in range(len(poly.distance))
+                             if GetClosestPoint(pt, poly.GetPoint(k), poly.GetPoint(k + 1)).GetDistanceMeters(pt) <= radius]
+                    candidates = index.query(pt, radius)
+                    self.assertTrue(set(close).issubset(candidates))
+                    self.assertEqual(sorted(candidates), candidates)
+
+    def test_query_far_from_shape(self):
+        self.assertEqual([], self.geometry.get_index().query(Point.FromLatLng(42.2, 24.9), 100))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+from snapshotdiff import SnapshotDiff
+from tripbatch import VehicleRecord
+
+
+def record(trip_id, timestamp, lat=42.1, lon=24.7):
+    return VehicleRecord(trip_id, '2718', '', lat, lon, timestamp)
+
+
+class SnapshotDiffTester(unittest.TestCase):
+
+    def test_filter(self):
+        diff = SnapshotDiff()
+        first = [record('1', 100), record('2', 100), record('2', 110), record('3', 100)]
+        self.assertEqual(['1', '2', '3'], [rec.trip_id for rec in diff.filter(first)])
+        self.assertEqual((0, 0, 3, 1), (diff.changed, diff.unchanged, diff.new, diff.duplicates))
+
+        second = [record('1', 100), record('2', 130), record('3', 100, lat=42.2), record('4', 130)]
+        self.assertEqual(['2', '3', '4'], [rec.trip_id for rec in diff.filter(second)])
+        self.assertEqual((2, 1, 1, 0), (diff.changed, diff.unchanged, diff.new, diff.gone))
+
+        self.assertEqual(['1'], [rec.trip_id for rec in diff.filter([record('1', 160)])])
+        self.assertEqual({'changed': 1, 'unchanged': 0, 'new': 0, 'gone': 3, 'duplicates': 0}, diff.get_stats())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+from datetime import datetime
+import calendar
+import unittest
+import numpy as np
+import pytz
+from google.transit import gtfs_realtime_pb2
+from transitfeed import Loader
+from transitfeed import Point
+from geometrycache import GeometryCache
+from utils import TripState, ENGINE_PYTHON, ENGINE_NUMPY
+from tripbatch import TripStateBatch, STATUS_OK, STATUS_FAULTY_TRIP, STATUS_OUT_OF_POLYLINE
+from feedscrapper import ActiveTrips, filter_updates, process_feed
+from reprocess import RowCollector
+
+VEHICLES = [('247284', 42.14530077994279, 24.800326824188232, ''),
+            ('247284', 42.13357424874254, 24.79510188102722, ''),
+            ('247284', 42.14507245405113, 24.79940072944254, ''),
+            ('247284', 42.14446157431765, 24.80178254507307, '2'),
+            ('247284', 42.14178793873418, 24.79772549935979, ''),
+            ('247284', 42.13851564680248, 24.79707830644129, '3'),
+            ('247284', 42.13432309381219, 24.7953958493531, ''),
+            ('247285', 42.13432309381219, 24.7953958493531, ''),
+            ('247284', 42.2, 24.9, ''),
+            ('unknown', 42.13432309381219, 24.7953958493531, '')]
+
+
+def build_feed(vehicles, timestamp=1517000000):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '1.0'
+    feed.header.timestamp = timestamp
+    for i, (trip_id, lat, lon, stop_id) in enumerate(vehicles):
+        entity = feed.entity.add()
+        entity.id = str(i)
+        entity.vehicle.trip.trip_id = trip_id
+        entity.vehicle.trip.route_id = '2718'
+        entity.vehicle.position.latitude = lat
+        entity.vehicle.position.longitude = lon
+        entity.vehicle.stop_id = stop_id
+        entity.vehicle.timestamp = timestamp
+    return feed
+
+
+class TripStateBatchTester(unittest.TestCase):
+
+    def __init__(self, *args, **kwargs):
+        super(TripStateBatchTester, self).__init__(*args, **kwargs)
+        loader = Loader(feed_path="./sample-feed")
+        self.schedule = loader.Load()
+
+    def test_batch_matches_trip_state(self):
+        DELTA = 1e-6
+        feed = build_feed(VEHICLES)
+        for engine in (ENGINE_PYTHON, ENGINE_NUMPY):
+            batch = TripStateBatch.from_feed(self.schedule, feed, engine=engine)
+            self.assertEqual(len(VEHICLES), len(batch))
+            self.assertEqual(STATUS_OUT_OF_POLYLINE, batch.status[8])
+            self.assertEqual(STATUS_FAULTY_TRIP, batch.status[9])
+            for i, record in enumerate(batch.records[:8]):
+                self.assertEqual(STATUS_OK, batch.status[i])
+                trip_state = TripState(self.schedule.GetTrip(record.trip_id), Point.FromLatLng(record.lat, record.lon),
+                                       record.stop_id)
+                self.assertTrue(abs(trip_state.error - batch.error[i]) < DELTA)
+                self.assertTrue(abs(trip_state.get_trip_progress() - batch.progress[i]) < DELTA)
+                self.assertTrue(abs(trip_state.get_stop_progress() - batch.stop_progress[i]) < DELTA)
+                self.assertEqual(trip_state.get_prev_stop_seq(), batch.prev_stop_seq[i])
+                self.assertTrue(abs(trip_state.get_estimated_scheduled_time() - batch.estimated_time[i]) < DELTA)
+                self.assertTrue(abs(trip_state.get_distance_to_end_stop() - batch.distance_to_end_stop[i]) < DELTA)
+
+    def test_batch_with_last_segments(self):
+        feed = build_feed(VEHICLES)
+        full = TripStateBatch.from_feed(self.schedule, feed, engine=ENGINE_NUMPY)
+        found = full.status == STATUS_OK
+        for hint in (0, 5, 30):
+            batches = [TripStateBatch.from_feed(self.schedule, feed, engine=engine, last_segments=lambda trip_id: hint)
+                       for engine in (ENGINE_PYTHON, ENGINE_NUMPY)]
+            self.assertEqual(list(full.status), list(batches[0].status))
+            self.assertEqual(list(batches[0].status), list(batches[1].status))
+            self.assertTrue((abs(batches[0].distance[found] - batches[1].distance[found]) < 1e-6).all())
+            if hint == 0:
+                self.assertTrue((abs(full.distance[found] - batches[1].distance[found]) < 1e-6).all())
+
+    def test_faulty_trips_are_cached(self):
+        geometry_cache = GeometryCache()
+        feed = build_feed(VEHICLES[8:])
+        for engine in (ENGINE_PYTHON, ENGINE_NUMPY):
+            batch = TripStateBatch.from_feed(self.schedule, feed, engine=engine, geometry_cache=geometry_cache)
+            self.assertEqual([STATUS_OUT_OF_POLYLINE, STATUS_FAULTY_TRIP], list(batch.status))
+        # the unknown trip is looked up once, a vehicle out of the shape isn't a trip failure
+        self.assertEqual(1, geometry_cache.failures.hits)
+        self.assertEqual([('unknown', 'faulty_trip', 2)],
+                         [(entry['key'], entry['reason'], entry['seen']) for entry in geometry_cache.failures.get_report()])
+
+    def test_filter_updates(self):
+        active_trips = ActiveTrips()
+        batch = TripStateBatch.from_feed(self.schedule, build_feed([VEHICLES[5]], 1517000000))
+        self.assertFalse(filter_updates(batch, active_trips)[0])  # new trip far from the first stops
+
+        batch = TripStateBatch.from_feed(self.schedule, build_feed([VEHICLES[3]], 1517000000))
+        self.assertTrue(filter_updates(batch, active_trips)[0])
+        active_trips.add_update_trip('247284', 1517000000, batch.progress[0])
+        self.assertFalse(filter_updates(batch, active_trips)[0])  # the same timestamp
+
+        batch = TripStateBatch.from_feed(self.schedule, build_feed([VEHICLES[6]], 1517000010))
+        self.assertFalse(filter_updates(batch, active_trips)[0])  # too fast
+
+        batch = TripStateBatch.from_feed(self.schedule, build_feed([VEHICLES[4]], 1517000600))
+        self.assertTrue(filter_updates(batch, active_trips)[0])
+        active_trips.add_update_trip('247284', 1517000600, batch.progress[0])
+
+        batch = TripStateBatch.from_feed(self.schedule, build_feed([VEHICLES[3]], 1517000700))
+        self.assertFalse(filter_updates(batch, active_trips)[0])  # backwards
+
+    def test_update_before_the_first_stop(self):
+        # the placeholder scheduled time 0 would move an afternoon update to the next service day
+        time_zone = pytz.timezone('Europe/Sofia')
+        timestamp = calendar.timegm(time_zone.localize(datetime(2024, 5, 10, 14)).utctimetuple())
+        active_trips = ActiveTrips(time_zone)
+        rows = RowCollector()
+        saved, projected = process_feed(self.schedule, build_feed([VEHICLES[2]], timestamp), active_trips, rows,
+                                        GeometryCache())
+        self.assertEqual((1, 1), (saved, projected))
+        self.assertEqual(131, active_trips.get_day_for_trip('247284'))
+        # stop_seq 0, the delay is the time of the day as before
+        self.assertEqual([(0, 131, 14 * 3600)], [(row[2], row[4], row[5]) for row in rows.rows])
+
+    def test_untimed_position(self):
+        feed = build_feed([VEHICLES[3], ('247285',) + VEHICLES[3][1:]], 1517000000)
+        batch = TripStateBatch.from_feed(self.schedule, feed)
+        batch.estimated_time[1] = np.nan
+        active_trips = ActiveTrips(pytz.timezone('America/Toronto'))
+        rows = RowCollector()
+        saved, projected = process_feed(self.schedule, feed, active_trips, rows, projection_pool=FixedPool(batch))
+        self.assertEqual((2, 2), (saved, projected))
+        self.assertEqual(26, active_trips.get_day_for_trip('247285'))
+        # 15:53:20 local time
+        self.assertEqual(('247285', 26, 57200), (rows.rows[1][1], rows.rows[1][4], rows.rows[1][5]))
+
+
+class FixedPool:
+
+    def __init__(self, batch):
+        self.batch = batch
+
+    def project(self, records, last_segments=None):
+        return self.batch
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,8 +2,12 @@ import unittest
 from transitfeed import Loader
 from transitfeed import Point
 from utils import TripState
+from utils import ENGINE_PYTHON, ENGINE_NUMPY
 from utils import StopFarFromPolylineException
 from utils import VehicleOutOfPolylineException
+from utils import get_trip_times, get_stop_pattern, PATTERN_UNREACHABLE
+from geometrycache import GeometryCache
+from stoppattern import StopPattern, TripTimes
 
 
 class TripStateTester(unittest.TestCase):
@@ -109,6 +113,92 @@ class TripStateTester(unittest.TestCase):
         except StopFarFromPolylineException as e:
             self.fail("Stop finding doesn't work")
 
+    def test_search_window(self):
+        vehicle = Point.FromLatLng(42.13851564680248, 24.79707830644129)
+        trip_state = TripState(self.trip, vehicle, '')
+        self.assertFalse(trip_state.found_in_window)
+        resumed = TripState(self.trip, vehicle, '', trip_state.segment_indx - 1)
+        self.assertTrue(resumed.found_in_window)
+        self.assertEqual(trip_state.distance, resumed.distance)
+
+        TripState.WINDOW_AHEAD = 10
+        try:
+            # the window doesn't reach the vehicle, so the whole shape is searched
+            resumed = TripState(self.trip, vehicle, '', 0)
+            self.assertFalse(resumed.found_in_window)
+            self.assertEqual(trip_state.distance, resumed.distance)
+        finally:
+            TripState.WINDOW_AHEAD = 3000
+
+    def test_unreachable_pattern_is_cached(self):
+        cache = GeometryCache()
+        geometry = cache.get_shape(self.schedule, self.trip.shape_id)
+        for scanned in (True, False):
+            scan = {}
+            self.assertRaises(StopFarFromPolylineException, get_stop_pattern, cache, geometry, self.stop_times, 0.001,
+                              scan)
+            self.assertEqual(scanned, scan['scanned'])
+        stop_ids = tuple(st_time[2].stop_id for st_time in self.stop_times)
+        self.assertEqual([((self.trip.shape_id, stop_ids), PATTERN_UNREACHABLE, 2)],
+                         [(entry['key'], entry['reason'], entry['seen']) for entry in cache.failures.get_report()])
+
+    def test_geometry_is_shared(self):
+        cache = GeometryCache()
+        trip_state_a = TripState(self.trip, Point.FromLatLng(42.14446157431765, 24.80178254507307), '', geometry_cache=cache)
+        trip_state_b = TripState(self.trip, Point.FromLatLng(42.14178793873418, 24.79772549935979), '', geometry_cache=cache)
+        self.assertTrue(trip_state_a.poly is trip_state_b.poly)
+        self.assertTrue(trip_state_a._stop_distances is trip_state_b._stop_distances)
+        self.assertEqual(1, len(cache))
+
+    def test_geometry_cache_eviction(self):
+        cache = GeometryCache(max_shapes=1, max_patterns=1)
+        first = cache.get_shape(self.schedule, '8093')
+        self.assertTrue(first is cache.get_shape(self.schedule, '8093'))
+        stop_ids = [st_time[2].stop_id for st_time in self.stop_times]
+        cache.add_pattern(StopPattern(first, stop_ids, [0, 1, 2, 3, 4], None))
+        cache.add_pattern(StopPattern(first, stop_ids[::-1], [0, 1, 2, 3, 4], None))
+        self.assertEqual(None, cache.get_pattern('8093', stop_ids))
+
+    def test_trips_share_stop_pattern(self):
+        cache = GeometryCache()
+        trip_state = TripState(self.trip, Point.FromLatLng(42.14178793873418, 24.79772549935979), '', geometry_cache=cache)
+        shifted = TripTimes('shifted', trip_state.pattern, [(arr + 600, dep + 600, stop) for arr, dep, stop in self.stop_times])
+        self.assertTrue(trip_state.trip_times is get_trip_times(cache, self.trip, TripState.STOP_ERROR))
+        self.assertEqual(1, cache.get_num_patterns())
+        self.assertEqual(self.stop_times[0][1], trip_state.trip_times.start)
+        self.assertEqual([st_time[0] for st_time in self.stop_times], list(trip_state.trip_times.get_arrival()))
+        self.assertEqual(trip_state.get_estimated_scheduled_time() + 600,
+                         shifted.get_scheduled_time(trip_state.distance))
+        self.assertEqual(0, shifted.get_scheduled_time(trip_state.pattern.distances[0] - 1))
+        self.assertEqual(self.stop_times[-1][0] + 600, shifted.get_scheduled_time(trip_state.pattern.distances[-1]))
+
+
+class TripStateNumpyTester(TripStateTester):
+
+    def setUp(self):
+        TripState.ENGINE = ENGINE_NUMPY
+
+    def tearDown(self):
+        TripState.ENGINE = ENGINE_PYTHON
+
+    def test_engines_agree(self):
+        DELTA = 1e-6
+        for i in range(-5, 25):
+            for j in range(-5, 10):
+                vehicle = Point.FromLatLng(42.145 - i * 0.0006, 24.794 + j * 0.0008)
+                for next_stop_id in ('', '2', '4'):
+                    results = []
+                    for engine in (ENGINE_PYTHON, ENGINE_NUMPY):
+                        try:
+                            trip_state = TripState(self.trip, vehicle, next_stop_id, engine=engine)
+                            results.append((trip_state.distance, trip_state.error))
+                        except VehicleOutOfPolylineException:
+                            results.append(None)
+                    if results[0] is None:
+                        self.assertEqual(None, results[1])
+                    else:
+                        self.assertTrue(abs(results[0][0] - results[1][0]) < DELTA)
+                        self.assertTrue(abs(results[0][1] - results[1][1]) < DELTA)
 
 
 if __name__ == "__main__":
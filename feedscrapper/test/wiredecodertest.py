@@ -0,0 +1,54 @@
+import unittest
+from google.protobuf.message import DecodeError
+from tripbatch import get_vehicle_records
+from tripbatchtest import VEHICLES, build_feed
+from wiredecoder import decode_feed, parse_feed, compare_records, DECODER_FAST, DECODER_VALIDATE
+
+
+def build_mixed_feed():
+    feed = build_feed(VEHICLES)
+    trip_update = feed.entity.add()
+    trip_update.id = 'tu'
+    trip_update.trip_update.trip.trip_id = '247284'
+    stop_time_update = trip_update.trip_update.stop_time_update.add()
+    stop_time_update.stop_id = '3'
+    stop_time_update.arrival.delay = -30
+    alert = feed.entity.add()
+    alert.id = 'alert'
+    alert.alert.informed_entity.add().route_id = '2718'
+    vehicle = feed.entity.add()
+    vehicle.id = 'v'
+    vehicle.vehicle.vehicle.id = 'bus 17'
+    vehicle.vehicle.position.latitude = 42.1
+    vehicle.vehicle.position.longitude = 24.7
+    vehicle.vehicle.position.bearing = 90
+    vehicle.vehicle.position.odometer = 12345.5
+    vehicle.vehicle.current_stop_sequence = 300
+    vehicle.vehicle.trip.trip_id = u'\u0442\u0440\u0438\u043f'
+    return feed
+
+
+class WireDecoderTester(unittest.TestCase):
+
+    def test_matches_full_parse(self):
+        feed = build_mixed_feed()
+        decoded = decode_feed(feed.SerializeToString())
+        self.assertEqual(feed.header.timestamp, decoded.header.timestamp)
+        self.assertEqual(len(VEHICLES) + 1, len(decoded.records))
+        self.assertEqual([], compare_records(get_vehicle_records(feed), decoded.records))
+        self.assertTrue(get_vehicle_records(decoded) is decoded.records)
+
+    def test_parse_feed(self):
+        data = build_mixed_feed().SerializeToString()
+        self.assertEqual(len(VEHICLES) + 1, len(parse_feed(data, DECODER_FAST).records))
+        self.assertEqual(len(VEHICLES) + 3, len(parse_feed(data, DECODER_VALIDATE).entity))
+
+    def test_malformed_input(self):
+        data = build_mixed_feed().SerializeToString()
+        self.assertRaises(DecodeError, decode_feed, data[:-3])
+        self.assertRaises(DecodeError, decode_feed, data + '\x0b')
+        self.assertEqual(0, len(decode_feed('').records))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,275 @@
+from collections import namedtuple
+from transitfeed import Point
+from utils import TripState, ENGINE_NUMPY, build_trip_times, locate_on_segment, get_search_window
+from utils import StopFarFromPolylineException, VehicleOutOfPolylineException
+import numpy as np
+import projection
+import time
+
+STATUS_OK = 0
+STATUS_FAULTY_TRIP = 1
+STATUS_STOPS_UNREACHABLE = 2
+STATUS_OUT_OF_POLYLINE = 3
+STATUS_NAMES = {STATUS_OK: 'ok', STATUS_FAULTY_TRIP: 'faulty_trip', STATUS_STOPS_UNREACHABLE: 'stops_unreachable',
+                STATUS_OUT_OF_POLYLINE: 'out_of_polyline'}
+_STATUS_BY_NAME = dict((name, status) for status, name in STATUS_NAMES.items())
+
+# per vehicle result arrays of TripStateBatch
+RESULT_COLUMNS = ('status', 'distance', 'error', 'segment', 'distance_to_end_stop', 'trip_len', 'prev_stop_seq',
+                  'stop_progress', 'progress', 'estimated_time')
+
+VehicleRecord = namedtuple('VehicleRecord', ['trip_id', 'route_id', 'stop_id', 'lat', 'lon', 'timestamp'])
+
+
+def get_vehicle_records(feed):
+    """"Extracts the fields used for projection from every vehicle entity of a FeedMessage. A DecodedFeed of the fast
+        decoder holds them already."""
+    if hasattr(feed, 'records'):
+        return feed.records
+    records = []
+    for entity in feed.entity:
+        if entity.HasField('vehicle'):
+            vehicle = entity.vehicle
+            records.append(VehicleRecord(vehicle.trip.trip_id, vehicle.trip.route_id, vehicle.stop_id,
+                                         vehicle.position.latitude, vehicle.position.longitude, vehicle.timestamp))
+    return records
+
+
+class TripStateBatch:
+    """"Column oriented counterpart of TripState for all vehicles of a feed snapshot. Vehicles on the same shape are
+        projected together and per vehicle results are kept in arrays indexed like the input records. Rows with
+        status other than STATUS_OK hold NaN values.
+        last_segments holds for every record the segment its trip was matched to last time or None, see
+        TripState.last_known. The cost of every row with a schedule, its share of the projection and the build of
+        the schedule when it wasn't cached, is added to TripState.CONSTRUCTIONS."""
+
+    def __init__(self, schedule, records, engine=None, geometry_cache=None, last_segments=None):
+        self.schedule = schedule
+        self.engine = engine or TripState.ENGINE
+        self.geometry_cache = geometry_cache if geometry_cache is not None else TripState.GEOMETRY_CACHE
+        self.records = records
+        count = len(records)
+        self.trip_ids = [rec.trip_id for rec in records]
+        self.route_ids = [rec.route_id for rec in records]
+        self.timestamps = np.array([rec.timestamp for rec in records], dtype=np.int64)
+        self.status = np.zeros(count, dtype=np.int8)
+        self.distance = np.full(count, np.nan)
+        self.error = np.full(count, np.nan)
+        self.distance_to_end_stop = np.full(count, np.nan)
+        self.trip_len = np.full(count, np.nan)
+        self.segment = np.full(count, -1, dtype=np.int64)
+        self.last_segments = last_segments if last_segments is not None else [None] * count
+        self.trip_times = [None] * count
+        self.vehicles = [Point.FromLatLng(rec.lat, rec.lon) for rec in records]
+        self._costs = np.zeros(count)
+        self._scans = [None] * count
+
+        self._load_trip_times()
+        if self.engine == ENGINE_NUMPY:
+            self._project_vectorized()
+        else:
+            self._project_by_trip_state()
+        self._calculate_progress()
+        if TripState.CONSTRUCTIONS is not None:
+            self._record_costs(TripState.CONSTRUCTIONS)
+
+    @classmethod
+    def from_feed(cls, schedule, feed, engine=None, geometry_cache=None, last_segments=None):
+        """"last_segments is a callable returning the last matched segment for a trip_id."""
+        records = get_vehicle_records(feed)
+        hints = [last_segments(rec.trip_id) for rec in records] if last_segments is not None else None
+        return cls(schedule, records, engine, geometry_cache, hints)
+
+    def __len__(self):
+        return len(self.records)
+
+    def _load_trip_times(self):
+        for i, rec in enumerate(self.records):
+            trip_times = self.geometry_cache.get_trip_times(rec.trip_id)
+            scan = {'scanned': False, 'fallback': trip_times.pattern.fallback if trip_times is not None else False}
+            if trip_times is None:
+                started = time.time()
+                failure = self.geometry_cache.failures.get(rec.trip_id)
+                if failure is not None:
+                    self.status[i] = _STATUS_BY_NAME[failure]
+                    continue
+                try:
+                    trip = self.schedule.GetTrip(rec.trip_id)
+                except KeyError:
+                    self._fail(i, STATUS_FAULTY_TRIP)
+                    continue
+                try:
+                    trip_times = build_trip_times(self.geometry_cache, trip, TripState.STOP_ERROR, scan)
+                except StopFarFromPolylineException:
+                    self._fail(i, STATUS_STOPS_UNREACHABLE, trip.shape_id)
+                    continue
+                self._costs[i] = time.time() - started
+            self.trip_times[i] = trip_times
+            self._scans[i] = scan
+
+    def _fail(self, i, status, shape_id=None):
+        """"Marks a trip that can't be projected in any snapshot, it's skipped until its failure expires."""
+        self.status[i] = status
+        self.geometry_cache.failures.add(self.trip_ids[i], STATUS_NAMES[status], shape_id)
+
+    def _get_shape_groups(self):
+        groups = {}
+        for i, trip_times in enumerate(self.trip_times):
+            if trip_times is not None:
+                groups.setdefault(trip_times.pattern.shape_id, []).append(i)
+        return groups
+
+    def _project_vectorized(self):
+        for shape_id, rows in self._get_shape_groups().items():
+            started = time.time()
+            geometry = self.trip_times[rows[0]].pattern.geometry
+            hinted = [i for i in rows if self.last_segments[i] is not None]
+            windows = [get_search_window(geometry, self.last_segments[i], TripState.WINDOW_BEHIND,
+                                         TripState.WINDOW_AHEAD) for i in hinted]
+            found = self._project_rows(geometry, hinted, [w[0] for w in windows], [w[1] for w in windows])
+            self._project_rows(geometry, [i for i in rows if i not in found])
+            self._costs[rows] += (time.time() - started) / len(rows)
+
+    def _project_rows(self, geometry, rows, first_segments=None, last_segments=None):
+        """"Projects vehicles of the rows on the geometry and returns a set of rows where the vehicle was found. With
+            first_segments and last_segments the search is limited to these windows and vehicles found out of their
+            next stop range are not accepted, as in TripState._find_vehicle."""
+        if not rows:
+            return set()
+        ranges = [self.trip_times[i].pattern.get_distance_range(self.records[i].stop_id) for i in rows]
+        index = geometry.get_index()
+        segments = set()
+        for i in rows:
+            segments.update(index.query(self.vehicles[i], TripState.VEHICLE_ERROR))
+        distance, error, segment = projection.project_points(
+            geometry.get_arrays(), projection.to_vectors([self.vehicles[i] for i in rows]), TripState.VEHICLE_ERROR,
+            [rng[0] for rng in ranges], [rng[1] for rng in ranges], first_segments, sorted(segments), last_segments)
+        windowed = first_segments is not None
+        found = set()
+        for i, rng, segment_indx in zip(rows, ranges, segment):
+            if segment_indx < 0:
+                self.status[i] = STATUS_OUT_OF_POLYLINE
+                continue
+            distance, error = locate_on_segment(geometry, self.vehicles[i], segment_indx)
+            if windowed and self.trip_times[i].pattern.get_stop_idx(self.records[i].stop_id) is not None and \
+                    not rng[0] < distance <= rng[1]:
+                continue
+            self.status[i] = STATUS_OK
+            self.distance[i], self.error[i], self.segment[i] = distance, error, segment_indx
+            found.add(i)
+        return found
+
+    def _project_by_trip_state(self):
+        for i, trip_times in enumerate(self.trip_times):
+            if trip_times is None:
+                continue
+            started = time.time()
+            try:
+                trip_state = TripState(self.schedule.GetTrip(self.trip_ids[i]), self.vehicles[i],
+                                       self.records[i].stop_id, self.last_segments[i],
+                                       geometry_cache=self.geometry_cache, engine=self.engine, profile=False)
+            except VehicleOutOfPolylineException:
+                self.status[i] = STATUS_OUT_OF_POLYLINE
+                continue
+            finally:
+                self._costs[i] += time.time() - started
+            self.distance[i], self.error[i] = trip_state.distance, trip_state.error
+            self.segment[i] = trip_state.segment_indx
+
+    def _record_costs(self, constructions):
+        for i, trip_times in enumerate(self.trip_times):
+            if trip_times is not None:
+                pattern = trip_times.pattern
+                constructions.add(self._costs[i], self.trip_ids[i], pattern.shape_id,
+                                  pattern.geometry.get_num_points(), len(pattern), self._scans[i]['scanned'],
+                                  self._scans[i]['fallback'])
+
+    def _calculate_progress(self):
+        count = len(self.records)
+        found = self.status == STATUS_OK
+        rows = np.flatnonzero(found)
+        num_stops = np.zeros(count, dtype=np.int64)
+        max_stops = max([len(self.trip_times[i].pattern) for i in rows] or [1])
+        stop_distances = np.full((count, max_stops), np.inf)
+        arrival = np.full((count, max_stops), np.nan)
+        departure = np.full((count, max_stops), np.nan)
+        end_stops = np.zeros((count, 3))
+        for i in rows:
+            trip_times = self.trip_times[i]
+            pattern = trip_times.pattern
+            num_stops[i] = len(pattern)
+            stop_distances[i, :num_stops[i]] = pattern.distances
+            arrival[i, :num_stops[i]] = trip_times.get_arrival()
+            departure[i, :num_stops[i]] = trip_times.get_departure()
+            end_stops[i] = (pattern.end_stop.x, pattern.end_stop.y, pattern.end_stop.z)
+            self.trip_len[i] = pattern.geometry.length
+
+        # the same as TripState._find_previous_stop_indx for non decreasing stop distances
+        with np.errstate(invalid='ignore'):
+            prev_stop_indx = (stop_distances <= self.distance[:, np.newaxis]).sum(axis=1) - 1
+        is_last = found & (prev_stop_indx == num_stops - 1)
+        before_first = found & (prev_stop_indx == -1)
+        in_between = found & ~is_last & ~before_first
+
+        all_rows = np.arange(count)
+        prev_col = np.clip(prev_stop_indx, 0, max_stops - 1)
+        next_col = np.clip(prev_stop_indx + 1, 0, max_stops - 1)
+        last_col = np.clip(num_stops - 1, 0, max_stops - 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stop_interval = stop_distances[all_rows, next_col] - stop_distances[all_rows, prev_col]
+            dist_to_prev_stop = self.distance - stop_distances[all_rows, prev_col]
+            stop_fraction = dist_to_prev_stop / stop_interval
+            first_stop = stop_distances[:, 0]
+            trip_progress = (self.distance - first_stop) / (self.trip_len - first_stop)
+            prev_departure = departure[all_rows, prev_col]
+            estimated = prev_departure + (arrival[all_rows, next_col] - prev_departure) * stop_fraction
+
+        self.prev_stop_seq = np.where(found, prev_stop_indx + 1, -1)
+        self.stop_progress = np.where(in_between, stop_fraction, np.where(found, 0, np.nan))
+        self.progress = np.where(is_last, 1, np.where(before_first, 0, np.where(found, trip_progress, np.nan)))
+        self.estimated_time = np.where(is_last, arrival[all_rows, last_col],
+                                       np.where(before_first, 0, np.where(found, estimated, np.nan)))
+        vectors = projection.to_vectors(self.vehicles) if count else np.zeros((0, 3))
+        self.distance_to_end_stop = np.where(
+            found, projection.get_angle(vectors, end_stops) * projection.EARTH_RADIUS_METERS, np.nan)
+
+    def get_avrg_speed(self, duration_sec, progress):
+        return get_avrg_speed(self.trip_len, duration_sec, progress)
+
+    def get_columns(self):
+        return dict((name, getattr(self, name)) for name in RESULT_COLUMNS)
+
+
+class BatchResult:
+    """"TripStateBatch results computed elsewhere, e.g. by worker processes, with the attributes used by
+        filter_updates and process_feed."""
+
+    def __init__(self, records, columns):
+        self.records = records
+        self.trip_ids = [rec.trip_id for rec in records]
+        self.route_ids = [rec.route_id for rec in records]
+        self.timestamps = np.array([rec.timestamp for rec in records], dtype=np.int64)
+        for name in RESULT_COLUMNS:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.records)
+
+    def get_avrg_speed(self, duration_sec, progress):
+        return get_avrg_speed(self.trip_len, duration_sec, progress)
+
+
+def empty_columns(count):
+    """"Result columns for count vehicles with no projection."""
+    columns = dict((name, np.full(count, np.nan)) for name in RESULT_COLUMNS)
+    columns['status'] = np.zeros(count, dtype=np.int8)
+    columns['segment'] = np.full(count, -1, dtype=np.int64)
+    columns['prev_stop_seq'] = np.full(count, -1, dtype=np.int64)
+    return columns
+
+
+def get_avrg_speed(trip_len, duration_sec, progress):
+    """"Vectorized TripState.get_avrg_speed, km/h."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        speed = np.where(duration_sec > 0, progress * trip_len / duration_sec, 0)
+    return speed * 3.6
@@ -1,55 +1,67 @@
-from transitfeed import Poly
 from transitfeed import Point
 from transitfeed import GetClosestPoint
+from geometrycache import GeometryCache
+from stoppattern import StopPattern, TripTimes
+import bisect
+import projection
+import time
+
+ENGINE_PYTHON = 'python'
+ENGINE_NUMPY = 'numpy'
+ENGINES = (ENGINE_PYTHON, ENGINE_NUMPY)
+# reason of (shape_id, stop_ids) entries in GeometryCache.failures
+PATTERN_UNREACHABLE = 'pattern_unreachable'
 
 
 class TripState:
     STOP_ERROR = 30
     VEHICLE_ERROR = 100
-
-    def __init__(self, trip, vehicle_point, next_stop_id, last_known = 0):
+    WINDOW_BEHIND = 200
+    WINDOW_AHEAD = 3000
+    GEOMETRY_CACHE = GeometryCache()
+    ENGINE = ENGINE_PYTHON
+    CONSTRUCTIONS = None  # profiler.ConstructionLog recording the cost of every vehicle projection
+
+    def __init__(self, trip, vehicle_point, next_stop_id, last_known = None, geometry_cache = None, engine = None,
+                 profile = True):
+        """"last_known is the segment index the vehicle was matched to last time. The vehicle is looked for around
+            it first and on the whole shape only if it isn't found there. With profile the cost of the construction
+            is added to CONSTRUCTIONS, TripStateBatch turns it off as it records its rows itself."""
+        started = time.time()
         self.trip = trip
         self.vehicle = vehicle_point
+        self.engine = engine or self.ENGINE
         self.next_stop_id = next_stop_id
         self.calculated_length = None
-        self.shape = trip._schedule.GetShape(trip.shape_id)
-        self.poly = Poly()
-        for pt in self.shape.points:
-            self.poly.AddPoint(Point.FromLatLng(pt[0], pt[1]))
-        self.poly.distance = [self.poly.GetPoint(i-1).GetDistanceMeters(self.poly.GetPoint(i))
-                              for i in range(1, len(self.poly.GetPoints()))]
-
-        self._stop_times = trip.GetTimeStops()
-        self._stop_distances = [None for i in range(len(self._stop_times))]
-
-        if not self._scan_for_stops(self.STOP_ERROR) and not self._scan_for_stops(self.STOP_ERROR*3):
-            raise StopFarFromPolylineException()
-
-        self.next_stop_idx = self._get_next_stop_idx()
-        if not self._find_vehicle(last_known):
-            raise VehicleOutOfPolylineException()
-
-        self._find_previous_stop_indx()
-        self._calculate_distances()
+        self.geometry_cache = geometry_cache if geometry_cache is not None else self.GEOMETRY_CACHE
+        scan = {}
+        self.trip_times = get_trip_times(self.geometry_cache, trip, self.STOP_ERROR, scan)
+        self.pattern = self.trip_times.pattern
+        self.geometry = self.pattern.geometry
+        self.poly = self.geometry.poly
+        self._stop_distances = self.pattern.distances
+
+        try:
+            self.next_stop_idx = self._get_next_stop_idx()
+            if not self._find_vehicle(last_known):
+                raise VehicleOutOfPolylineException()
+
+            self._find_previous_stop_indx()
+            self._calculate_distances()
+        finally:
+            if profile and self.CONSTRUCTIONS is not None:
+                self.CONSTRUCTIONS.add(time.time() - started, trip.trip_id, trip.shape_id,
+                                       self.geometry.get_num_points(), len(self.pattern), scan['scanned'],
+                                       scan['fallback'])
 
     def _get_next_stop_idx(self):
-        if self.next_stop_id:
-            for st_indx, st_time in enumerate(self._stop_times):
-                if st_time[2].stop_id == self.next_stop_id:
-                    return st_indx
-        return None
+        return self.pattern.get_stop_idx(self.next_stop_id)
 
     def _get_distance_range(self):
-        if self.next_stop_idx is not None:
-            if self.next_stop_idx == 0:
-                return 0, self._stop_distances[0]
-            else:
-                return self._stop_distances[self.next_stop_idx - 1], self._stop_distances[self.next_stop_idx]
-        return -0.1, float("inf")
+        return self.pattern.get_distance_range(self.next_stop_id)
 
     def get_distance_to_end_stop(self):
-        end_stop = Point.FromLatLng(self._stop_times[-1][2].stop_lat, self._stop_times[-1][2].stop_lon)
-        return self.vehicle.GetDistanceMeters(end_stop)
+        return self.vehicle.GetDistanceMeters(self.pattern.end_stop)
 
     def get_avrg_speed(self, duration_sec, progress):
         """"Get average speed in km/h for time interval."""
@@ -60,58 +72,32 @@ class TripState:
         return speed * 3.6
 
     def _is_last_stop(self):
-        return self.prev_stop_indx == len(self._stop_times) - 1
+        return self.prev_stop_indx == len(self.pattern) - 1
 
-    def _find_vehicle(self, start_pt_indx):
+    def _find_vehicle(self, last_segment):
         min_distance, max_distance = self._get_distance_range()
-        self.distance = None
-        restricted_distance = None
-        accum_distance = 0
-        for i in range(start_pt_indx, len(self.poly.GetPoints()) - 1):
-            pt_a, pt_b = self.poly.GetPoint(i), self.poly.GetPoint(i + 1)
-            cur_segment_len = self.poly.distance[i]
-
-            dist_to_vehicle = pt_a.GetDistanceMeters(self.vehicle)
-            res = reach_to_point(self.vehicle, pt_a, pt_b, dist_to_vehicle, cur_segment_len, self.VEHICLE_ERROR)
-            if res:
-                pt_on_shape = res[0]
-                distance = accum_distance + pt_a.GetDistanceMeters(pt_on_shape)
-                if self.distance is None or self.distance is not None and self.error > res[1]:
-                    self.distance = distance
-                    self.error = res[1]
-                if min_distance < distance <= max_distance and (restricted_distance is None or restricted_distance is not None and restricted_dist_err > res[1]):
-                    restricted_distance = distance
-                    restricted_dist_err = res[1]
-            accum_distance += cur_segment_len
-
-        if restricted_distance is not None:
-            self.distance = restricted_distance
-            self.error = restricted_dist_err
-
-        return self.distance is not None
-
-    def _scan_for_stops(self, STOP_ERROR):
-        """"This is necessary, because shape_dist_traveled column is not reliable."""
-        current_stop_index = 0
-        accum_distance = 0
-        for i in range(len(self.poly.GetPoints()) - 1):
-            pt_a, pt_b = self.poly.GetPoint(i), self.poly.GetPoint(i + 1)
-            cur_segment_len = self.poly.distance[i]
-
-            while current_stop_index < len(self._stop_times):
-                stop = Point.FromLatLng(self._stop_times[current_stop_index][2].stop_lat, self._stop_times[current_stop_index][2].stop_lon)
-                dist_to_stop = pt_a.GetDistanceMeters(stop)
-                res = reach_to_point(stop, pt_a, pt_b, dist_to_stop, cur_segment_len, STOP_ERROR)
-                if res:
-                    pt_on_shape = res[0]
-                    self._stop_distances[current_stop_index] = accum_distance + pt_a.GetDistanceMeters(pt_on_shape)
-                    current_stop_index += 1
-                else:
-                    break
-            if current_stop_index == len(self._stop_times):
-                break
-            accum_distance += cur_segment_len
-        return current_stop_index == len(self._stop_times)
+        segments = self.geometry.get_index().query(self.vehicle, self.VEHICLE_ERROR)
+        res = None
+        if last_segment is not None:
+            first, last = get_search_window(self.geometry, last_segment, self.WINDOW_BEHIND, self.WINDOW_AHEAD)
+            res = self._project([i for i in segments if first <= i <= last], min_distance, max_distance)
+            if res is not None and self.next_stop_idx is not None and not min_distance < res[0] <= max_distance:
+                res = None
+        self.found_in_window = res is not None
+        if res is None:
+            res = self._project(segments, min_distance, max_distance)
+        if res is None:
+            self.distance = None
+            return False
+        self.distance, self.error, self.segment_indx = res
+        return True
+
+    def _project(self, segments, min_distance, max_distance):
+        if self.engine == ENGINE_NUMPY:
+            return project_on_shape_vectorized(self.geometry, self.vehicle, self.VEHICLE_ERROR, min_distance,
+                                               max_distance, segments=segments)
+        return project_on_shape(self.geometry, self.vehicle, self.VEHICLE_ERROR, min_distance, max_distance,
+                                segments=segments)
 
     def get_stop_progress(self):
         if self.prev_stop_indx == -1 or self._is_last_stop():
@@ -119,18 +105,15 @@ class TripState:
         return self.dist_to_prev_stop / self.stop_interval
 
     def debug_error(self):
-        pt, segment_indx = self.poly.GetClosestPoint(self.vehicle)
-        distance = 0
-        for i in range(0, segment_indx):
-            distance += self.poly._points[i].GetDistanceMeters(self.poly._points[i + 1])
-        distance += self.poly._points[segment_indx].GetDistanceMeters(pt)
+        pt, segment_indx = get_closest_point(self.geometry, self.vehicle, self.VEHICLE_ERROR)
+        distance = self.geometry.cumulative[segment_indx] + self.poly._points[segment_indx].GetDistanceMeters(pt)
         return pt.GetDistanceMeters(self.vehicle), distance
 
     def debug_stop_distances(self):
-        stop_coords = [Point.FromLatLng(self._stop_times[i][2].stop_lat, self._stop_times[i][2].stop_lon) for i in range(len(self._stop_times))]
+        stop_coords = [Point.FromLatLng(st_time[2].stop_lat, st_time[2].stop_lon) for st_time in self.trip.GetTimeStops()]
         errors = []
         for stop in stop_coords:
-            pt, i = self.poly.GetClosestPoint(stop)
+            pt, i = get_closest_point(self.geometry, stop, self.STOP_ERROR)
             errors.append(pt.GetDistanceMeters(stop))
         return errors
 
@@ -139,7 +122,7 @@ class TripState:
 
     def get_trip_len(self):
         if self.calculated_length is None:
-            self.calculated_length = sum(self.poly.distance)
+            self.calculated_length = self.geometry.length
         return self.calculated_length
 
     def get_trip_progress(self):
@@ -153,15 +136,7 @@ class TripState:
             return distance / shape_len
 
     def _find_previous_stop_indx(self):
-        if self.distance >= self._stop_distances[-1]:
-            self.prev_stop_indx = len(self._stop_distances) - 1
-        elif self.distance < self._stop_distances[0]:
-            self.prev_stop_indx = -1
-
-        for i in range(len(self._stop_distances) - 1):
-            if self._stop_distances[i] <= self.distance < self._stop_distances[i+1]:
-                self.prev_stop_indx = i
-                break
+        self.prev_stop_indx = self.pattern.get_prev_stop_idx(self.distance)
 
     def _calculate_distances(self):
         if self.prev_stop_indx == -1:
@@ -177,20 +152,154 @@ class TripState:
         """"Gets a time corresponding to current vehicle position for this trip. If for example our vehicle is between
             two stops, it should estimate it like stop1.departureTime + duration_betwen_stops * traveled_fraction.
             A time is measured in seconds from midnight"""
-        if self.prev_stop_indx == -1:
-            return 0
-
-        if self._is_last_stop():
-            return self._stop_times[-1][0]
-
-        prev_dep = self._stop_times[self.prev_stop_indx][1]
-        duration = self._stop_times[self.prev_stop_indx + 1][0] - prev_dep
-        return prev_dep + duration * (self.dist_to_prev_stop / self.stop_interval)
+        return self.trip_times.get_scheduled_time(self.distance, self.prev_stop_indx)
 
     def get_prev_stop_seq(self):
         return self.prev_stop_indx + 1
 
 
+def get_trip_times(geometry_cache, trip, stop_error, scan=None):
+    """"Returns TripTimes of the trip stored in geometry_cache, building them on the first use."""
+    trip_times = geometry_cache.get_trip_times(trip.trip_id)
+    if trip_times is None:
+        return build_trip_times(geometry_cache, trip, stop_error, scan)
+    if scan is not None:
+        scan['scanned'], scan['fallback'] = False, trip_times.pattern.fallback
+    return trip_times
+
+
+def build_trip_times(geometry_cache, trip, stop_error, scan=None):
+    """"Reads the stop times of the trip once and stores them in geometry_cache as TripTimes of its stop pattern."""
+    geometry = geometry_cache.get_shape(trip._schedule, trip.shape_id)
+    stop_times = trip.GetTimeStops()
+    pattern = get_stop_pattern(geometry_cache, geometry, stop_times, stop_error, scan)
+    trip_times = TripTimes(trip.trip_id, pattern, stop_times)
+    geometry_cache.add_trip_times(trip_times)
+    return trip_times
+
+
+def get_stop_pattern(geometry_cache, geometry, stop_times, stop_error, scan=None):
+    """"Returns the StopPattern of the stop sequence on the shape, scanning for the distances of its stops with 3 times
+        bigger tolerance if some stop is not reachable. Patterns are stored in geometry_cache and shared by all trips
+        with the same shape and stops. The scan dict, when given, gets 'scanned' and 'fallback' flags telling whether
+        the stops were snapped now and needed the bigger tolerance, the latter also for a pattern snapped before.
+        A sequence that can't be snapped is remembered in geometry_cache.failures under the pattern key, so other
+        trips with the same stops fail without a scan."""
+    scanned = fallback = False
+    stop_ids = [st_time[2].stop_id for st_time in stop_times]
+    pattern = geometry_cache.get_pattern(geometry.shape_id, stop_ids)
+    if pattern is None:
+        key = (geometry.shape_id, tuple(stop_ids))
+        if geometry_cache.failures.get(key) is not None:
+            if scan is not None:
+                scan['scanned'], scan['fallback'] = scanned, fallback
+            raise StopFarFromPolylineException()
+        scanned = True
+        stop_distances = scan_for_stops(geometry, stop_times, stop_error)
+        if stop_distances is None:
+            fallback = True
+            stop_distances = scan_for_stops(geometry, stop_times, stop_error * 3)
+        if stop_distances is None:
+            geometry_cache.failures.add(key, PATTERN_UNREACHABLE, len(stop_ids))
+            if scan is not None:
+                scan['scanned'], scan['fallback'] = scanned, fallback
+            raise StopFarFromPolylineException()
+        end_stop = stop_times[-1][2]
+        pattern = StopPattern(geometry, stop_ids, stop_distances, Point.FromLatLng(end_stop.stop_lat, end_stop.stop_lon),
+                              fallback)
+        geometry_cache.add_pattern(pattern)
+    if scan is not None:
+        scan['scanned'], scan['fallback'] = scanned, pattern.fallback
+    return pattern
+
+
+def scan_for_stops(geometry, stop_times, stop_error):
+    """"This is necessary, because shape_dist_traveled column is not reliable. Returns None if some stop is farther
+        than stop_error from the shape.
+        Every stop is snapped to the first segment after the previous stop's one that reaches it, only segments
+        returned by the shape index are tried."""
+    poly = geometry.poly
+    index = geometry.get_index()
+    stop_distances = []
+    start_segment = 0
+    for st_time in stop_times:
+        stop = Point.FromLatLng(st_time[2].stop_lat, st_time[2].stop_lon)
+        for i in index.query(stop, stop_error):
+            if i < start_segment:
+                continue
+            pt_a = poly.GetPoint(i)
+            res = reach_to_point(stop, pt_a, poly.GetPoint(i + 1), pt_a.GetDistanceMeters(stop), poly.distance[i],
+                                 stop_error)
+            if res:
+                stop_distances.append(geometry.cumulative[i] + pt_a.GetDistanceMeters(res[0]))
+                start_segment = i
+                break
+        else:
+            return None
+    return stop_distances
+
+
+def project_on_shape(geometry, pt_x, allowed_error, min_distance, max_distance, start_segment=0, segments=None):
+    """"Returns tuple (distance, error, segment) for the closest segment that reaches pt_x within
+        (min_distance, max_distance] or, if there is no such one, the closest on the whole shape. Returns None if pt_x
+        is farther than allowed_error from all segments. segments limits the search to given sorted segment indexes."""
+    poly = geometry.poly
+    if segments is None:
+        segments = range(len(poly.distance))
+    best = restricted = None
+    for i in segments:
+        if i < start_segment:
+            continue
+        pt_a, pt_b = poly.GetPoint(i), poly.GetPoint(i + 1)
+        res = reach_to_point(pt_x, pt_a, pt_b, pt_a.GetDistanceMeters(pt_x), poly.distance[i], allowed_error)
+        if res:
+            distance = geometry.cumulative[i] + pt_a.GetDistanceMeters(res[0])
+            if best is None or best[1] > res[1]:
+                best = distance, res[1], i
+            if min_distance < distance <= max_distance and (restricted is None or restricted[1] > res[1]):
+                restricted = distance, res[1], i
+    return restricted if restricted is not None else best
+
+
+def project_on_shape_vectorized(geometry, pt_x, allowed_error, min_distance, max_distance, start_segment=0,
+                                segments=None):
+    """"The numpy engine counterpart of project_on_shape."""
+    distance, error, segment = projection.project_points(
+        geometry.get_arrays(), projection.to_vectors([pt_x]), allowed_error, min_distance, max_distance,
+        start_segment, segments)
+    if segment[0] < 0:
+        return None
+    distance, error = locate_on_segment(geometry, pt_x, segment[0])
+    return distance, error, int(segment[0])
+
+
+def get_search_window(geometry, last_segment, behind, ahead):
+    """"Returns (first, last) indexes of segments that are at most behind meters before or ahead meters after
+        last_segment along the shape."""
+    cumulative = geometry.cumulative
+    if len(cumulative) < 2:
+        return 0, -1
+    last_segment = min(max(last_segment, 0), len(cumulative) - 2)
+    first = bisect.bisect_left(cumulative, cumulative[last_segment] - behind) - 1
+    last = bisect.bisect_right(cumulative, cumulative[last_segment + 1] + ahead) - 1
+    return max(first, 0), min(last, len(cumulative) - 2)
+
+
+def get_closest_point(geometry, pt_x, radius):
+    """"The same as Poly.GetClosestPoint, but only segments from the shape index are checked when some of them is
+        within radius."""
+    poly = geometry.poly
+    closest_point = closest_i = None
+    for i in geometry.get_index().query(pt_x, radius):
+        cur_closest_point = GetClosestPoint(pt_x, poly.GetPoint(i), poly.GetPoint(i + 1))
+        if closest_point is None or pt_x.Angle(cur_closest_point) < pt_x.Angle(closest_point):
+            closest_point = cur_closest_point.Normalize()
+            closest_i = i
+    if closest_point is None or closest_point.GetDistanceMeters(pt_x) > radius:
+        return poly.GetClosestPoint(pt_x)
+    return closest_point, closest_i
+
+
 def reach_to_point(pt_x, pt_a, pt_b, a_x_len, a_b_len, allowed_error):
     """"Returns tuple(pt, error) if (pt_a, pt_b) segment approaches pt_x to at least allowed_error distance"""
     MAPPING_ERROR = 10
@@ -202,6 +311,14 @@ def reach_to_point(pt_x, pt_a, pt_b, a_x_len, a_b_len, allowed_error):
     return tuple()
 
 
+def locate_on_segment(geometry, pt_x, segment_indx):
+    """"Returns (distance along the shape, error) of pt_x projected on a segment. It is used to recompute a segment
+        picked by the numpy engine with the same arithmetic as the stop distances, so both agree at stop boundaries."""
+    pt_a, pt_b = geometry.poly.GetPoint(segment_indx), geometry.poly.GetPoint(segment_indx + 1)
+    pt = GetClosestPoint(pt_x, pt_a, pt_b)
+    return geometry.cumulative[segment_indx] + pt_a.GetDistanceMeters(pt), pt.GetDistanceMeters(pt_x)
+
+
 class VehicleOutOfPolylineException(Exception): pass
 
 class StopFarFromPolylineException(Exception): pass
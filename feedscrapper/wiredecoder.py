@@ -0,0 +1,225 @@
+from google.protobuf.message import DecodeError
+from google.transit import gtfs_realtime_pb2
+from tripbatch import VehicleRecord, get_vehicle_records
+import logging
+import struct
+
+# field numbers from gtfs-realtime.proto
+FEED_HEADER = 1
+FEED_ENTITY = 2
+HEADER_TIMESTAMP = 3
+ENTITY_VEHICLE = 4
+VEHICLE_TRIP = 1
+VEHICLE_POSITION = 2
+VEHICLE_TIMESTAMP = 5
+VEHICLE_STOP_ID = 7
+TRIP_TRIP_ID = 1
+TRIP_ROUTE_ID = 5
+POSITION_LATITUDE = 1
+POSITION_LONGITUDE = 2
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH = 2
+WIRE_FIXED32 = 5
+
+DECODER_FULL = 'full'
+DECODER_FAST = 'fast'
+DECODER_VALIDATE = 'validate'
+DECODERS = (DECODER_FULL, DECODER_FAST, DECODER_VALIDATE)
+
+_FLOAT = struct.Struct('<f')
+
+
+class DecodedFeed:
+    """"Result of decode_feed: the header timestamp and a VehicleRecord for every entity with a vehicle. It can be
+        passed to process_feed in place of a FeedMessage."""
+
+    def __init__(self, timestamp, records):
+        self.header = FeedHeader(timestamp)
+        self.records = records
+
+
+class FeedHeader:
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+
+
+def decode_feed(data):
+    """"Reads only header.timestamp and the VehiclePosition fields of VehicleRecord straight from the protobuf wire
+        format. Trip updates, alerts and other fields are skipped by their length without being decoded.
+        Raises DecodeError for malformed input."""
+    data = bytearray(data)
+    timestamp = 0
+    records = []
+    pos, end = 0, len(data)
+    try:
+        while pos < end:
+            field, wire_type, pos = _read_tag(data, pos)
+            if wire_type == WIRE_LENGTH:
+                length, pos = _read_varint(data, pos)
+                if field == FEED_ENTITY:
+                    vehicle = _find_vehicle(data, pos, pos + length)
+                    if vehicle is not None:
+                        records.append(vehicle)
+                elif field == FEED_HEADER:
+                    timestamp = _decode_header(data, pos, pos + length, timestamp)
+                pos += length
+            else:
+                pos = _skip(data, pos, wire_type)
+    except IndexError:
+        raise DecodeError("Truncated message")
+    if pos != end:
+        raise DecodeError("Truncated message")
+    return DecodedFeed(timestamp, records)
+
+
+def parse_feed(data, decoder=DECODER_FULL):
+    """"Returns a FeedMessage for the full decoder, DecodedFeed for the fast one. The validate decoder runs both, logs
+        differences and returns the FeedMessage."""
+    if decoder == DECODER_FAST:
+        return decode_feed(data)
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(data)
+    if decoder == DECODER_VALIDATE:
+        differences = compare_records(get_vehicle_records(feed), decode_feed(data).records)
+        if differences:
+            logging.error("Fast decoder differs from the full parse in {} records, first {}".format(
+                len(differences), differences[0]))
+    return feed
+
+
+def compare_records(expected, actual):
+    """"Returns pairs of records which differ, a missing record is None."""
+    differences = [(exp, act) for exp, act in zip(expected, actual) if exp != act]
+    for i in range(min(len(expected), len(actual)), max(len(expected), len(actual))):
+        differences.append((expected[i] if i < len(expected) else None, actual[i] if i < len(actual) else None))
+    return differences
+
+
+def _find_vehicle(data, pos, end):
+    vehicle = None
+    while pos < end:
+        field, wire_type, pos = _read_tag(data, pos)
+        if wire_type == WIRE_LENGTH:
+            length, pos = _read_varint(data, pos)
+            if field == ENTITY_VEHICLE:
+                vehicle = _decode_vehicle(data, pos, pos + length, vehicle)
+            pos += length
+        else:
+            pos = _skip(data, pos, wire_type)
+    _check_end(pos, end)
+    return VehicleRecord(*vehicle) if vehicle is not None else None
+
+
+def _decode_header(data, pos, end, timestamp):
+    while pos < end:
+        field, wire_type, pos = _read_tag(data, pos)
+        if field == HEADER_TIMESTAMP and wire_type == WIRE_VARINT:
+            timestamp, pos = _read_varint(data, pos)
+        else:
+            pos = _skip(data, pos, wire_type)
+    _check_end(pos, end)
+    return timestamp
+
+
+def _decode_vehicle(data, pos, end, vehicle):
+    """"Merges the message into vehicle, a list in the order of VehicleRecord fields, as protobuf merges repeated
+        occurrences of a message field."""
+    if vehicle is None:
+        vehicle = [u'', u'', u'', 0.0, 0.0, 0]
+    while pos < end:
+        field, wire_type, pos = _read_tag(data, pos)
+        if wire_type == WIRE_LENGTH:
+            length, pos = _read_varint(data, pos)
+            if field == VEHICLE_TRIP:
+                _decode_trip(data, pos, pos + length, vehicle)
+            elif field == VEHICLE_POSITION:
+                _decode_position(data, pos, pos + length, vehicle)
+            elif field == VEHICLE_STOP_ID:
+                vehicle[2] = _read_string(data, pos, pos + length)
+            pos += length
+        elif field == VEHICLE_TIMESTAMP and wire_type == WIRE_VARINT:
+            vehicle[5], pos = _read_varint(data, pos)
+        else:
+            pos = _skip(data, pos, wire_type)
+    _check_end(pos, end)
+    return vehicle
+
+
+def _decode_trip(data, pos, end, vehicle):
+    while pos < end:
+        field, wire_type, pos = _read_tag(data, pos)
+        if wire_type == WIRE_LENGTH:
+            length, pos = _read_varint(data, pos)
+            if field == TRIP_TRIP_ID:
+                vehicle[0] = _read_string(data, pos, pos + length)
+            elif field == TRIP_ROUTE_ID:
+                vehicle[1] = _read_string(data, pos, pos + length)
+            pos += length
+        else:
+            pos = _skip(data, pos, wire_type)
+    _check_end(pos, end)
+
+
+def _decode_position(data, pos, end, vehicle):
+    while pos < end:
+        field, wire_type, pos = _read_tag(data, pos)
+        if wire_type == WIRE_FIXED32 and field in (POSITION_LATITUDE, POSITION_LONGITUDE):
+            vehicle[2 + field] = _FLOAT.unpack_from(data, pos)[0]
+            pos += 4
+        else:
+            pos = _skip(data, pos, wire_type)
+    _check_end(pos, end)
+
+
+def _read_tag(data, pos):
+    tag = data[pos]
+    if tag < 0x80:
+        return tag >> 3, tag & 7, pos + 1
+    tag, pos = _read_varint(data, pos)
+    return tag >> 3, tag & 7, pos
+
+
+def _read_varint(data, pos):
+    result = data[pos]
+    if result < 0x80:
+        return result, pos + 1
+    result &= 0x7f
+    shift = 7
+    while True:
+        pos += 1
+        byte = data[pos]
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos + 1
+        shift += 7
+        if shift > 63:
+            raise DecodeError("Too long varint")
+
+
+def _read_string(data, pos, end):
+    if end > len(data):
+        raise DecodeError("Truncated message")
+    try:
+        return data[pos:end].decode('utf-8')
+    except UnicodeDecodeError:
+        raise DecodeError("Invalid utf-8 string")
+
+
+def _skip(data, pos, wire_type):
+    if wire_type == WIRE_VARINT:
+        return _read_varint(data, pos)[1]
+    if wire_type == WIRE_LENGTH:
+        length, pos = _read_varint(data, pos)
+        return pos + length
+    if wire_type == WIRE_FIXED64:
+        return pos + 8
+    if wire_type == WIRE_FIXED32:
+        return pos + 4
+    raise DecodeError("Unsupported wire type {}".format(wire_type))
+
+
+def _check_end(pos, end):
+    if pos != end:
+        raise DecodeError("Field crosses message end")